@@ -0,0 +1,167 @@
+from Constants import *
+from Instance import *
+from Utilities import *
+
+#Instance channels, applied to the object in this order (scale first, translate last)
+TRANSFORM_CHANNELS = ("scale", "rotateX", "rotateY", "rotateZ", "translate")
+
+
+class Track:
+    def __init__(self):
+        """
+        Keyframes of one animated value, linearly interpolated between keys
+
+        Attributes:
+            times: frame of every key, sorted
+            values: value at every key, a number or a tuple of numbers
+        """
+        self.times = []
+        self.values = []
+
+    def key(self, frame, value):
+        if not isinstance(value, (int, float)):
+            value = tuple(float(x) for x in value)
+        i = 0
+        while i < len(self.times) and self.times[i] < frame:
+            i += 1
+        if i < len(self.times) and self.times[i] == frame:
+            self.values[i] = value
+        else:
+            self.times.insert(i, frame)
+            self.values.insert(i, value)
+
+    #Value at frame, held at the first and last keys outside of them
+    def value(self, frame):
+        times = self.times
+        if frame <= times[0]:
+            return self.values[0]
+        if frame >= times[-1]:
+            return self.values[-1]
+        i = 1
+        while times[i] < frame:
+            i += 1
+        a = self.values[i - 1]
+        b = self.values[i]
+        f = (frame - times[i - 1]) / (times[i] - times[i - 1])
+        if isinstance(a, tuple):
+            return tuple(x + (y - x)*f for x, y in zip(a, b))
+        return a + (b - a)*f
+
+
+class Animation:
+    def __init__(self, world):
+        """
+        Keyframed changes to the objects (and materials or lights) of a world
+
+        Instances can key the channels translate, scale (3 values) and rotateX/Y/Z
+        (radians). They move the instance after the transforms it already has, so an
+        instance placed with translate can still be animated around the world origin.
+        Any other channel is an attribute set on the object (on the object an Instance
+        transforms), lists become the type of the attribute they replace (Point, Vector or Color).
+
+        Nothing is rebuilt between frames: setFrame hands the moved objects to
+        World.update, which refits the acceleration structure around them.
+
+        Attributes:
+            world: the animated World
+            tracks: (object, channel) -> Track
+            base: Instance -> its (forward, inverse) matrices before any channel is applied
+            frame: frame set last (None before the first)
+        """
+        self.world = world
+        self.tracks = {}
+        self.base = {}
+        self.frame = None
+
+    def key(self, ob, channel, frame, value):
+        """ Set the value of channel of ob at frame """
+        if channel in TRANSFORM_CHANNELS:
+            if not isinstance(ob, Instance):
+                raise ValueError("{0} can only be keyed on an Instance".format(channel))
+            if ob not in self.base:
+                self.base[ob] = (ob.forward, ob.inv_matrix)
+        else:
+            #Other channels of an Instance belong to the object it transforms
+            if isinstance(ob, Instance):
+                ob = ob.o
+            if not hasattr(ob, channel):
+                raise ValueError("{0} has no attribute {1}".format(type(ob).__name__, channel))
+        track = self.tracks.get((ob, channel))
+        if track == None:
+            track = self.tracks[(ob, channel)] = Track()
+        track.key(frame, value)
+        return track
+
+    #Frames from the first key to the last one
+    def frameRange(self):
+        if not self.tracks:
+            return (0, 0)
+        return (min(t.times[0] for t in self.tracks.values()), max(t.times[-1] for t in self.tracks.values()))
+
+    def setFrame(self, frame):
+        """
+        Move everything keyed to where it is at frame and update the world's accelerator
+        Returns: what World.update did ("refit", "rebuild" or None)
+        """
+        changed = {}
+        transforms = {}
+        for (ob, channel), track in self.tracks.items():
+            value = track.value(frame)
+            if channel in TRANSFORM_CHANNELS:
+                transforms.setdefault(ob, {})[channel] = value
+            else:
+                current = getattr(ob, channel)
+                if isinstance(current, (Point, Vector, Color)):
+                    value = type(current)(*value)
+                setattr(ob, channel, value)
+                #A sphere is placed in the Octree by its position, which is its center
+                if channel == "c" and hasattr(ob, "position"):
+                    ob.position = value
+            changed[ob] = True
+
+        for ob, channels in transforms.items():
+            forward, inverse = self.base[ob]
+            ob.forward = Matrix.identity()
+            ob.inv_matrix = Matrix.identity()
+            #The last call is applied to the object first
+            for channel in reversed(TRANSFORM_CHANNELS):
+                if channel in channels:
+                    value = channels[channel]
+                    if isinstance(value, tuple):
+                        getattr(ob, channel)(*value)
+                    else:
+                        getattr(ob, channel)(value)
+            ob.forward = forward * ob.forward
+            ob.inv_matrix = ob.inv_matrix * inverse
+
+        #The accelerator holds objects an Instance transforms through the Instance,
+        #an object shared by several instances moves all of them
+        top = {}
+        for ob in self.world.objects:
+            inner = ob
+            while True:
+                top.setdefault(inner, []).append(ob)
+                if not isinstance(inner, Instance):
+                    break
+                inner = inner.o
+        moved = {}
+        for ob in changed:
+            for outer in top.get(ob, ()):
+                moved[outer] = True
+        self.frame = frame
+        return self.world.update(list(moved))
+
+
+def renderAnimation(world, animation, frames, workers = 1, tile_size = TILE_SIZE, backend = None):
+    """
+    Render frames of an animation, the world and everything loaded in it are reused
+    Takes in:
+        The world and its Animation (world, animation)
+        The frames to render (frames), e.g. range(48)
+        The renderScene arguments (workers, tile_size, backend)
+    Returns: a generator of (frame, image, RenderStats)
+    """
+    for frame in frames:
+        animation.setFrame(frame)
+        image, stats = world.renderScene(workers, tile_size, backend)
+        yield frame, image, stats
@@ -0,0 +1,316 @@
+from array import array
+import heapq
+import numpy as np
+from Utilities import *
+from Constants import *
+
+def buildArrays(lo, hi, leaf_size = BVH_LEAF_SIZE, bins = BVH_BINS):
+    """
+    Build a bounding volume hierarchy over N boxes with the binned surface area heuristic
+    Takes in:
+        (N, 3) arrays of the lower (lo) and upper (hi) corners of the boxes
+        The number of boxes a leaf should hold (leaf_size)
+        The number of bins tried per axis (bins)
+    Nodes are stored depth first, so the left child of node i is node i+1
+    Returns: the node arrays
+        bounds: 6 floats per node (lower xyz, upper xyz)
+        child: index of the right child, -1 for a leaf
+        start, count: range of order that a leaf holds
+        axis: split axis of an interior node
+        order: box indices in leaf order
+    """
+    n = lo.shape[0]
+    centers = (lo + hi) * 0.5
+    order = np.arange(n)
+    bounds = array('d')
+    child = array('i')
+    start = array('i')
+    count = array('i')
+    axis = array('b')
+
+    def node(first, last):
+        idx = order[first:last]
+        nlo = lo[idx].min(axis=0)
+        nhi = hi[idx].max(axis=0)
+        i = len(child)
+        bounds.extend(nlo.tolist())
+        bounds.extend(nhi.tolist())
+        child.append(-1)
+        start.append(first)
+        count.append(last - first)
+        axis.append(0)
+        if last - first <= leaf_size:
+            return i
+
+        split = _sahSplit(idx, lo, hi, centers, nlo, nhi, bins)
+        if split == None:
+            if last - first <= BVH_MAX_LEAF:
+                return i
+            #Everything is on one point or no split beats a leaf, halve it
+            ax = int(np.argmax(nhi - nlo))
+            idx = idx[np.argsort(centers[idx, ax], kind="stable")]
+            mid = first + (last - first) // 2
+        else:
+            ax, left = split
+            idx = np.concatenate((idx[left], idx[~left]))
+            mid = first + int(left.sum())
+        order[first:last] = idx
+
+        node(first, mid)
+        child[i] = node(mid, last)
+        count[i] = 0
+        axis[i] = ax
+        return i
+
+    if n > 0:
+        node(0, n)
+    return bounds, child, start, count, axis, order
+
+def _area(lo, hi):
+    """ Surface areas of boxes given as (..., 3) corner arrays """
+    d = hi - lo
+    return 2.0 * (d[..., 0]*d[..., 1] + d[..., 1]*d[..., 2] + d[..., 2]*d[..., 0])
+
+def _sahSplit(idx, lo, hi, centers, nlo, nhi, bins):
+    """
+    Find the cheapest binned split of the boxes idx, all three axes are binned at once
+    Returns: (axis, mask of the boxes going left) or None when a leaf is cheaper
+    """
+    n = idx.shape[0]
+    c = centers[idx]
+    cmin = c.min(axis=0)
+    cext = c.max(axis=0) - cmin
+    node_area = _area(nlo, nhi)
+    flat = cext > 0.0
+    scale = np.where(flat, bins / np.where(flat, cext, 1.0), 0.0)
+    b = ((c - cmin) * scale).astype(np.intp)
+    np.minimum(b, bins - 1, out=b)
+    #Bin of every box on each axis, axis major so the (3*bins) bins are one array
+    slot = (b + np.arange(3) * bins).T.ravel()
+    cnt = np.bincount(slot, minlength=3*bins).reshape(3, bins)
+    blo = np.full((3*bins, 3), np.inf)
+    bhi = np.full((3*bins, 3), -np.inf)
+    np.minimum.at(blo, slot, np.tile(lo[idx], (3, 1)))
+    np.maximum.at(bhi, slot, np.tile(hi[idx], (3, 1)))
+    blo = blo.reshape(3, bins, 3)
+    bhi = bhi.reshape(3, bins, 3)
+    with np.errstate(invalid="ignore"):
+        #Area and count of everything left and right of each of the bins-1 split planes
+        al = _area(np.minimum.accumulate(blo, axis=1), np.maximum.accumulate(bhi, axis=1))[:, :-1]
+        ar = _area(np.minimum.accumulate(blo[:, ::-1], axis=1), np.maximum.accumulate(bhi[:, ::-1], axis=1))[:, ::-1][:, 1:]
+        nl = np.cumsum(cnt, axis=1)[:, :-1]
+        nr = n - nl
+        cost = 1.0 + (al*nl + ar*nr) / node_area
+    cost = np.where((nl > 0) & (nr > 0) & flat[:, None], cost, np.inf)
+    ax, k = divmod(int(np.argmin(cost)), bins - 1)
+    #Cost of a leaf, relative to traversing one node
+    if not cost[ax, k] < n:
+        return None
+    return ax, b[:, ax] <= k
+
+
+class BVH:
+    def __init__(self, objects, leaf_size = BVH_LEAF_SIZE):
+        """
+        Bounding volume hierarchy over the world's objects, built from their bounding boxes
+
+        Attributes:
+            objects: bounded objects, in leaf order
+            unbounded: objects without a bbox (planes), tested by every ray
+            bounds, child, start, count, axis: node arrays (see buildArrays)
+            parent: parent of every node (-1 for the root)
+            leaf: bounded object -> leaf node that holds it (for refit)
+            built_area: summed box area of the nodes when built (see refit)
+        """
+        self.objects = []
+        self.unbounded = []
+        boxes = []
+        for ob in objects:
+            box = ob.getBbox()
+            if box == None:
+                self.unbounded.append(ob)
+            else:
+                self.objects.append(ob)
+                boxes.append(box)
+        lo = np.array([(b.l.x, b.l.y, b.l.z) for b in boxes], dtype=np.float64).reshape(-1, 3)
+        hi = np.array([(b.u.x, b.u.y, b.u.z) for b in boxes], dtype=np.float64).reshape(-1, 3)
+        self.bounds, self.child, self.start, self.count, self.axis, order = buildArrays(lo, hi, leaf_size)
+        self.objects = [self.objects[i] for i in order]
+
+        self.parent = array('i', [-1]) * len(self.child)
+        self.leaf = {}
+        for node in range(len(self.child)):
+            right = self.child[node]
+            if right >= 0:
+                self.parent[node + 1] = node
+                self.parent[right] = node
+            else:
+                for j in range(self.start[node], self.start[node] + self.count[node]):
+                    self.leaf[self.objects[j]] = node
+        self.built_area = self.area()
+
+    #Summed surface area of the node boxes, grows as refit stretches them
+    def area(self):
+        return boundsArea(self.bounds)
+
+    def refit(self, objects):
+        """
+        Fit the node bounds around the current bboxes of objects, after they moved
+        Only the leaves that hold them and the nodes above those are updated, the tree
+        keeps its shape, so it slows down the further objects get from where it was built
+        """
+        bounds = self.bounds
+        child = self.child
+        #Children come after their parent, so the deepest nodes are refit first
+        queued = set(self.leaf[ob] for ob in objects if ob in self.leaf)
+        heap = [-node for node in queued]
+        heapq.heapify(heap)
+        while heap:
+            node = -heapq.heappop(heap)
+            k = 6*node
+            right = child[node]
+            if right < 0:
+                lo = [BIGTIME, BIGTIME, BIGTIME]
+                hi = [-BIGTIME, -BIGTIME, -BIGTIME]
+                for j in range(self.start[node], self.start[node] + self.count[node]):
+                    box = self.objects[j].getBbox()
+                    lo = [min(lo[0], box.l.x), min(lo[1], box.l.y), min(lo[2], box.l.z)]
+                    hi = [max(hi[0], box.u.x), max(hi[1], box.u.y), max(hi[2], box.u.z)]
+                new = lo + hi
+            else:
+                a = 6*(node + 1)
+                b = 6*right
+                new = [min(bounds[a+i], bounds[b+i]) for i in range(3)] + [max(bounds[a+i], bounds[b+i]) for i in range(3, 6)]
+            if bounds[k:k+6].tolist() == new:
+                continue
+            bounds[k:k+6] = array('d', new)
+            parent = self.parent[node]
+            if parent >= 0 and parent not in queued:
+                queued.add(parent)
+                heapq.heappush(heap, -parent)
+
+    def hit(self, ray, sr, stats = None, tmin = BIGTIME, closest = None):
+        """
+        Find the closest object the ray hits and fill in sr
+        A hit already in sr (at tmin, on closest) is only replaced by closer ones,
+        closest isn't tested again
+        Node visits, intersection tests and the hit are counted in stats (a RenderStats)
+        Returns: the time of the closest hit (BIGTIME if nothing is hit) and the object hit
+        """
+        known = closest
+        for object in self.unbounded:
+            if object is known:
+                continue
+            hit = object.intersectRay(ray, sr)
+            if hit and hit.t < tmin:
+                sr.setHit(ray, hit)
+                tmin = hit.t
+                closest = object
+        visits = 0
+        tests = len(self.unbounded)
+
+        if len(self.child):
+            ox, oy, oz = ray.o.x, ray.o.y, ray.o.z
+            ix, iy, iz = safeInverse(ray.d.x), safeInverse(ray.d.y), safeInverse(ray.d.z)
+            #Offsets of the near and far slab of each axis in a node's bounds
+            nx = 0 if ix >= 0 else 3
+            ny = 1 if iy >= 0 else 4
+            nz = 2 if iz >= 0 else 5
+            fx, fy, fz = (nx + 3) % 6, (ny + 3) % 6, (nz + 3) % 6
+            negative = (ix < 0, iy < 0, iz < 0)
+            bounds = self.bounds
+            child = self.child
+            objects = self.objects
+
+            stack = [0]
+            while stack:
+                node = stack.pop()
+                visits += 1
+                k = 6*node
+                tnear = max((bounds[k+nx] - ox)*ix, (bounds[k+ny] - oy)*iy, (bounds[k+nz] - oz)*iz)
+                tfar = min((bounds[k+fx] - ox)*ix, (bounds[k+fy] - oy)*iy, (bounds[k+fz] - oz)*iz)
+                if tnear > tfar or tfar < kEpsilon or tnear > tmin:
+                    continue
+                right = child[node]
+                if right < 0:
+                    first = self.start[node]
+                    tests += self.count[node]
+                    for j in range(first, first + self.count[node]):
+                        object = objects[j]
+                        if object is known:
+                            continue
+                        hit = object.intersectRay(ray, sr)
+                        if hit and hit.t < tmin:
+                            sr.setHit(ray, hit)
+                            tmin = hit.t
+                            closest = object
+                #Visit the child nearer to the ray origin first
+                elif negative[self.axis[node]]:
+                    stack.append(node + 1)
+                    stack.append(right)
+                else:
+                    stack.append(right)
+                    stack.append(node + 1)
+
+        if stats != None:
+            stats.node_visits += visits
+            stats.primitive_tests += tests
+            if closest != None:
+                stats.addHit(closest)
+        return tmin, closest
+
+    def shadowHit(self, ray, tmax, stats = None):
+        """
+        Any-hit query for shadow rays
+        Node visits and intersection tests are counted in stats (a RenderStats)
+        Returns: the first object found that blocks the ray before tmax (None if nothing does)
+        """
+        visits = 0
+        tests = 0
+        blocked = None
+        for object in self.unbounded:
+            tests += 1
+            t = object.shadowHit(ray, stats)
+            if t != None and t < tmax:
+                blocked = object
+                break
+
+        if blocked == None and len(self.child):
+            ox, oy, oz = ray.o.x, ray.o.y, ray.o.z
+            ix, iy, iz = safeInverse(ray.d.x), safeInverse(ray.d.y), safeInverse(ray.d.z)
+            nx = 0 if ix >= 0 else 3
+            ny = 1 if iy >= 0 else 4
+            nz = 2 if iz >= 0 else 5
+            fx, fy, fz = (nx + 3) % 6, (ny + 3) % 6, (nz + 3) % 6
+            bounds = self.bounds
+            child = self.child
+            objects = self.objects
+
+            stack = [0]
+            while stack and blocked == None:
+                node = stack.pop()
+                visits += 1
+                k = 6*node
+                tnear = max((bounds[k+nx] - ox)*ix, (bounds[k+ny] - oy)*iy, (bounds[k+nz] - oz)*iz)
+                tfar = min((bounds[k+fx] - ox)*ix, (bounds[k+fy] - oy)*iy, (bounds[k+fz] - oz)*iz)
+                #Nodes past the light can't block it
+                if tnear > tfar or tfar < kEpsilon or tnear > tmax:
+                    continue
+                right = child[node]
+                if right < 0:
+                    first = self.start[node]
+                    for j in range(first, first + self.count[node]):
+                        tests += 1
+                        t = objects[j].shadowHit(ray, stats)
+                        if t != None and t < tmax:
+                            blocked = objects[j]
+                            break
+                else:
+                    stack.append(right)
+                    stack.append(node + 1)
+
+        if stats != None:
+            stats.node_visits += visits
+            stats.primitive_tests += tests
+        return blocked
+
@@ -0,0 +1,271 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+from Camera import *
+from Constants import *
+from GeometricObjects import *
+from Instance import *
+from Light import *
+from Material import *
+from Mesh import *
+from Sampler import *
+from Texture import *
+from Utilities import *
+from World import *
+from RayTracer import HERE, buildDemo
+
+#Baseline file the results are compared to and saved in, the one in the repository was made with
+#    python Benchmark.py --save --repeat 3
+#Timings only compare on the machine they were made on, save a baseline of your own before changing
+#the tracer (or pass --baseline FILE to keep it elsewhere) and run python Benchmark.py after
+BASELINE = os.path.join(HERE, "benchmark.json")
+#Relative change of a metric that counts as a regression
+TOLERANCE = 0.10
+#Image width and height the scenes are rendered at
+WIDTH = 48
+#Samples per pixel along each axis
+SAMPLES = 2
+
+#Metric: True if a larger value is better
+METRICS = {
+    "render_s": False,
+    "primary_rps": True,
+    "secondary_rps": True,
+    "peak_mb": False,
+}
+
+
+#Camera every scene but the demo is seen from
+def _camera():
+    return PerspectiveCamera(Point(0, 0, -25), Vector(0, 0, 1), 0, Vector(0, 1, 0))
+
+#Area light above the scene, as in the demo
+def _areaLight(world):
+    emissive = Emissive(10.0, Color(1.0, 1.0, 1.0))
+    rectangle = Rectangle(Point(-5, 40, -12), Vector(10.0, 0, 0), Vector(0, 0, 10.0), emissive, Regular(25, 83))
+    world.addObject(rectangle)
+    world.addLight(AreaLight(rectangle))
+
+def _emptyWorld(width):
+    world = World()
+    world.build(width, width, 1)
+    world.camera = _camera()
+    world.addObject(Plane(Point(0, -40, 0), Vector(0, 1, 0), Matte(0.5, 0.5, RegularSurface(Color(0.5, 0.5, 0.5)))))
+    _areaLight(world)
+    return world
+
+def demoScene(width):
+    """ The scene RayTracer.py renders """
+    return buildDemo(width, width)
+
+def spheresScene(width):
+    """ 400 random matte and phong spheres """
+    world = _emptyWorld(width)
+    rng = random.Random(1)
+    for i in range(400):
+        color = RegularSurface(Color(rng.random(), rng.random(), rng.random()))
+        if i % 2:
+            mat = Phong(0.5, 0.7, 0.3, color, 40.0)
+        else:
+            mat = Matte(0.5, 0.8, color)
+        c = Point(rng.uniform(-50, 50), rng.uniform(-35, 50), rng.uniform(0, 60))
+        world.addObject(Sphere(c, rng.uniform(1.0, 4.0), mat))
+    return world
+
+def _torus(R, r, n, m):
+    """ Vertices and faces of a torus around the y axis, with n x m quads split in two """
+    i, j = np.meshgrid(np.arange(n), np.arange(m), indexing="ij")
+    u = 2*math.pi*i/n
+    v = 2*math.pi*j/m
+    vertices = np.stack(((R + r*np.cos(v))*np.cos(u), r*np.sin(v), (R + r*np.cos(v))*np.sin(u)), axis=-1).reshape(-1, 3)
+    a = (i*m + j).ravel()
+    b = (i*m + (j + 1) % m).ravel()
+    c = (((i + 1) % n)*m + j).ravel()
+    d = (((i + 1) % n)*m + (j + 1) % m).ravel()
+    faces = np.concatenate((np.stack((a, b, d), axis=1), np.stack((a, d, c), axis=1)))
+    return vertices, faces
+
+def meshScene(width):
+    """ A 20000 triangle torus mesh """
+    world = _emptyWorld(width)
+    vertices, faces = _torus(25.0, 10.0, 100, 100)
+    #Tip the torus toward the camera
+    y = vertices[:, 1].copy()
+    vertices[:, 1] = 0.8*y - 0.6*vertices[:, 2]
+    vertices[:, 2] = 0.6*y + 0.8*vertices[:, 2] + 20
+    world.addObject(TriangleMesh(vertices, faces, Phong(0.5, 0.7, 0.3, RegularSurface(Color(1.0, 0.6, 0.2)), 40.0)))
+    return world
+
+def instancesScene(width):
+    """ 100 scaled instances of one sphere """
+    world = _emptyWorld(width)
+    sphere = Sphere(Point(0, 0, 0), 3.0, Phong(0.5, 0.7, 0.3, RegularSurface(Color(0.2, 0.4, 1.0)), 40.0))
+    for i in range(10):
+        for j in range(10):
+            s_i = Instance(sphere)
+            #As in the demo, the last transform is applied to the object first
+            s_i.translate(-45 + 10*i, -45 + 10*j, 10 + (i + j) % 3 * 5)
+            s_i.scale(1.0 + 0.1*i, 1.0 + 0.1*j, 1.0)
+            world.addObject(s_i)
+    return world
+
+def texturesScene(width):
+    """ 16 spheres with the earth texture, sampled with a 25 sample diffuse sampler """
+    world = _emptyWorld(width)
+    texture = ImageTexture(loadTexture(os.path.join(HERE, "earthmap1k.jpg")), SphericalMapping(1.0))
+    sphere = Sphere(Point(0, 0, 0), 1.0, Matte(0.75, 0.75, texture, Regular(25, 83)))
+    for i in range(4):
+        for j in range(4):
+            s_i = Instance(sphere)
+            s_i.translate(-36 + 24*i, -36 + 24*j, 10)
+            s_i.scale(11, 11, 11)
+            world.addObject(s_i)
+    return world
+
+SCENES = {
+    "demo": demoScene,
+    "spheres": spheresScene,
+    "mesh": meshScene,
+    "instances": instancesScene,
+    "textures": texturesScene,
+}
+
+
+def _peakMB():
+    """ Peak resident memory of this process in MB, or None where it can't be read """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+def runScene(name, width = WIDTH, samples = SAMPLES, accel = ACCEL):
+    """
+    Build and render one scene serially at fixed settings
+    Returns: dict of the scene's timings, ray counts and peak memory
+    """
+    start = time.perf_counter()
+    world = SCENES[name](width)
+    world.accel = accel
+    world.camera.adaptive = False
+    world.camera.samples = samples
+    world.buildAccel()
+    build = time.perf_counter() - start
+
+    random.seed(0)
+    start = time.perf_counter()
+    image, stats = world.renderScene(1)
+    render = time.perf_counter() - start
+
+    secondary = stats.totalRays() - stats.primary
+    return {
+        "build_s": build,
+        "render_s": render,
+        "primary_rays": stats.primary,
+        "secondary_rays": secondary,
+        "shadow_rays": stats.shadow,
+        "primary_rps": stats.primary / render,
+        "secondary_rps": secondary / render,
+        "node_visits": stats.node_visits,
+        "primitive_tests": stats.primitive_tests,
+        "peak_mb": _peakMB(),
+    }
+
+def runIsolated(name, width = WIDTH, samples = SAMPLES, accel = ACCEL):
+    """ Run one scene in a fresh interpreter so its peak memory is its own """
+    args = [sys.executable, os.path.abspath(__file__), "--child", name,
+            "--width", str(width), "--samples", str(samples), "--accel", accel]
+    out = subprocess.run(args, capture_output=True, text=True, check=True, cwd=HERE)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def compare(results, baseline, tolerance = TOLERANCE):
+    """
+    Compare results with a baseline
+    Returns: list of (scene, metric, baseline value, new value, relative change)
+             for every metric that got worse by more than tolerance
+    """
+    regressions = []
+    for name, new in results.items():
+        old = baseline.get("scenes", {}).get(name)
+        if old == None:
+            continue
+        for metric, larger_better in METRICS.items():
+            a = old.get(metric)
+            b = new.get(metric)
+            if not a or b == None:
+                continue
+            change = (b - a) / a
+            if (larger_better and change < -tolerance) or (not larger_better and change > tolerance):
+                regressions.append((name, metric, a, b, change))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Render the benchmark scenes and compare them with a baseline")
+    parser.add_argument("scenes", nargs="*", help="scenes to run: {0} (default all)".format(", ".join(sorted(SCENES))))
+    parser.add_argument("--width", type=int, default=WIDTH, help="image width and height")
+    parser.add_argument("--samples", type=int, default=SAMPLES, help="samples per pixel along each axis")
+    parser.add_argument("--accel", default=ACCEL, choices=["octree", "bvh"], help="acceleration structure")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scene, the fastest is kept")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative change that counts as a regression")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    for name in args.scenes + ([args.child] if args.child else []):
+        if name not in SCENES:
+            parser.error("unknown scene {0}".format(name))
+    if args.child:
+        print(json.dumps(runScene(args.child, args.width, args.samples, args.accel)))
+        return 0
+
+    settings = {"width": args.width, "samples": args.samples, "accel": args.accel}
+    results = {}
+    for name in args.scenes or sorted(SCENES):
+        runs = [runIsolated(name, args.width, args.samples, args.accel) for i in range(max(1, args.repeat))]
+        results[name] = min(runs, key=lambda r: r["render_s"])
+        r = results[name]
+        print("{0:10} {1:7.2f}s  {2:9.0f} primary/s  {3:9.0f} secondary/s  {4} MB".format(
+            name, r["render_s"], r["primary_rps"], r["secondary_rps"],
+            "?" if r["peak_mb"] == None else "%.0f" % r["peak_mb"]))
+
+    status = 0
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            baseline = None
+            print("Baseline was made with other settings, not compared")
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            for name, metric, a, b, change in regressions:
+                print("REGRESSION {0} {1}: {2:.4g} -> {3:.4g} ({4:+.0%})".format(name, metric, a, b, change))
+            if regressions:
+                status = 1
+            else:
+                print("No regressions beyond {0:.0%}".format(args.tolerance))
+
+    if args.save:
+        #Scenes that were not run keep their old baseline
+        scenes = dict(baseline["scenes"]) if baseline else {}
+        scenes.update(results)
+        data = {"settings": settings, "python": platform.python_version(), "machine": platform.machine(), "scenes": scenes}
+        with open(args.baseline, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        print("Saved baseline to {0}".format(args.baseline))
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
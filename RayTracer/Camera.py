@@ -1,12 +1,21 @@
-﻿import numpy as np
+﻿import math
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from numpy import linalg as LA
 from PIL import Image
 from ViewPort import ViewPort
+from Framebuffer import *
 from Material import *
 from Tracer import *
 #from Octree import *
 from Utilities import *
 from Constants import *
+from Statistics import *
 from World import *
 
 class PerspectiveCamera:
@@ -23,6 +32,10 @@ class PerspectiveCamera:
         u = up.cross(w)
         self.u = u.normalize()
         self.v = self.w.cross(self.u)
+        self.samples = SAMPLES
+        self.adaptive = ADAPTIVE
+        self.prepass = PREPASS
+        self.setAdaptive()
 
     def rayDirection(self, p, d):
         """ Determine the direction of the ray given a point and distance to viewport
@@ -32,24 +45,248 @@ class PerspectiveCamera:
         return dir.normalize()
     #  #419end
 
+    def setAdaptive(self, threshold = ADAPTIVE_THRESHOLD, min_samples = ADAPTIVE_MIN, max_samples = ADAPTIVE_MAX, contrast = ADAPTIVE_CONTRAST):
+        """
+        Settings of adaptive sampling (used when self.adaptive is True)
+        Every pixel starts with min_samples and gets min_samples more at a time while
+        the standard error of its luminance is above threshold, up to max_samples.
+        Pixels that differ from a neighbour by more than contrast are refined too.
 
-    def renderScene(self, w):
-        #create a viewport and image
+        Attributes:
+            threshold: standard error of a pixel's luminance that is good enough
+            min_samples: samples per pixel in the first pass and per refinement step
+            max_samples: cap on the samples of a pixel
+            contrast: luminance difference to a neighbour that marks an edge
+            grid: the samples lie on a grid x grid regular grid in the pixel
+            order: (p, q) grid cells in the order they are sampled
+        """
+        self.threshold = threshold
+        self.min_samples = max(2, min_samples)
+        self.contrast = contrast
+        self.grid = max(1, int(math.isqrt(max_samples)))
+        self.max_samples = self.grid * self.grid
+        self.order = progressiveOrder(self.grid)
+
+
+    def renderScene(self, w, workers = 1, tile_size = TILE_SIZE, backend = None, gbuffer = None, checkpoint = None):
+        """
+        Render the world's viewport, tile by tile
+        Takes in:
+            The world to render (w)
+            The number of workers to trace tiles with (workers)
+            The edge length of a tile in pixels (tile_size)
+            "process" or "thread" workers (backend), defaults to threads only on free-threaded Python,
+            or a Coordinator (see Distributed) whose workers on other machines trace the tiles
+            A GBuffer to capture the primary hits in (gbuffer), None to not capture them
+            A Checkpoint (checkpoint) that the finished tiles are saved to now and then,
+            tiles it already holds (from an earlier run, see Checkpoint.load) aren't traced again
+        The counters of the workers are merged into a new w.stats, the tiles into a new w.framebuffer
+        Returns: the rendered image and its RenderStats
+        """
+        if backend == None:
+            backend = defaultBackend()
+        #create a viewport and framebuffer
+        v = w.view_port
+        fb = Framebuffer(v.w, v.h)
+        tiles = self.makeTiles(v, tile_size)
+        start = time.time()
+        w.stats = RenderStats()
+        #The footprints go to the workers with the world
+        w.footprints = self.footprints(w) if self.prepass else None
+        if gbuffer != None:
+            gbuffer.start(w)
+        if checkpoint != None and checkpoint.tiles:
+            if gbuffer != None:
+                raise ValueError("the primary hits of tiles resumed from a checkpoint can't be captured")
+            #Tiles an earlier run finished are only copied into the image
+            for tile in tiles:
+                if tile in checkpoint.tiles:
+                    fb.addTile(tile, *checkpoint.tiles[tile])
+            tiles = [tile for tile in tiles if tile not in checkpoint.tiles]
+            w.stats.merge(checkpoint.stats)
+            start -= checkpoint.stats.seconds
+
+        #Add a traced tile to the framebuffer and the checkpoint, w.stats must hold its counts already
+        def finish(tile, samples):
+            fb.addTile(tile, *samples)
+            if checkpoint != None and checkpoint.add(tile, samples):
+                w.stats.seconds = time.time() - start
+                checkpoint.save(w.stats)
+
+        try:
+            if hasattr(backend, "renderTiles"):
+                #The world is pickled for the remote workers when the render starts
+                w.capture = gbuffer.empty() if gbuffer != None else None
+                results = backend.renderTiles(w, self, tiles)
+                w.capture = None
+                for tile, samples, stats, records in results:
+                    w.stats.merge(stats)
+                    finish(tile, samples)
+                    if records != None:
+                        gbuffer.extend(records)
+            elif workers > 1 and backend == "thread":
+                #Trace the tiles in a pool of threads that share the world
+                for tile, samples, stats, records in _renderThreaded(w, self, tiles, workers, gbuffer):
+                    w.stats.merge(stats)
+                    finish(tile, samples)
+                    if records != None:
+                        gbuffer.extend(records)
+            elif workers > 1:
+                #Trace the tiles in a pool of processes, the world is handed over once per worker
+                w.capture = gbuffer.empty() if gbuffer != None else None
+                pool = _pool(workers, w, self)
+                w.capture = None
+                try:
+                    for tile, samples, stats, records in pool.imap_unordered(_renderTile, tiles):
+                        w.stats.merge(stats)
+                        finish(tile, samples)
+                        if records != None:
+                            gbuffer.extend(records)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                w.capture = gbuffer
+                try:
+                    for tile in tiles:
+                        finish(tile, self.renderTile(w, tile))
+                finally:
+                    w.capture = None
+        finally:
+            w.stats.seconds = time.time() - start
+            #Also when the render fails or is interrupted, so it resumes from the last finished tile
+            if checkpoint != None:
+                checkpoint.save(w.stats)
+        w.framebuffer = fb
+        return fb.toImage(w.tonemap), w.stats
+
+    def makeTiles(self, v, tile_size):
+        """ Split the viewport into tiles
+            Returns: a list of (col0, row0, col1, row1) tuples, the upper bounds are exclusive
+        """
+        tiles = []
+        for row in range(0, v.h, tile_size):
+            for col in range(0, v.w, tile_size):
+                tiles.append((col, row, min(col + tile_size, v.w), min(row + tile_size, v.h)))
+        return tiles
+
+    def footprints(self, w):
+        """
+        Visibility pre-pass over the world's objects
+        All primary rays have the direction lookat and start on the plane z = eye.z, so
+        the origins of the rays that can hit an object lie in its bbox projected along
+        lookat onto that plane. Objects without a bbox (planes) are over every tile.
+        Returns: (camera, x0, y0, x1, y1, objects, unbounded), x0 to y1 are arrays of the
+                 projected bboxes of objects, None if lookat lies in the plane
+        """
+        d = self.lookat
+        if d.z == 0:
+            return None
+        kx = d.x / d.z
+        ky = d.y / d.z
+        objects = []
+        unbounded = []
+        boxes = []
+        for ob in w.objects:
+            box = ob.getBbox()
+            if box == None:
+                unbounded.append(ob)
+            #A box wholly behind the plane can't be hit
+            elif (box.u.z >= self.eye.z) if d.z > 0 else (box.l.z <= self.eye.z):
+                objects.append(ob)
+                boxes.append((box.l.x, box.l.y, box.l.z, box.u.x, box.u.y, box.u.z))
+        b = np.array(boxes, dtype=float).reshape(-1, 6)
+        #The ray through p starts at p - (p.z - eye.z)*(kx, ky)
+        zl = b[:, 2] - self.eye.z
+        zu = b[:, 5] - self.eye.z
+        x0 = b[:, 0] - np.maximum(zl*kx, zu*kx) - kEpsilon
+        x1 = b[:, 3] - np.minimum(zl*kx, zu*kx) + kEpsilon
+        y0 = b[:, 1] - np.maximum(zl*ky, zu*ky) - kEpsilon
+        y1 = b[:, 4] - np.minimum(zl*ky, zu*ky) + kEpsilon
+        return self, x0, y0, x1, y1, objects, unbounded
+
+    def tileCandidates(self, w, tile):
+        """ The objects whose footprint (see footprints) overlaps the ray origins of a tile
+            Returns: a list of (x0, y0, x1, y1, object) with the footprint of each object
+                     (unbounded ones cover everything), None if the tile's primary rays walk
+                     the accelerator (no footprints of this camera, or more than PREPASS_CANDIDATES objects)
+        """
+        f = getattr(w, "footprints", None)
+        if f == None or f[0] is not self:
+            return None
+        camera, x0, y0, x1, y1, objects, unbounded = f
         v = w.view_port
-        im = Image.new("RGB",(v.w,v.h))
-        pix = im.load()
+        col0, row0, col1, row1 = tile
+        tx0 = v.s*(col0 - 0.5*v.w) + self.eye.x
+        tx1 = v.s*(col1 - 0.5*v.w) + self.eye.x
+        ty0 = v.s*(row0 - 0.5*v.h) + self.eye.y
+        ty1 = v.s*(row1 - 0.5*v.h) + self.eye.y
+        over = np.nonzero((x0 <= tx1) & (x1 >= tx0) & (y0 <= ty1) & (y1 >= ty0))[0]
+        if len(over) + len(unbounded) > PREPASS_CANDIDATES:
+            return None
+        everywhere = [(-math.inf, -math.inf, math.inf, math.inf, ob) for ob in unbounded]
+        return everywhere + list(zip(x0[over].tolist(), y0[over].tolist(), x1[over].tolist(), y1[over].tolist(),
+                                     [objects[i] for i in over.tolist()]))
+
+    def renderTile(self, w, tile):
+        """ Trace every pixel of a tile
+            Primary rays only test the tile's candidates from the pre-pass (World.candidates)
+            Returns: the color sums (r, g, b per pixel) and sample counts of the tile's pixels (column major)
+        """
+        w.candidates = self.tileCandidates(w, tile)
+        try:
+            if w.candidates == []:
+                return self.renderBackground(w, tile)
+            if self.adaptive:
+                return self.renderAdaptive(w, tile)
+            return self.renderGrid(w, tile)
+        finally:
+            w.candidates = None
+
+    def renderBackground(self, w, tile):
+        """ Fill a tile that no object is over with the background, nothing is traced
+            Its rays are counted as culled
+            Returns: the color sums (r, g, b per pixel) and sample counts of the tile's pixels (column major)
+        """
+        col0, row0, col1, row1 = tile
+        pixels = (col1 - col0) * (row1 - row0)
+        #Every pixel of the tile would have had its first pass only
+        k = self.min_samples if self.adaptive else self.samples*self.samples
+        #Same sum as a traced pixel, so the colors match exactly
+        color = Color(0, 0, 0)
+        for i in range(k):
+            color += w.background
+        for col in range(col0, col1):
+            for row in range(row0, row1):
+                newPixel()
+                if w.capture != None:
+                    w.capture.addMisses(col, row, k, self.lookat)
+        w.stats.culled += k*pixels
+        return [color.r, color.g, color.b] * pixels, [k] * pixels
+
+    def renderGrid(self, w, tile):
+        """ Trace every pixel of a tile with a fixed n x n grid of rays
+            Returns: the color sums (r, g, b per pixel) and sample counts of the tile's pixels (column major)
+        """
+        v = w.view_port
+        col0, row0, col1, row1 = tile
         depth = 0
-               
+
         #perform perspective ray-tracing
         ray = Ray(self.eye, self.lookat)
         d = 1
         #Square root of number of rays per pixel
-        n = 4
+        n = self.samples
 
+        sums = []
+        counts = []
         #Run through each pixel
-        for col in range(v.w):
-            for row in range(v.h):
+        for col in range(col0, col1):
+            for row in range(row0, row1):
                 color = Color(0, 0, 0)
+                newPixel()
+                if w.capture != None:
+                    w.capture.setPixel(col, row)
 
                 #Run through each ray per pixel
                 for p in range(n):
@@ -58,8 +295,158 @@ class PerspectiveCamera:
                                        v.s*(row - 0.5*v.h + (p+0.5)/n)+ self.eye.y, self.eye.z)
                         color += w.tracer.trace(ray, depth)
                             
-                #Divide by number of rays per pixel        
-                color /= n*n
-                pix[col, v.h-1-row] = (int(color.r*255), int(color.g*255), int(color.b*255))
-        #Print to my desktop, change Bob to your user name to print to desktop           
-        im.save("C:/Users/Bob/Desktop/image.bmp")
+                w.stats.primary += n*n
+                sums.extend((color.r, color.g, color.b))
+                counts.append(n*n)
+        return sums, counts
+
+    def renderAdaptive(self, w, tile):
+        """ Trace every pixel of a tile with adaptive sampling (see setAdaptive)
+            Returns: the color sums (r, g, b per pixel) and sample counts of the tile's pixels (column major)
+        """
+        v = w.view_port
+        col0, row0, col1, row1 = tile
+        rows = row1 - row0
+        step = self.min_samples
+        colors = []
+        lum = []
+        lum2 = []
+        count = []
+
+        #First pass, every pixel gets min_samples
+        for col in range(col0, col1):
+            for row in range(row0, row1):
+                colors.append(Color(0, 0, 0))
+                lum.append(0.0)
+                lum2.append(0.0)
+                count.append(0)
+                self.samplePixel(w, col, row, len(count) - 1, step, colors, lum, lum2, count)
+
+        #Refine noisy pixels and pixels on an edge to a neighbour
+        for i in range(len(count)):
+            col = col0 + i // rows
+            row = row0 + i % rows
+            mean = lum[i] / count[i]
+            edge = False
+            for j in (i - rows, i + rows, i - 1, i + 1):
+                if j < 0 or j >= len(count) or (j // rows != i // rows and abs(j - i) == 1):
+                    continue
+                if abs(lum[j] / count[j] - mean) > self.contrast:
+                    edge = True
+                    break
+            while count[i] < self.max_samples and (edge or self.error(i, lum, lum2, count) > self.threshold):
+                self.samplePixel(w, col, row, i, step, colors, lum, lum2, count)
+                edge = False
+
+        sums = []
+        for color in colors:
+            sums.extend((color.r, color.g, color.b))
+        return sums, count
+
+    def samplePixel(self, w, col, row, i, k, colors, lum, lum2, count):
+        """ Trace the next k samples of pixel (col, row) and add them to its sums at i """
+        v = w.view_port
+        g = self.grid
+        ray = Ray(self.eye, self.lookat)
+        first = count[i]
+        newPixel()
+        if w.capture != None:
+            w.capture.setPixel(col, row)
+        for p, q in self.order[first:min(first + k, self.max_samples)]:
+            ray.o = Point(v.s*(col - 0.5*v.w +(q+0.5)/g) + self.eye.x,
+                           v.s*(row - 0.5*v.h + (p+0.5)/g)+ self.eye.y, self.eye.z)
+            c = w.tracer.trace(ray, 0)
+            colors[i] += c
+            #Luminance of the displayed (clamped) color
+            l = 0.2126*min(c.r, 1.0) + 0.7152*min(c.g, 1.0) + 0.0722*min(c.b, 1.0)
+            lum[i] += l
+            lum2[i] += l*l
+            count[i] += 1
+        w.stats.primary += count[i] - first
+
+    #Standard error of the mean luminance of pixel i
+    def error(self, i, lum, lum2, count):
+        n = count[i]
+        mean = lum[i] / n
+        var = max(lum2[i] / n - mean*mean, 0.0) * n / (n - 1)
+        return math.sqrt(var / n)
+
+
+def progressiveOrder(g):
+    """
+    Order the cells of a g x g sample grid so every prefix is spread over the pixel
+    Cells are sorted by their bit reversed Morton code, so the first 4 cells fall in
+    the 4 quadrants, the first 16 in the 16 sub-quadrants, and so on
+    Returns: the list of (p, q) cells
+    """
+    bits = max(1, (g - 1).bit_length())
+    cells = []
+    for p in range(g):
+        for q in range(g):
+            code = 0
+            for b in range(bits):
+                code |= ((q >> b) & 1) << (2*b) | ((p >> b) & 1) << (2*b + 1)
+            cells.append((int(format(code, "0%db" % (2*bits))[::-1], 2), p, q))
+    cells.sort()
+    return [(p, q) for key, p, q in cells]
+
+#World and camera of a worker process, set once by _initWorker
+_world = None
+_camera = None
+
+#The camera may be another one than world.camera (the one renderScene was called on)
+def _initWorker(world, camera):
+    global _world, _camera
+    _world = world
+    _camera = camera
+
+#Trace one tile in a worker process
+#Returns the tile, its sums and counts, its RenderStats and its GBuffer records (None when not capturing)
+def _renderTile(tile):
+    _world.stats = RenderStats()
+    if _world.capture != None:
+        _world.capture = _world.capture.empty()
+    #Seed from the tile so forked workers don't all draw the same random samples
+    random.seed(tile[1] * _world.view_port.w + tile[0])
+    samples = _camera.renderTile(_world, tile)
+    records = _world.capture.records() if _world.capture != None else None
+    return tile, samples, _world.stats, records
+
+def _renderThreaded(world, camera, tiles, workers, gbuffer = None):
+    """
+    Trace tiles of world with camera in a pool of threads, each thread works on its own view of the world
+    The primary hits of each tile are captured in a GBuffer of its own when gbuffer is given
+    Yields: the tile, its sums and counts, its RenderStats and its GBuffer records (or None), as the tiles finish
+    """
+    local = threading.local()
+
+    def render(tile):
+        view = getattr(local, "world", None)
+        if view == None:
+            view = local.world = world.workerView()
+        view.stats = RenderStats()
+        view.capture = gbuffer.empty() if gbuffer != None else None
+        samples = camera.renderTile(view, tile)
+        records = view.capture.records() if gbuffer != None else None
+        return tile, samples, view.stats, records
+
+    with ThreadPoolExecutor(workers) as pool:
+        for result in pool.map(render, tiles):
+            yield result
+
+#Threads only trace in parallel on free-threaded CPython (3.13+ without the GIL)
+def defaultBackend():
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    if is_gil_enabled != None and not is_gil_enabled():
+        return "thread"
+    return "process"
+
+def _pool(workers, world, camera):
+    """ Start a pool of worker processes that hold the world and the camera that renders it
+        Forking shares the built world with the workers, other start methods pickle it
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    return context.Pool(workers, _initWorker, (world, camera))
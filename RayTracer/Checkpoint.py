@@ -0,0 +1,82 @@
+import json
+import os
+import time
+import numpy as np
+from Constants import *
+from Statistics import *
+
+
+class Checkpoint:
+    def __init__(self, filename, key, interval = CHECKPOINT_SECONDS):
+        """
+        The finished tiles of a render, saved to disk now and then so a render that
+        dies can be resumed (see PerspectiveCamera.renderScene)
+        The file is replaced in one step, a crash while saving leaves the last checkpoint
+
+        Attributes:
+            filename: .npz file the checkpoint is kept in
+            key: text that tells renders apart (scene, camera, resolution...), a file
+                 saved with another key isn't resumed
+            interval: seconds between two saves
+            tiles: (col0, row0, col1, row1) -> color sums and sample counts of the finished tiles
+                   (as renderTile returns them)
+            stats: RenderStats of the tiles read by load
+            saved: time of the last save
+        """
+        self.filename = filename
+        self.key = key
+        self.interval = interval
+        self.tiles = {}
+        self.stats = RenderStats()
+        self.saved = time.time()
+
+    def load(self):
+        """ Read the tiles of the checkpoint file, if there is one with this key
+            Returns: the number of tiles read
+        """
+        if not os.path.exists(self.filename):
+            return 0
+        with np.load(self.filename) as data:
+            if str(data["key"]) != self.key:
+                return 0
+            tiles = data["tiles"].tolist()
+            sums = data["sums"]
+            counts = data["counts"]
+            state = json.loads(str(data["stats"]))
+        self.tiles = {}
+        i = 0
+        for tile in tiles:
+            n = (tile[2] - tile[0]) * (tile[3] - tile[1])
+            self.tiles[tuple(tile)] = (sums[i:i + n], counts[i:i + n])
+            i += n
+        self.stats = RenderStats()
+        self.stats.__setstate__(state)
+        return len(self.tiles)
+
+    #Add a finished tile, returns True when the checkpoint is due to be saved
+    def add(self, tile, samples):
+        self.tiles[tile] = samples
+        return time.time() - self.saved >= self.interval
+
+    def save(self, stats):
+        """ Write the finished tiles and the RenderStats of the render so far (stats)
+            to a temporary file, then move it over the checkpoint file
+        """
+        tiles = list(self.tiles)
+        sums = [np.asarray(self.tiles[tile][0], dtype=np.float32).reshape(-1, 3) for tile in tiles]
+        counts = [np.asarray(self.tiles[tile][1], dtype=np.int32) for tile in tiles]
+        temp = self.filename + ".tmp"
+        with open(temp, "wb") as f:
+            np.savez(f, key=self.key, tiles=np.array(tiles, dtype=np.int32).reshape(-1, 4),
+                     sums=np.concatenate(sums) if sums else np.zeros((0, 3), np.float32),
+                     counts=np.concatenate(counts) if counts else np.zeros(0, np.int32),
+                     stats=json.dumps(stats.__getstate__()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.filename)
+        self.saved = time.time()
+
+    #Delete the checkpoint file (once the image is saved)
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
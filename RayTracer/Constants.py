@@ -1,10 +1,66 @@
 ﻿#kEpsilon Value for object intersection error
 kEpsilon = 0.0000001
-#Max times a ray can be reflected
+#Max times a ray can be reflected (Material.max_depth can lower it per material)
 RAYDEPTH = 5
+#What is done with secondary rays whose path weight (the scale their color reaches the pixel with)
+#falls below PRUNE_THRESHOLD: "off" (trace them), "cutoff" (drop them, a little darker)
+#or "roulette" (Russian roulette, drops most of them and keeps the image unbiased but noisier,
+#opt in with the scene's "prune" setting or --prune of Render.py and RayTracer.py)
+PRUNE = "off"
+PRUNE_THRESHOLD = 0.05
+#Test the object the last primary ray hit, and the last occluder of each light, before
+#walking the accelerator (neighbouring rays mostly hit and are blocked by the same objects)
+COHERENCE = True
+#Project every object's bbox onto the plane of the camera's ray origins before rendering, so
+#primary rays only test the objects over their tile and tiles over nothing aren't traced
+PREPASS = True
+#Longest list of objects over a tile that its primary rays test one by one, tiles
+#with more walk the accelerator
+PREPASS_CANDIDATES = 16
 #Unless MAX_DEPTH is reached
 MAX_OBJ = 10
 #Maximum depth of the OcTree, overrides the MAX_OBJ at the max depth
 MAX_DEPTH = 10
 #Big positive value for time of intersections
-BIGTIME = 1e6
\ No newline at end of file
+BIGTIME = 1e6
+#Edge length (in pixels) of the tiles the image is split into for rendering
+TILE_SIZE = 16
+#Port a render Coordinator listens on for workers (see Distributed)
+DISTRIBUTED_PORT = 25250
+#Seconds an idle worker waits before it asks the coordinator for a tile again
+DISTRIBUTED_WAIT = 0.2
+#A tile out for longer than this times the mean tile time is handed to an idle worker too
+STRAGGLER_FACTOR = 3.0
+#Seconds between two saves of a render's checkpoint (see Checkpoint)
+CHECKPOINT_SECONDS = 60
+#How the linear colors of the framebuffer are mapped to 8 bit images:
+#"clamp" (saturate at 1) or "reinhard" (c / (1 + c), keeps detail in bright areas)
+TONEMAP = "clamp"
+#Acceleration structure World.hitObjects uses ("octree" or "bvh")
+ACCEL = "octree"
+#Number of objects a BVH leaf holds
+BVH_LEAF_SIZE = 4
+#Largest leaf the BVH keeps when splitting it further doesn't pay off
+BVH_MAX_LEAF = 16
+#Number of bins per axis the BVH tries split planes at
+BVH_BINS = 16
+#Samples per pixel along each axis (SAMPLES*SAMPLES rays per pixel)
+SAMPLES = 4
+#Trace pixels with adaptive sampling instead of a fixed SAMPLES*SAMPLES grid
+ADAPTIVE = False
+#Samples every pixel starts with, and that are added per refinement step, in adaptive sampling
+ADAPTIVE_MIN = 4
+#Most samples one pixel gets in adaptive sampling
+ADAPTIVE_MAX = 16
+#Standard error of a pixel's luminance (0 to 1) above which it gets more samples
+ADAPTIVE_THRESHOLD = 0.02
+#Luminance difference to a neighbouring pixel above which a pixel gets more samples
+ADAPTIVE_CONTRAST = 0.1
+#Edge length of the Octree root, independent of the image resolution
+WORLD_SIZE = 128
+#Growth of the summed node box area from refitting a moved scene, past which the accelerator is rebuilt
+REFIT_LIMIT = 2.0
+#Filtering of image textures: "nearest", "bilinear" or "trilinear" (bilinear between mip levels)
+TEXTURE_FILTER = "trilinear"
+#Size the process wide texture cache is kept under
+TEXTURE_CACHE_MB = 256
@@ -0,0 +1,237 @@
+import argparse
+import collections
+import pickle
+import secrets
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, wait
+import Camera
+from Constants import *
+
+"""
+Tiles of a render traced by worker processes on other machines
+
+The coordinator listens on a socket. A worker connects and asks for work, gets the
+pickled World of the render (once per render) and then one tile at a time. It sends
+the color sums and counts of each tile back with its next request.
+Tiles of a worker whose connection drops are handed out again, and once nothing is
+left to hand out, idle workers get copies of tiles that are out for much longer than
+tiles took so far (the first copy back wins).
+
+Everything is sent as pickles, and unpickling runs code, so both sides prove they know
+the authkey before anything is read. Whoever knows the key can run code on the coordinator
+and on every worker: keep it secret, and only listen on an interface other machines can
+reach on a network you trust. The coordinator listens on localhost unless told otherwise,
+and makes up a random key when it isn't given one.
+
+    coordinator = Coordinator(("10.0.0.5", DISTRIBUTED_PORT))
+    print(coordinator.authkey)
+    image, stats = world.renderScene(backend = coordinator)
+
+and on every node (several per machine is fine):
+
+    python Distributed.py 10.0.0.5:25250 --authkey KEY
+"""
+
+
+#Parse a "HOST:PORT" address
+def parseAddress(text):
+    host, sep, port = text.rpartition(":")
+    if not sep or not port.isdigit():
+        raise argparse.ArgumentTypeError("address must look like host:port, not {0!r}".format(text))
+    return (host or "localhost", int(port))
+
+
+class Coordinator:
+    def __init__(self, address = ("localhost", DISTRIBUTED_PORT), authkey = None, straggler = STRAGGLER_FACTOR):
+        """
+        Serves the tiles of renders to the workers that connect to address
+        Used as the backend of World.renderScene, workers can come and go at any time
+        A random authkey is made when none is given, the workers must be started with it
+
+        Attributes:
+            listener: Listener the workers connect to
+            address: (host, port) it listens on (port 0 asks for a free one)
+            authkey: key the workers must know (text, or bytes when given as bytes)
+            straggler: a tile out for longer than this times the mean tile time is handed out again
+            connections: connections of the workers
+            lock: guards connections, the accepting thread adds to them
+            job: number of the current render, workers holding another world are sent this one
+            blob: pickled World and camera of the current render
+            closed: set by close, stops the accepting thread
+        """
+        if authkey == None:
+            authkey = secrets.token_hex(16)
+        self.authkey = authkey
+        self.listener = Listener(address, authkey = authkey.encode() if isinstance(authkey, str) else authkey)
+        self.address = self.listener.address
+        self.straggler = straggler
+        self.connections = []
+        self.lock = threading.Lock()
+        self.job = 0
+        self.blob = None
+        self.closed = False
+        threading.Thread(target = self.accept, daemon = True).start()
+
+    #Accept workers until the coordinator is closed
+    def accept(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                if self.closed:
+                    return
+                #A worker with the wrong key, or one that hung up while connecting
+                continue
+            with self.lock:
+                self.connections.append(conn)
+
+    #Stop listening and drop the workers, they exit when they notice
+    def close(self):
+        self.closed = True
+        self.listener.close()
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def renderTiles(self, w, camera, tiles):
+        """
+        Start a render of tiles of the world w with camera, both are pickled for the workers right away
+        Returns: an iterator of (tile, samples, RenderStats, GBuffer records or None)
+                 as the tiles come back, like the process and thread pools of renderScene
+        """
+        self.job += 1
+        self.blob = pickle.dumps((w, camera), pickle.HIGHEST_PROTOCOL)
+        return self.collect(tiles)
+
+    def collect(self, tiles):
+        pending = collections.deque(tiles)
+        #tile -> [time it was first handed out, connections working on it]
+        out = {}
+        done = set()
+        elapsed = 0.0
+        while len(done) < len(tiles):
+            with self.lock:
+                connections = list(self.connections)
+            for conn in wait(connections, DISTRIBUTED_WAIT) if connections else []:
+                try:
+                    kind, job, result = conn.recv()
+                except (EOFError, OSError):
+                    self.drop(conn, out, pending)
+                    continue
+                if kind == "error":
+                    raise RuntimeError("a worker failed:\n" + result)
+                if result != None and job == self.job and result[0] not in done:
+                    tile = result[0]
+                    done.add(tile)
+                    start = out.pop(tile, [None])[0]
+                    if start != None:
+                        elapsed += time.time() - start
+                    yield result
+                try:
+                    self.reply(conn, job, pending, out, done, elapsed / len(done) if done else None)
+                except OSError:
+                    self.drop(conn, out, pending)
+            if not connections:
+                time.sleep(DISTRIBUTED_WAIT)
+
+    def reply(self, conn, job, pending, out, done, mean):
+        """ Answer the request of a worker: the world of this render, a tile, or to wait
+            mean is the mean time of a tile so far (None before the first is back)
+        """
+        if job != self.job:
+            conn.send(("job", self.job))
+            conn.send_bytes(self.blob)
+            return
+        now = time.time()
+        #A tile handed out again after its worker dropped may have come back from a copy meanwhile
+        while pending and pending[0] in done:
+            pending.popleft()
+        if pending:
+            tile = pending.popleft()
+            out[tile] = [now, [conn]]
+        else:
+            #The straggler out for the longest that this worker isn't already on
+            late = [(start, tile) for tile, (start, workers) in out.items()
+                    if mean != None and now - start > self.straggler * mean and conn not in workers]
+            if not late:
+                conn.send(("wait", DISTRIBUTED_WAIT))
+                return
+            tile = min(late)[1]
+            out[tile][1].append(conn)
+        conn.send(("tile", tile))
+
+    #Forget a worker whose connection dropped, its tiles nobody else works on are handed out again
+    def drop(self, conn, out, pending):
+        with self.lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        conn.close()
+        for tile in list(out):
+            workers = out[tile][1]
+            if conn in workers:
+                workers.remove(conn)
+                if not workers:
+                    del out[tile]
+                    pending.appendleft(tile)
+
+
+def worker(address, authkey):
+    """
+    Trace tiles for the coordinator at address until it goes away
+    authkey is the key of the coordinator, only connect to coordinators you trust:
+    the worlds they send are unpickled
+    Returns: the number of tiles traced
+    """
+    conn = Client(address, authkey = authkey.encode() if isinstance(authkey, str) else authkey)
+    job = None
+    result = None
+    traced = 0
+    try:
+        while True:
+            conn.send(("next", job, result))
+            result = None
+            message = conn.recv()
+            if message[0] == "job":
+                job = message[1]
+                Camera._initWorker(*pickle.loads(conn.recv_bytes()))
+            elif message[0] == "tile":
+                try:
+                    result = Camera._renderTile(message[1])
+                except Exception:
+                    conn.send(("error", job, traceback.format_exc()))
+                    return traced
+                traced += 1
+            else:
+                time.sleep(message[1])
+    except (EOFError, OSError):
+        #The coordinator is done
+        return traced
+    finally:
+        conn.close()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Trace tiles for a render coordinator (see Render.py --serve)")
+    parser.add_argument("address", type=parseAddress, help="host:port of the coordinator")
+    parser.add_argument("--authkey", required=True, help="key of the coordinator (Render.py --serve prints it)")
+    args = parser.parse_args(argv)
+    try:
+        traced = worker(args.address, args.authkey)
+    except (ConnectionError, OSError) as e:
+        print("{0}:{1}: {2}".format(args.address[0], args.address[1], e), file=sys.stderr)
+        return 1
+    print("traced {0} tiles".format(traced))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+from PIL import Image
+from Constants import *
+
+
+class Framebuffer:
+    def __init__(self, width, height):
+        """
+        Float accumulation buffer of a render, the sums and counts of the samples of
+        every pixel. Tiles (and further passes over the same pixels) are added in, the
+        image is made from the means in one go.
+        Rows are stored top to bottom like the image (row 0 of the viewport is the last).
+
+        Attributes:
+            width, height: resolution
+            sums: (height, width, 3) float32 array of the summed linear sample colors
+            counts: (height, width) int32 array of the number of samples per pixel
+        """
+        self.width = width
+        self.height = height
+        self.sums = np.zeros((height, width, 3), dtype=np.float32)
+        self.counts = np.zeros((height, width), dtype=np.int32)
+
+    def addTile(self, tile, sums, counts):
+        """
+        Add the samples of a traced tile
+        Takes in:
+            The (col0, row0, col1, row1) tile (tile)
+            The r, g, b sums of its pixels (sums) and their sample counts (counts),
+            pixels in column major order as renderTile returns them
+        """
+        col0, row0, col1, row1 = tile
+        cols = col1 - col0
+        rows = row1 - row0
+        top = self.height - row1
+        bottom = self.height - row0
+        self.sums[top:bottom, col0:col1] += np.asarray(sums, dtype=np.float32).reshape(cols, rows, 3).transpose(1, 0, 2)[::-1]
+        self.counts[top:bottom, col0:col1] += np.asarray(counts, dtype=np.int32).reshape(cols, rows).T[::-1]
+
+    #Add the samples of another framebuffer of the same size (e.g. another pass)
+    def merge(self, other):
+        self.sums += other.sums
+        self.counts += other.counts
+        return self
+
+    #Mean linear color of every pixel, (height, width, 3) float32 (black where there are no samples)
+    def mean(self):
+        return self.sums / np.maximum(self.counts, 1)[:, :, None].astype(np.float32)
+
+    def toImage(self, tonemap = TONEMAP):
+        """
+        Tonemap and quantize the means to an 8 bit image
+        Takes in: "clamp" (saturate at 1) or "reinhard" (c / (1 + c)) (tonemap)
+        Returns: the PIL image
+        """
+        c = self.mean()
+        if tonemap == "reinhard":
+            c = c / (1.0 + c)
+        elif tonemap != "clamp":
+            raise ValueError("unknown tonemap {0!r}".format(tonemap))
+        return Image.fromarray((np.clip(c, 0.0, 1.0) * 255).astype(np.uint8), "RGB")
+
+    def save(self, filename):
+        """ Write the linear means without tonemapping, as .pfm or .npy by the extension """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == ".npy":
+            np.save(filename, self.mean())
+        elif ext == ".pfm":
+            #Little endian (negative scale), rows bottom to top
+            with open(filename, "wb") as f:
+                f.write("PF\n{0} {1}\n-1.0\n".format(self.width, self.height).encode("ascii"))
+                f.write(np.ascontiguousarray(self.mean()[::-1], dtype="<f4").tobytes())
+        else:
+            raise ValueError("raw images are .pfm or .npy, not {0!r}".format(filename))
+
+    @staticmethod
+    def load(filename):
+        """ Read a .pfm or .npy file written by save, each pixel counts as one sample
+            Returns: the Framebuffer
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == ".npy":
+            c = np.load(filename)
+        elif ext == ".pfm":
+            with open(filename, "rb") as f:
+                kind = f.readline().strip()
+                width, height = (int(n) for n in f.readline().split())
+                scale = float(f.readline())
+                channels = 3 if kind == b"PF" else 1
+                data = np.frombuffer(f.read(), dtype="<f4" if scale < 0 else ">f4")
+            c = data.reshape(height, width, channels)[::-1]
+            if channels == 1:
+                c = np.repeat(c, 3, axis=2)
+        else:
+            raise ValueError("raw images are .pfm or .npy, not {0!r}".format(filename))
+        fb = Framebuffer(c.shape[1], c.shape[0])
+        fb.sums[:] = c
+        fb.counts[:] = 1
+        return fb
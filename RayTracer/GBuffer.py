@@ -0,0 +1,233 @@
+import time
+from array import array
+import numpy as np
+from Framebuffer import *
+from Instance import *
+from Sampler import *
+from ShadeRec import *
+from Statistics import *
+from Utilities import *
+
+#Per sample arrays of a GBuffer: name, array typecode and values per sample
+FIELDS = (("pixel", "i", 2), ("material", "i", 1), ("t", "d", 1), ("hit_point", "d", 3),
+          ("normal", "d", 3), ("local_hit", "d", 3), ("local_scale", "d", 1), ("direction", "d", 3),
+          ("secondary", "d", 3))
+
+
+def materialTable(world):
+    """
+    The materials of the world's objects (and of the objects instances share), in object order
+    A scene built again from the same file gives the same order, so the index of a
+    material is its id in a saved GBuffer
+    Returns: the list of materials
+    """
+    materials = []
+    seen = {}
+    for ob in world.objects:
+        while ob != None:
+            if id(ob.material) not in seen:
+                seen[id(ob.material)] = True
+                materials.append(ob.material)
+            ob = ob.o if isinstance(ob, Instance) else None
+    return materials
+
+
+class GBuffer:
+    def __init__(self):
+        """
+        What the primary rays of a render hit, sample by sample, so the image can be
+        shaded again (see reshade) after materials or lights changed, without tracing
+        the primary rays. Filled by PerspectiveCamera.renderScene when passed one.
+
+        Attributes:
+            width, height: resolution of the render
+            materials: materials by id (see materialTable)
+            ids: id() of a material -> its index in materials
+            current: (col, row) of the pixel the next samples belong to
+            pixel: col, row of each sample
+            material: id of the material hit, -1 for a miss
+            t: time of the hit
+            hit_point, normal, local_hit, local_scale: the hit, as in ShadeRec
+            direction: direction of the ray
+            secondary: color of the secondary rays (reflections, refractions) of the hit
+        """
+        self.width = 0
+        self.height = 0
+        self.materials = []
+        self.ids = {}
+        self.current = (0, 0)
+        for name, typecode, n in FIELDS:
+            setattr(self, name, array(typecode))
+
+    #Start capturing a render of the world, samples of an earlier one are dropped
+    def start(self, world):
+        self.width = world.view_port.w
+        self.height = world.view_port.h
+        self.materials = materialTable(world)
+        self.ids = {id(m): i for i, m in enumerate(self.materials)}
+        for name, typecode, n in FIELDS:
+            setattr(self, name, array(typecode))
+
+    #An empty GBuffer for one tile of the same render (see records)
+    def empty(self):
+        chunk = GBuffer()
+        chunk.width = self.width
+        chunk.height = self.height
+        chunk.materials = self.materials
+        chunk.ids = self.ids
+        return chunk
+
+    #The ids are made again after a copy, the materials are other objects then
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["ids"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.ids = {id(m): i for i, m in enumerate(self.materials)}
+
+    #Number of samples
+    def __len__(self):
+        return len(self.material)
+
+    #Samples added from here on belong to pixel (col, row)
+    def setPixel(self, col, row):
+        self.current = (col, row)
+
+    #Record the ShadeRec of a primary ray
+    def add(self, sr, ray):
+        self.pixel.extend(self.current)
+        self.direction.extend((ray.d.x, ray.d.y, ray.d.z))
+        self.secondary.extend((0.0, 0.0, 0.0))
+        if not sr.hit:
+            self.material.append(-1)
+            self.t.append(0.0)
+            self.hit_point.extend((0.0, 0.0, 0.0))
+            self.normal.extend((0.0, 0.0, 0.0))
+            self.local_hit.extend((0.0, 0.0, 0.0))
+            self.local_scale.append(1.0)
+            return
+        self.material.append(self.ids[id(sr.mat)])
+        self.t.append(sr.t)
+        self.hit_point.extend((sr.hit_point.x, sr.hit_point.y, sr.hit_point.z))
+        self.normal.extend((sr.normal.x, sr.normal.y, sr.normal.z))
+        self.local_hit.extend((sr.local_hit.x, sr.local_hit.y, sr.local_hit.z))
+        self.local_scale.append(sr.local_scale)
+
+    #Set the color of the secondary rays of the last sample added
+    def setSecondary(self, color):
+        k = len(self.secondary) - 3
+        self.secondary[k] = color.r
+        self.secondary[k+1] = color.g
+        self.secondary[k+2] = color.b
+
+    #Record k primary rays in direction d of pixel (col, row) that miss everything
+    def addMisses(self, col, row, k, d):
+        for i in range(k):
+            self.pixel.extend((col, row))
+            self.direction.extend((d.x, d.y, d.z))
+            self.secondary.extend((0.0, 0.0, 0.0))
+            self.material.append(-1)
+            self.t.append(0.0)
+            self.hit_point.extend((0.0, 0.0, 0.0))
+            self.normal.extend((0.0, 0.0, 0.0))
+            self.local_hit.extend((0.0, 0.0, 0.0))
+            self.local_scale.append(1.0)
+
+    #The sample arrays, to hand a tile's samples from a worker to the GBuffer of the render
+    def records(self):
+        return tuple(getattr(self, name) for name, typecode, n in FIELDS)
+
+    #Append the sample arrays of a tile (see records)
+    def extend(self, records):
+        for (name, typecode, n), values in zip(FIELDS, records):
+            getattr(self, name).extend(values)
+
+    def save(self, filename):
+        """ Write the samples to a NumPy .npz file, the materials are stored by id """
+        arrays = {name: np.frombuffer(getattr(self, name), dtype=np.int32 if typecode == "i" else np.float64).reshape(-1, n)
+                  for name, typecode, n in FIELDS}
+        np.savez_compressed(filename, width=self.width, height=self.height, materials=len(self.materials), **arrays)
+
+    @staticmethod
+    def load(filename, world):
+        """
+        Read a GBuffer written by save
+        The ids are looked up in world's materials (see materialTable), so world must be
+        built from the same scene, its materials and lights may differ
+        Returns: the GBuffer
+        """
+        gbuffer = GBuffer()
+        with np.load(filename) as data:
+            gbuffer.width = int(data["width"])
+            gbuffer.height = int(data["height"])
+            gbuffer.materials = materialTable(world)
+            if int(data["materials"]) != len(gbuffer.materials):
+                raise ValueError("{0} was captured from a scene with {1} materials, this one has {2}".format(
+                    filename, int(data["materials"]), len(gbuffer.materials)))
+            for name, typecode, n in FIELDS:
+                if name not in data:
+                    #Saved before the field was added
+                    values = np.zeros((len(data["material"]), n), dtype=np.int32 if typecode == "i" else np.float64)
+                    setattr(gbuffer, name, array(typecode, values.tobytes()))
+                    continue
+                values = np.ascontiguousarray(data[name], dtype=np.int32 if typecode == "i" else np.float64)
+                setattr(gbuffer, name, array(typecode, values.tobytes()))
+        gbuffer.ids = {id(m): i for i, m in enumerate(gbuffer.materials)}
+        return gbuffer
+
+    def reshade(self, world):
+        """
+        Shade the samples again with the current settings of the materials and lights
+        Only the direct lighting of the primary hits is shaded again (with its shadow
+        rays), no secondary rays are traced: the reflections and refractions keep the
+        color they had in the captured render, so changes to the materials and lights
+        seen in them don't show
+        Returns: the image and its RenderStats, the linear colors are kept in world.framebuffer
+        """
+        start = time.time()
+        world.stats = RenderStats()
+        tracer = world.tracer
+        h = self.height
+        colors = [None] * (self.width * h)
+        count = [0] * (self.width * h)
+        pixel = self.pixel
+        last = -1
+        for s in range(len(self)):
+            #Column major, the order of Framebuffer.addTile
+            i = pixel[2*s] * h + pixel[2*s + 1]
+            if i != last:
+                newPixel()
+                last = i
+            m = self.material[s]
+            if m < 0:
+                c = world.background
+            else:
+                sr = ShadeRec(world)
+                sr.hit = True
+                sr.mat = self.materials[m]
+                sr.t = self.t[s]
+                k = 3*s
+                sr.hit_point = Point(self.hit_point[k], self.hit_point[k+1], self.hit_point[k+2])
+                sr.normal = Vector(self.normal[k], self.normal[k+1], self.normal[k+2])
+                sr.local_hit = Point(self.local_hit[k], self.local_hit[k+1], self.local_hit[k+2])
+                sr.local_scale = self.local_scale[s]
+                d = Vector(self.direction[k], self.direction[k+1], self.direction[k+2])
+                sr.ray = Ray(sr.hit_point.addScaled(d, -sr.t), d)
+                c = tracer.shadeDirect(sr) + Color(self.secondary[k], self.secondary[k+1], self.secondary[k+2])
+            if count[i] == 0:
+                colors[i] = Color(0, 0, 0)
+            colors[i] += c
+            count[i] += 1
+
+        sums = []
+        for color in colors:
+            if color == None:
+                sums.extend((0.0, 0.0, 0.0))
+            else:
+                sums.extend((color.r, color.g, color.b))
+        world.framebuffer = Framebuffer(self.width, h)
+        world.framebuffer.addTile((0, 0, self.width, h), sums, count)
+        world.stats.seconds = time.time() - start
+        return world.framebuffer.toImage(world.tonemap), world.stats
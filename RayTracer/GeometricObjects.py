@@ -4,19 +4,25 @@ from Utilities import *
 from Material import *
 from ShadeRec import *
 from Constants import *
+from RayPacket import *
 
 
 # #419begin #type=3 #src= Ray Trace Ground Up
 
 class GeometricObject():
+    #Kept in the World's coherence caches, objects that walk their own accelerator aren't
+    #(testing them again costs as much as the walk they would save)
+    coherent = True
+
     def getNormal(self, ray):
         return Vector(0.0, 0.0, 0.0)
 
     def setBbox(self):
         pass
 
+    #Bounding box of the object, None for unbounded objects (planes)
     def getBbox(self):
-        return Bbox()
+        return None
 
     def sample(self):
         return Point(0.0, 0.0, 0.0)
@@ -24,8 +30,14 @@ class GeometricObject():
     def pdf(self):
         return 0.0
 
-    def shadowHit(self, ray):
-        return Color(0, 0, 0)
+    #Returns the time the ray hits the object, None if it doesn't
+    def shadowHit(self, ray, stats = None):
+        return None
+
+    #Intersect a whole RayPacket with this object, returns arrays of t, normals and hits
+    def intersectPacket(self, packet):
+        t, normals, hit, index = intersectObjects(packet, [self])
+        return t, normals, hit
 
 class Sphere(GeometricObject):
     def __init__(self, center, radius, material):
@@ -45,59 +57,59 @@ class Sphere(GeometricObject):
         self.shadows = True
         self.type = "Sphere"
 
+    #Vectorized intersection of a RayPacket with a list of spheres
+    packetKernel = intersectSpheres
+
     def intersectRay(self,ray, sr):
         """ Determine if a ray intersects the sphere
-            Returns: the parameter t for the closest intersection point to
+            Returns: a Hit for the closest intersection point to
                      the ray origin.
                      Returns a value of None for no intersection
         """  
-        temp= ray.o - self.c
-        a = ray.d * ray.d
-        b = temp * ray.d * 2.0
-        cq = temp * temp - self.r * self.r
+        o = ray.o
+        d = ray.d
+        tx = o.x - self.c.x
+        ty = o.y - self.c.y
+        tz = o.z - self.c.z
+        a = d.x*d.x + d.y*d.y + d.z*d.z
+        b = 2.0 * (tx*d.x + ty*d.y + tz*d.z)
+        cq = tx*tx + ty*ty + tz*tz - self.r * self.r
         disc = b * b -4.0 * a *cq
         if (disc < 0.0):
-            return False
+            return None
         else:
-            e = np.sqrt(disc)
+            e = math.sqrt(disc)
             denom = 2.0 * a
             t = (-b - e) / denom
+            if (t<=kEpsilon):
+                t = (-b+e)/denom
             if (t>kEpsilon):
-                self.t = t
-                self.normal = (temp + t*ray.d) / self.r
-                self.local_hit = ray.o + ray.d * t
-                return True
-
-            t = (-1.0*b+e)/denom
-            if (t>kEpsilon):
-                self.t = t
-                self.normal = (temp + t*ray.d) / self.r
-                self.local_hit = ray.o + ray.d * t
-                return True
-        return False  
-
-    #Same as intersectRay, except no sr
-    def shadowHit(self, ray):
-        temp= ray.o - self.c
-        a = ray.d * ray.d
-        b = 2.0 * temp * ray.d
-        cq = temp * temp - self.r * self.r
+                inv_r = 1.0 / self.r
+                normal = Vector((tx + t*d.x) * inv_r, (ty + t*d.y) * inv_r, (tz + t*d.z) * inv_r)
+                return Hit(t, normal, o.addScaled(d, t), self.material)
+        return None  
+
+    #Same as intersectRay, except no sr, returns only t
+    def shadowHit(self, ray, stats = None):
+        d = ray.d
+        tx = ray.o.x - self.c.x
+        ty = ray.o.y - self.c.y
+        tz = ray.o.z - self.c.z
+        a = d.x*d.x + d.y*d.y + d.z*d.z
+        b = 2.0 * (tx*d.x + ty*d.y + tz*d.z)
+        cq = tx*tx + ty*ty + tz*tz - self.r * self.r
         disc = b * b -4.0 * a *cq
         if (disc < 0.0):
-            return False
+            return None
         else:
-            e = np.sqrt(disc)
+            e = math.sqrt(disc)
             denom = 2.0 * a
             t = (-b - e) / denom
+            if (t<=kEpsilon):
+                t = (-b+e)/denom
             if (t>kEpsilon):
-                self.st = t
-                return True
-
-            t = (-1.0*b+e)/denom
-            if (t>kEpsilon):
-                self.st = t
-                return True
-        return False  
+                return t
+        return None  
 
     #return bbox of Sphere
     def getBbox(self):
@@ -128,33 +140,33 @@ class Plane(GeometricObject):
         self.shadows = True
         self.type = "Plane"
 
+    #Vectorized intersection of a RayPacket with a list of planes
+    packetKernel = intersectPlanes
+
     def intersectRay(self,ray, sr):
         """ Determine if a ray intersects the plane
-            Returns: the parameter t for the closest intersection point to
+            Returns: a Hit for the closest intersection point to
                      the ray origin.
                      Returns a value of None for no intersection
         """  
-        test = ray.d * self.n
+        n = self.n
+        test = ray.d.dot(n)
         if test == 0:
-            return False
-        t = ((self.p - ray.o) * self.n)/(ray.d * self.n)
+            return None
+        t = self.p.diff(ray.o).dot(n)/test
         if (t>kEpsilon):
-            self.t = t
-            self.normal = self.n
-            self.local_hit = ray.o + t * ray.d
-            return True
-        return False
-
-    #Same as intersectRay, but without sr
-    def shadowHit(self, ray):
-        test = ray.d * self.n
+            return Hit(t, n, ray.o.addScaled(ray.d, t), self.material)
+        return None
+
+    #Same as intersectRay, but without sr, returns only t
+    def shadowHit(self, ray, stats = None):
+        test = ray.d.dot(self.n)
         if test == 0:
-            return False
-        t = ((self.p - ray.o) * self.n)/(ray.d * self.n)
+            return None
+        t = self.p.diff(ray.o).dot(self.n)/test
         if (t>kEpsilon):
-                self.st = t
-                return True
-        return False
+                return t
+        return None
     
     def getNormal(self,pt):
         """ Returns unit normal of sphere at the point pt """
@@ -190,52 +202,41 @@ class Rectangle(GeometricObject):
         self.pdf = 1/self.a
         self.type = "Plane"
         self.shadows = False
+
+    #Vectorized intersection of a RayPacket with a list of rectangles
+    packetKernel = intersectRectangles
      
           
     def intersectRay(self,ray, sr):
         """ Determine if a ray intersects the Rectangle
-            Returns: the parameter t for the closest intersection point to
+            Returns: a Hit for the closest intersection point to
                      the ray origin.
                      Returns a value of None for no intersection
         """  
-        test = ray.d * self.n
+        test = ray.d.dot(self.n)
         if test == 0:
-            return False
-        t = ((self.position - ray.o) * self.n)/(ray.d * self.n)
+            return None
+        t = self.position.diff(ray.o).dot(self.n)/test
         if (t<kEpsilon):
-                return False
-        p = ray.o + t*ray.d
-        v = p - self.p
-        h = v*self.h
-        if(h < 0 or h > self.h.length()*self.h.length()):
-            return False
-        w = v*self.w
-        if w < 0 or w > (self.w.length()*self.w.length()):
-            return False
-        self.t = t
-        self.normal = self.n
-        self.local_hit = p
-        return True
-
-    #Same as intersectRay, but no sr
-    def shadowHit(self, ray):
-        return False
-        test = ray.d * self.n
-        if test == 0:
-            return False
-        t = ((self.position - ray.o) * self.n)/(ray.d * self.n)
-        if (t<kEpsilon):
-                return False
-        p = ray.o + t*ray.d
-        v = p - self.p
-        h = v*self.h
-        if(h < 0 or h > self.h.length()*self.h.length()):
-            return False
-        w = v*self.w
-        if w < 0 or w > (self.w.length()*self.w.length()):
-            return False
-        self.st = t
-        return True
+                return None
+        p = ray.o.addScaled(ray.d, t)
+        v = p.diff(self.p)
+        h = v.dot(self.h)
+        if(h < 0 or h > self.h.dot(self.h)):
+            return None
+        w = v.dot(self.w)
+        if w < 0 or w > self.w.dot(self.w):
+            return None
+        return Hit(t, self.n, p, self.material)
+
+    #Rectangles are only used as area lights, which don't cast shadows
+    def shadowHit(self, ray, stats = None):
+        return None
+
+    #return bbox of Rectangle
+    def getBbox(self):
+        box = Bbox.fromPoints([self.p, self.p + self.w, self.p + self.h, self.p + self.w + self.h])
+        return Bbox(box.l - kEpsilon, box.u + kEpsilon)
 
     #Return sample point
     def sample(self):
@@ -276,10 +277,12 @@ class Triangle(GeometricObject):
         self.shadows = True
         self.type = "Triangle"
 
+    #Vectorized intersection of a RayPacket with a list of triangles
+    packetKernel = intersectTriangles
 
     def intersectRay(self, ray, sr):
         """ Determine if a ray intersects the triangle
-            Returns: the parameter t for the closest intersection point to
+            Returns: a Hit for the closest intersection point to
                      the ray origin.
                      Returns a value of None for no intersection
         """  
@@ -305,7 +308,7 @@ class Triangle(GeometricObject):
         s = e*j - f*i
 
         if (a*m+b*q+c*s) == 0:
-            return False
+            return None
         inv_denom = 1.0/(a*m+b*q+c*s)
 
         e1 = d*m - b*n - c*p
@@ -313,31 +316,28 @@ class Triangle(GeometricObject):
         beta = e1*inv_denom
 
         if(beta < 0.0):
-            return False
+            return None
 
         r = e*l - h*i
         e2 = a*n + d*q + c*r
         gamma = e2*inv_denom
 
         if(gamma < 0.0):
-            return False
+            return None
 
         if((beta+gamma) > 1.0):
-            return False
+            return None
 
         e3 = a*p - b*r + d*s
         t = e3*inv_denom
 
         if(t<self.kEpsilon):
-            return False
+            return None
 
-        self.t = t
-        self.normal = self.n
-        self.local_hit = ray.o + t*ray.d
-        return True
+        return Hit(t, self.n, ray.o.addScaled(ray.d, t), self.material)
 
-    #Same as intersectRay, without the sr, shadowing only
-    def shadowHit(self, ray):
+    #Same as intersectRay, without the sr, shadowing only, returns only t
+    def shadowHit(self, ray, stats = None):
         a = self.p0.x - self.p1.x
         b = self.p0.x - self.p2.x
         c = ray.d.x
@@ -360,7 +360,7 @@ class Triangle(GeometricObject):
         s = e*j - f*i
 
         if (a*m+b*q+c*s) == 0:
-            return False
+            return None
         inv_denom = 1.0/(a*m+b*q+c*s)
 
         e1 = d*m - b*n - c*p
@@ -368,29 +368,31 @@ class Triangle(GeometricObject):
         beta = e1*inv_denom
 
         if(beta < 0.0):
-            return False
+            return None
 
         r = e*l - h*i
         e2 = a*n + d*q + c*r
         gamma = e2*inv_denom
 
         if(gamma < 0.0):
-            return False
+            return None
 
         if((beta+gamma) > 1.0):
-            return False
+            return None
 
         e3 = a*p - b*r + d*s
         t = e3*inv_denom
 
         if(t<self.kEpsilon):
-            return False
+            return None
 
-        self.st = t
-        return True
+        return t
 
-    #Not used
+    #return bbox of Triangle
     def getBbox(self):
+        p0 = self.p0
+        p1 = self.p1
+        p2 = self.p2
         return Bbox(Point(min(min(p0.x, p1.x), p2.x) - kEpsilon, min(min(p0.y, p1.y), p2.y) - kEpsilon, min(min(p0.z, p1.z), p2.z) - kEpsilon), Point(max(max(p0.x, p1.x), p2.x) + kEpsilon, max(max(p0.y, p1.y), p2.y) + kEpsilon, max(max(p0.z, p1.z), p2.z) + kEpsilon))
 
     def getNormal(self, p):
@@ -4,46 +4,40 @@ from GeometricObjects import *
 class Instance:
     def __init__(self, object):
         """
+        An object moved, scaled or rotated without copying it
+        Any number of instances can share one object (a mesh and its BVH are shared the
+        same way), each only keeps its two matrices. The world's accelerator holds the
+        instances by their world space bbox
+
         Attributes:
             o: object of instance
-            inv_matrix: inverse transforms
-            forward: Ignore (does nothing right now)
+            forward: transforms from object to world space
+            inv_matrix: inverse transforms (world to object space)
             material: Material of object
-            position: position of object (For octree placement)
-            type: object type (For octree placement)
-            r: radius of object (sphere, for octree placement)
+            type: object type (For octree placement, instances fit their bbox)
+            coherent: if the World's coherence caches keep the instance (as they would its object)
         """
         self.o = object
-        self.inv_matrix = Matrix.identity()
         self.forward = Matrix.identity()
+        self.inv_matrix = Matrix.identity()
         self.material = object.material
-        self.position = self.o.position
-        self.type = self.o.type
-        self.r = self.o.r
+        self.type = "Instance"
+        self.coherent = object.coherent
 
-    #Not used
+    #Center of the world space bbox (For octree placement)
+    @property
+    def position(self):
+        box = self.getBbox()
+        if box == None:
+            return self.o.position.Mmult(self.forward)
+        return Point((box.l.x + box.u.x)/2, (box.l.y + box.u.y)/2, (box.l.z + box.u.z)/2)
+
+    #Return the world space bbox of the transformed object (None if the object is unbounded)
     def getBbox(self):
-        p = self.o.getBbox().getPoints()
-        transformed_p = []
-        for point in p:
-            transformed_p.append(point.Mmult(self.forward))
-        
-        l = transformed_p[0]
-        u = transformed_p[0]
-        for point in transformed_p:
-            if point.x < l.x:
-                l.x = point.x
-            if point.y < l.y:
-                l.y = point.y
-            if point.z < l.z:
-                l.z = point.z
-            if point.x > u.x:
-                u.x = point.x
-            if point.y > u.y:
-                u.y = point.y
-            if point.x > u.x:
-                u.z = point.z
-        return Bbox(l, u)
+        box = self.o.getBbox()
+        if box == None:
+            return None
+        return Bbox.fromPoints([point.Mmult(self.forward) for point in box.getPoints()])
 
     #Translate instance
     def translate(self, x, y, z):
@@ -72,30 +66,32 @@ class Instance:
 
     #Check Ray intersection
     def intersectRay(self, ray, sr):
-        #Transform ray
-        ro = ray.o.Mmult(self.inv_matrix)
-        rd = ray.d.Mmult(self.inv_matrix)
+        #Transform ray (Mmult by inv_matrix, written out)
+        a, b, c, tx, e, f, g, ty, i, j, k, tz, _, _, _, _ = self.inv_matrix.m
+        o = ray.o
+        d = ray.d
+        rd = Vector(a*d.x + b*d.y + c*d.z, e*d.x + f*d.y + g*d.z, i*d.x + j*d.y + k*d.z)
+        t_ray = Ray(Point(a*o.x + b*o.y + c*o.z + tx, e*o.x + f*o.y + g*o.z + ty, i*o.x + j*o.y + k*o.z + tz), rd)
 
         #Check transformed ray on object
-        t_ray = Ray(ro, rd)
         hit = self.o.intersectRay(t_ray, sr)
         if hit:
-            #Copy object values needed for sr
-            self.t = self.o.t
-            self.normal = self.o.normal.Mmult(self.inv_matrix).normalize()
-            self.local_hit = self.o.local_hit
-            self.material = self.o.material
-        return hit
+            #t is the same in both spaces, so the length of the transformed direction
+            #is the scale from world to object space
+            scale = hit.local_scale * rd.length() / d.length()
+            #Normals go back to world space by the transpose of the inverse
+            n = hit.normal
+            normal = Vector(a*n.x + e*n.y + i*n.z, b*n.x + f*n.y + j*n.z, c*n.x + g*n.y + k*n.z)
+            return Hit(hit.t, normal.normalize(), hit.local_hit, hit.material, scale)
+        return None
 
     #Shadow hit intersection
-    def shadowHit(self, ray):
+    def shadowHit(self, ray, stats = None):
         #Transform Ray
-        ro = ray.o.Mmult(self.inv_matrix)
-        rd = ray.d.Mmult(self.inv_matrix)
-        t_ray = Ray(ro, rd)        
+        a, b, c, tx, e, f, g, ty, i, j, k, tz, _, _, _, _ = self.inv_matrix.m
+        o = ray.o
+        d = ray.d
+        t_ray = Ray(Point(a*o.x + b*o.y + c*o.z + tx, e*o.x + f*o.y + g*o.z + ty, i*o.x + j*o.y + k*o.z + tz),
+                    Vector(a*d.x + b*d.y + c*d.z, e*d.x + f*d.y + g*d.z, i*d.x + j*d.y + k*d.z))
         #Check transformed ray to object
-        hit = self.o.shadowHit(t_ray)
-        if hit:
-            #Copy over object values needed for sr
-            self.st = self.o.st
-        return hit
\ No newline at end of file
+        return self.o.shadowHit(t_ray, stats)
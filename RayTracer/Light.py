@@ -12,6 +12,14 @@ class Light:
     def L(self, sr):
         pass
 
+    #Geometry term and pdf of the shaded light point, AreaLight samples its
+    #object and overrides them, lights at one point or direction have neither
+    def G(self, sr):
+        return 1.0
+
+    def pdf(self, sr):
+        return 1.0
+
 class AmbientLight(Light):
     def __init__(self, ls, color):
         """
@@ -42,25 +50,20 @@ class PointLight(Light):
         self.ls = ls
         self.color = color
 
-    #Get Vector to hit_point
+    #Get Vector to hit_point (its length is kept in sr for L)
     def getDirection(self, sr):
-        self.distance = (sr.hit_point - self.p).length()
-        return sr.hit_point - self.p
+        d = sr.hit_point - self.p
+        sr.light_distance = d.length()
+        return d
 
     #Return Light color
     def L(self, sr):
-        return self.ls * self.color / (self.distance * self.distance)
+        return self.ls * self.color / (sr.light_distance * sr.light_distance)
 
     #Check if object is in shadow
     def inShadow(self, ray, sr):
-        for object in sr.w.objects:
-            sr.w.addRay()
-            ts = (self.p - ray.o).length()
-            if object.shadowHit(ray):
-                if(object.st < ts):
-                    return True
-
-        return False
+        ts = (self.p - ray.o).length()
+        return sr.w.shadowHit(ray, ts, self)
 
 class DirectionLight(Light):
     def __init__(self, d, ls, color):
@@ -84,44 +87,34 @@ class DirectionLight(Light):
 
     #Check if object is in shadow
     def inShadow(self, ray, sr):
-        for object in sr.w.objects:
-            sr.w.addRay()
-            if object.shadowHit(ray):
-                return True
-        return False
+        return sr.w.shadowHit(ray, BIGTIME, self)
 
 class AreaLight(Light):
     """
     Attributes:
         o: object
-        p: point on sample
-        n: normal at p
-        wi: Direction Vector
+    The sample taken by getDirection is kept in sr (light_point, light_normal,
+    light_wi) so one light can shade several rays at once
     """
     def __init__(self, o):
         self.o = o
 
     #Get direction of the light
     def getDirection(self, sr):
-        self.p = self.o.sample()
-        self.n = self.o.getNormal(self.p)
-        self.wi = self.p - sr.hit_point
-        self.wi = self.wi.normalize()
-        return -1.0 * self.wi
+        p = self.o.sample()
+        sr.light_point = p
+        sr.light_normal = self.o.getNormal(p)
+        sr.light_wi = p.diff(sr.hit_point).normalize()
+        return -sr.light_wi
 
     #Check if in a shadow
     def inShadow(self, ray, sr):
-        ts = (self.p - ray.o) * ray.d
-        for object in sr.w.objects:
-            sr.w.addRay()
-            if object.shadowHit(ray) and object.st < ts:
-                return True
-
-        return False
+        ts = sr.light_point.diff(ray.o).dot(ray.d)
+        return sr.w.shadowHit(ray, ts, self)
 
     #Returns color depending on whether or not we are on the lit side
     def L(self, sr):
-        n = (-1.0*self.n * self.wi)
+        n = -sr.light_normal.dot(sr.light_wi)
 
         if(n > 0):
             return self.o.material.getLe()
@@ -130,9 +123,9 @@ class AreaLight(Light):
 
     #Get G
     def G(self, sr):
-        nd = (-1.0*self.n * self.wi)
-        d = self.p - sr.hit_point
-        ddot = d*d
+        nd = -sr.light_normal.dot(sr.light_wi)
+        d = sr.light_point.diff(sr.hit_point)
+        ddot = d.dot(d)
         return nd/ddot
 
     #Get pdf
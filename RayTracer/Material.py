@@ -1,12 +1,31 @@
 ﻿from Utilities import *
 from ShadeRec import *
 from Sampler import *
+from Texture import *
 
 # #419begin #type=3 #src= Ray Trace Ground Up
 class Material():
+    #Depth past which rays leaving this material aren't traced (at most RAYDEPTH)
+    max_depth = RAYDEPTH
+
     def shade(self, sr):
         pass
 
+    #shade and areaLightShade in two parts, the direct lighting of the hit and the light of the
+    #secondary rays the material spawns, added to the direct lighting L (see GBuffer.reshade)
+    #Materials that spawn no rays are all direct lighting
+    def shadeDirect(self, sr):
+        return self.shade(sr)
+
+    def areaLightDirect(self, sr):
+        return self.areaLightShade(sr)
+
+    def shadeSecondary(self, sr, L):
+        return L
+
+    def areaLightSecondary(self, sr, L):
+        return L
+
 class Matte(Material):
     def __init__(self, ka, kd, cd, sampler = None):
         """
@@ -22,12 +41,12 @@ class Matte(Material):
     #Non-area light shade function
     def shade(self, sr):
         #Add ambient light
-        L = self.ambient.rho(sr) * sr.w.ambient.L(sr)
+        L = self.ambient.rho(sr).modulate(sr.w.ambient.L(sr))
         #For each light, add up color
         for light in sr.w.lights:
-            wi = -1.0 * light.getDirection(sr)
+            wi = -light.getDirection(sr)
             wi = wi.normalize()
-            ndotwi = sr.normal * wi
+            ndotwi = sr.normal.dot(wi)
             if ndotwi > 0.0:
                 shadow = False
 
@@ -36,19 +55,19 @@ class Matte(Material):
                 shadow = light.inShadow(shadowRay, sr)
                 #No object in the way, so add the color
                 if not shadow:
-                    L += self.diffuse.f(sr) * light.L(sr) * ndotwi
+                    L.accumulate(self.diffuse.f(sr).modulate(light.L(sr)), ndotwi)
 
         return L
 
     #Area light shade func
     def areaLightShade(self, sr):
         #Add ambient light
-        L = self.ambient.rho(sr) * sr.w.ambient.L(sr)
+        L = self.ambient.rho(sr).modulate(sr.w.ambient.L(sr))
         #For each light, add up color
         for light in sr.w.lights:
-            wi = -1.0 * light.getDirection(sr)
+            wi = -light.getDirection(sr)
             wi = wi.normalize()
-            ndotwi = sr.normal * wi
+            ndotwi = sr.normal.dot(wi)
             if ndotwi > 0.0:
                 shadow = False
                 #Check if object is in the way
@@ -56,7 +75,7 @@ class Matte(Material):
                 shadow = light.inShadow(shadowRay, sr)
                 #No object in the way, so add color
                 if not shadow:
-                    L += self.diffuse.f(sr) * light.L(sr) * ndotwi * light.G(sr) / light.pdf(sr)
+                    L.accumulate(self.diffuse.f(sr).modulate(light.L(sr)), ndotwi * light.G(sr) / light.pdf(sr))
 
         return L
 
@@ -76,37 +95,37 @@ class Phong(Material):
 
     #Non area light shade, similar to Matte (but add specular)
     def shade(self, sr):
-        wo  = -1.0 * sr.ray.d
+        wo  = -sr.ray.d
         wo = wo.normalize()
-        L = self.ambient.rho(sr) * sr.w.ambient.L(sr)
+        L = self.ambient.rho(sr).modulate(sr.w.ambient.L(sr))
         for light in sr.w.lights:
-            wi = -1.0 * light.getDirection(sr)
+            wi = -light.getDirection(sr)
             wi = wi.normalize()
-            ndotwi = sr.normal * wi
+            ndotwi = sr.normal.dot(wi)
             if ndotwi > 0:
                 shadow = False
                 shadowRay = Ray(sr.hit_point, wi)
                 shadow = light.inShadow(shadowRay, sr)
                 if not shadow:
-                    L += (self.diffuse.f(sr) + self.specular.f(sr, wo, wi)) * light.L(sr) * ndotwi
+                    L.accumulate((self.diffuse.f(sr) + self.specular.f(sr, wo, wi)).modulate(light.L(sr)), ndotwi)
 
         return L
 
     #Area light shade, similar to Matte (but add specular)
     def areaLightShade(self, sr):
-        wo  = -1.0 * sr.ray.d
+        wo  = -sr.ray.d
         wo = wo.normalize()
-        L = self.ambient.rho(sr) * sr.w.ambient.L(sr)
+        L = self.ambient.rho(sr).modulate(sr.w.ambient.L(sr))
         for light in sr.w.lights:
-            wi = -1.0 * light.getDirection(sr)
+            wi = -light.getDirection(sr)
             wi = wi.normalize()
-            ndotwi = sr.normal * wi
+            ndotwi = sr.normal.dot(wi)
             if ndotwi > 0:
                 shadow = False
                 shadowRay = Ray(sr.hit_point, wi)
                 shadow = light.inShadow(shadowRay, sr)
                 if not shadow:
-                    L += (self.diffuse.f(sr) + self.specular.f(sr, wo, wi)) * light.L(sr) * ndotwi * light.G(sr) / light.pdf(sr)
+                    L.accumulate((self.diffuse.f(sr) + self.specular.f(sr, wo, wi)).modulate(light.L(sr)), ndotwi * light.G(sr) / light.pdf(sr))
 
         return L
 
@@ -119,29 +138,30 @@ class Reflective(Phong):
 
     #Non area light shade, similar to Phong (but add reflective)
     def shade(self, sr):
-        L = Phong.shade(self, sr)
-
-        wo = -1.0 * sr.ray.d
-        fr = self.reflective.sample_f(sr, wo)
-        wi = self.reflective.wi
-        reflectedRay = Ray(sr.hit_point, wi)
-        ndotwi = sr.normal * wi
-        L += fr * sr.w.tracer.trace(reflectedRay, sr.depth+1) * (ndotwi)
+        return self.shadeSecondary(sr, self.shadeDirect(sr))
 
-        return L
     #Area light shade, similar to Phong (but add reflective)
     def areaLightShade(self, sr):
-        L = Phong.areaLightShade(self, sr)
+        return self.areaLightSecondary(sr, self.areaLightDirect(sr))
 
-        wo = -1.0 * sr.ray.d
-        fr = self.reflective.sample_f(sr, wo)
-        wi = self.reflective.wi
-        reflectedRay = Ray(sr.hit_point, wi)
-        ndotwi = sr.normal * wi
-        L += fr * sr.w.tracer.trace(reflectedRay, sr.depth+1) * (ndotwi)
+    def shadeDirect(self, sr):
+        return Phong.shade(self, sr)
 
+    def areaLightDirect(self, sr):
+        return Phong.areaLightShade(self, sr)
+
+    #Add the reflected ray's color to L
+    def shadeSecondary(self, sr, L):
+        wo = -sr.ray.d
+        fr, wi = self.reflective.sample_f(sr, wo)
+        reflectedRay = Ray(sr.hit_point, wi)
+        ndotwi = sr.normal.dot(wi)
+        L.accumulate(fr.modulate(sr.w.tracer.spawn(sr, reflectedRay, fr.maxComponent() * ndotwi, "reflection")), ndotwi)
         return L
 
+    def areaLightSecondary(self, sr, L):
+        return self.shadeSecondary(sr, L)
+
 class GlossyReflective(Phong):
     def __init__(self, ka, kd, ks, cd, exp, kr, cr, sampler):
         #Subclass of phong
@@ -153,11 +173,18 @@ class GlossyReflective(Phong):
 
     #Area light shade, similar to Phong (but add reflective)
     def areaLightShade(self, sr):
-        L = Phong.areaLightShade(self, sr)
-        wo = -1.0 * sr.ray.d
-        fr = self.glossy.sample_f(sr, wo)
-        r_ray = Ray(sr.hit_point, self.glossy.wi)
-        L += fr * sr.w.tracer.trace(r_ray, sr.depth + 1) * (sr.normal * self.glossy.wi) / self.glossy.pdf
+        return self.areaLightSecondary(sr, self.areaLightDirect(sr))
+
+    def areaLightDirect(self, sr):
+        return Phong.areaLightShade(self, sr)
+
+    #Add the color of a glossy reflected ray to L
+    def areaLightSecondary(self, sr, L):
+        wo = -sr.ray.d
+        fr, wi, pdf = self.glossy.sample_f(sr, wo)
+        r_ray = Ray(sr.hit_point, wi)
+        s = sr.normal.dot(wi) / pdf
+        L.accumulate(fr.modulate(sr.w.tracer.spawn(sr, r_ray, fr.maxComponent() * s, "glossy")), s)
         return L
 
 
@@ -170,38 +197,28 @@ class Transparent(Reflective):
         self.reflective = PerfectSpecular(kr, cr)
         self.transparent = PerfectTransmitter(kt, ior)
 
-    #Non area light shade, similar to Reflective (but add Transparence)
-    def shade(self, sr):
-        L = Phong.shade(self, sr)
-        wo = -1.0 * sr.ray.d
-        fr = reflective.sample_f(sr, wo)
-        wi = self.reflective.wi
-        r_ray = Ray(sr.hit_point, wi)
-        if(self.transparent.tir(sr)):
-            L += sr.w.tracer.trace(r_ray, sr.depth + 1)
-        else:
-            ft = self.transparent.sample_f(sr, wo)
-            wt = self.transparent.wt
-            t_ray = Ray(sr.hit_point, wt)
-            L += fr * sr.w.tracer.trace(r_ray, sr.depth + 1) * math.fabs(sr.normal * wi)
-            L += ft * sr.w.tracer.trace(t_ray, sr.depth + 1) * math.fabs(sr.normal * wt)
-        return L
+    #Shade and area light shade are similar to Reflective (but add Transparence)
+    #Both light the hit with Phong.shade
+    def shadeDirect(self, sr):
+        return Phong.shade(self, sr)
 
-    #Area light shade, similar to Reflective (but add Transparence)
-    def areaLightShade(self, sr):
-        L = Phong.shade(self, sr)
-        wo = -1.0 * sr.ray.d
-        fr = self.reflective.sample_f(sr, wo)
-        wi = self.reflective.wi
+    def areaLightDirect(self, sr):
+        return Phong.shade(self, sr)
+
+    #Add the colors of the reflected and transmitted rays to L
+    def shadeSecondary(self, sr, L):
+        wo = -sr.ray.d
+        fr, wi = self.reflective.sample_f(sr, wo)
         r_ray = Ray(sr.hit_point, wi)
         if(self.transparent.tir(sr)):
-            L += sr.w.tracer.trace(r_ray, sr.depth + 1)
+            L += sr.w.tracer.spawn(sr, r_ray, 1.0, "reflection")
         else:
-            ft = self.transparent.sample_f(sr, wo)
-            wt = self.transparent.wt
+            ft, wt = self.transparent.sample_f(sr, wo)
             t_ray = Ray(sr.hit_point, wt)
-            L += fr * sr.w.tracer.trace(r_ray, sr.depth + 1) * math.fabs(sr.normal * wi)
-            L += ft * sr.w.tracer.trace(t_ray, sr.depth + 1) * math.fabs(sr.normal * wt)
+            kr = math.fabs(sr.normal.dot(wi))
+            kt = math.fabs(sr.normal.dot(wt))
+            L.accumulate(fr.modulate(sr.w.tracer.spawn(sr, r_ray, fr.maxComponent() * kr, "reflection")), kr)
+            L.accumulate(ft.modulate(sr.w.tracer.spawn(sr, t_ray, ft.maxComponent() * kt, "refraction")), kt)
         return L
 
 
@@ -251,28 +268,57 @@ class RegularSurface(Surface):
         return self.color
 
 class ImageTexture(Surface):
-    def __init__(self, texels, mapping, image_width, image_height):
+    def __init__(self, texels, mapping, filter = TEXTURE_FILTER):
         """
+        Takes in a MipMap (e.g. from loadTexture), a PIL image or an array (texels)
+
         Attrubutes:
-            t: list of texel values
+            t: MipMap of the texture
             m: Type of mapping
             hres: width
             vres: height
+            filter: "nearest", "bilinear" or "trilinear"
+            density: texels per object space unit on the mapped surface (picks the mip level)
         """
+        if not isinstance(texels, MipMap):
+            texels = MipMap(texels)
         self.t = texels
         self.m = mapping
-        self.hres = image_width
-        self.vres = image_height
+        self.hres, self.vres = texels.sizes[0]
+        self.filter = filter
+        self.density = mapping.texelDensity(self.hres, self.vres)
 
     #Return Color at sr.local_hit of the texture
     def getColor(self, sr):
-        column, row = self.m.getCoordinates(sr.local_hit, self.hres, self.vres)
-        r, g, b = self.t[column, row]
-        return Color(r/255.0, g/255.0, b/255.0)
+        #Shading a hit asks for its color several times, the first lookup is kept in sr
+        if sr.texture is self:
+            return sr.texel
+        u, v = self.m.getUV(sr.local_hit)
+        if self.filter == "nearest":
+            r, g, b = self.t.texel(int((self.hres - 1) * u), int((self.vres - 1) * v))
+        elif self.filter == "bilinear":
+            r, g, b = self.t.bilinear(0, u, v)
+        else:
+            #Texels a pixel of the camera covers at the hit, the mip level is its log2
+            texels = sr.w.view_port.s * sr.local_scale * self.density
+            r, g, b = self.t.trilinear(math.log2(texels) if texels > 1.0 else 0.0, u, v)
+        sr.texture = self
+        sr.texel = Color(r, g, b)
+        return sr.texel
 
 class TextureMapping:
+    #Texture coordinates (u, v) in 0-1 of local_hit
+    def getUV(self, local_hit):
+        return 0.0, 0.0
+
+    #Texels per object space unit for a hres x vres texture
+    def texelDensity(self, hres, vres):
+        return 1.0
+
+    #Column and row of the texel at local_hit
     def getCoordinates(self, local_hit, hres, vres):
-        pass
+        u, v = self.getUV(local_hit)
+        return int((hres - 1) * u), int((vres - 1) * v)
 
 class SphericalMapping(TextureMapping):
     def __init__(self, r):
@@ -286,9 +332,10 @@ class SphericalMapping(TextureMapping):
         self.r = 0
         self.radius = r
 
-    #get c and r for texel
-    def getCoordinates(self, local_hit, hres, vres):
-        theta = math.acos(local_hit.y/self.radius)
+    #get u and v of the texel
+    def getUV(self, local_hit):
+        #Clamped, a hit on the pole can be a rounding error past the radius
+        theta = math.acos(max(-1.0, min(1.0, local_hit.y/self.radius)))
         phi = math.atan2(local_hit.x/self.radius, local_hit.z/self.radius)
         pi = math.pi
 
@@ -297,10 +344,11 @@ class SphericalMapping(TextureMapping):
 
         u = phi * (1.0/(2*pi))
         v = 1.0 - theta * (1.0 / pi)
-        c = int((hres - 1) * u)
-        r = int((vres - 1) * v)
+        return u, v
 
-        return c, r
+    #Texels per unit along the equator, the texture wraps once around and half way over
+    def texelDensity(self, hres, vres):
+        return max(hres / (2*math.pi*self.radius), vres / (math.pi*self.radius))
 
 
 class BRDF:
@@ -318,16 +366,16 @@ class Lambertian(BRDF):
         self.kd = kd
         self.surface = surface
         if sampler != None:
-            self.sampler = sampler
-            self.sampler.mapHemisphere(1)
+            #Own view of the shared samples, mapped to a cosine hemisphere
+            self.sampler = sampler.hemisphere(1)
 
     #Return kd * color
     def rho(self, sr):
-        return self.kd * self.surface.getColor(sr)
+        return self.surface.getColor(sr).scale(self.kd)
 
     #Return kd * color / PI
     def f(self, sr):
-        return (self.kd * self.surface.getColor(sr))/math.pi
+        return self.surface.getColor(sr).scale(self.kd / math.pi)
 
     #Sample sampler, return values for coloring
     def sample_f(self, sr):
@@ -357,15 +405,16 @@ class GlossySpecular(BRDF):
         self.surface = surface
         self.exp = exp
         if(sampler != None):
-            self.sampler = Regular(25, 83)
+            self.sampler = sampler.hemisphere(exp)
 
     #Set up samples
     def setSamples(self, exp):
-        self.sampler.mapHemisphere(exp)
+        if getattr(self, "sampler", None) != None:
+            self.sampler.mapHemisphere(exp)
 
     #Return L (coloring)
     def f(self, sr, wo, wi):
-        ndotwi = sr.normal * wi
+        ndotwi = sr.normal.dot(wi)
         r = -1.0 * wi + 2 * sr.normal * ndotwi
         rdotwo = r * wo
         L = Color(0, 0, 0)
@@ -375,24 +424,22 @@ class GlossySpecular(BRDF):
 
         return L
 
-    #Sample sampler, return coloring value
+    #Sample sampler, return coloring value, the sampled direction wi and its pdf
     def sample_f(self, sr, wo):
-        ndotwo = sr.normal * wo
+        ndotwo = sr.normal.dot(wo)
         r = -1.0 * wo + 2 * sr.normal * ndotwo
         w = r
         u = Vector(0.00424, 1, 0.00764).cross(w)
         u.normalize()
         v = u.cross(w)
         sp = self.sampler.sampleHemisphere()
-        #Store wi
-        self.wi = sp.x * u + sp.y * v + sp.z * w
-        if sr.normal * self.wi < 0.0:
-            self.wi = -1.0 * sp.x * u - sp.y * v - sp.z * w
+        wi = sp.x * u + sp.y * v + sp.z * w
+        if sr.normal.dot(wi) < 0.0:
+            wi = -1.0 * sp.x * u - sp.y * v - sp.z * w
 
-        phong_lobe = pow(r * self.wi, self.exp)
-        #Store pdf
-        self.pdf = phong_lobe * (sr.normal * self.wi)
-        return (self.ks * self.surface.getColor(sr) * phong_lobe)
+        phong_lobe = pow(r.dot(wi), self.exp)
+        pdf = phong_lobe * sr.normal.dot(wi)
+        return (self.ks * self.surface.getColor(sr) * phong_lobe), wi, pdf
 
 class PerfectSpecular(BRDF):
     def __init__(self, kr, surface):
@@ -408,13 +455,12 @@ class PerfectSpecular(BRDF):
     def f(self):
         return Color(0, 0, 0)
 
-    #Return coloring values
+    #Return coloring values and the mirror direction wi
     def sample_f(self, sr, wo):
-        ndotwo = sr.normal * wo
-        #Store wi
-        self.wi = -1.0 * wo + 2 * sr.normal * ndotwo
-        pdf = math.fabs(sr.normal * self.wi)
-        return (self.kr * self.surface.getColor(sr) / pdf)
+        ndotwo = sr.normal.dot(wo)
+        wi = -1.0 * wo + 2 * sr.normal * ndotwo
+        pdf = math.fabs(sr.normal.dot(wi))
+        return (self.kr * self.surface.getColor(sr) / pdf), wi
 
 class PerfectTransmitter(BRDF):
     def __init__(self, kt, ior):
@@ -430,9 +476,9 @@ class PerfectTransmitter(BRDF):
     def f(self):
         pass
 
-    #Return White modified by refraction values
+    #Return White modified by refraction values and the transmitted direction wt
     def sample_f(self, sr, wo):
-        cos_thetai = sr.normal * wo
+        cos_thetai = sr.normal.dot(wo)
         n = sr.normal
         eta = self.ior
         if cos_thetai < 0.0:
@@ -442,9 +488,8 @@ class PerfectTransmitter(BRDF):
 
         temp = 1.0 - (1.0 - cos_thetai*cos_thetai) / (eta*eta)
         cos_theta2 = math.sqrt(temp)
-        #Save wt
-        self.wt = -1.0 * wo / eta - (cos_theta2 - cos_thetai / eta) * n
-        return (self.kt / (eta * eta) * Color(1, 1, 1) / math.fabs(sr.normal * self.wt))
+        wt = -1.0 * wo / eta - (cos_theta2 - cos_thetai / eta) * n
+        return (self.kt / (eta * eta) * Color(1, 1, 1) / math.fabs(sr.normal.dot(wt))), wt
 
     #Ignore
     def rho(self):
@@ -453,7 +498,7 @@ class PerfectTransmitter(BRDF):
     #Total internal reflection
     def tir(self, sr):
         wo = -1.0 * sr.ray.d
-        cos_thetai = sr.normal * wo
+        cos_thetai = sr.normal.dot(wo)
         eta = self.ior
         if cos_thetai < 0.0:
             eta = 1.0/eta
@@ -0,0 +1,214 @@
+import math
+import numpy as np
+from BVH import *
+from GeometricObjects import *
+from ShadeRec import *
+from Utilities import *
+from Constants import *
+
+class TriangleMesh(GeometricObject):
+    """
+    Triangle mesh stored in NumPy arrays, with shared vertices and its own BVH
+
+    The mesh is one object to the world's accelerator, its triangles are the
+    leaves of the mesh's BVH. Triangles are reordered into leaf order when the
+    BVH is built, so a leaf is a contiguous range of the triangle arrays.
+    Only the shared float32 vertices and the vertex indices of the triangles are
+    stored, the edges and normals are worked out in doubles when a ray is tested.
+    The difference of two float32 vertices is exact in a double, so the triangles
+    that share an edge see the same edge and there are no cracks between them.
+    The boxes of the BVH are float64 so rounding can't pull them inside a triangle.
+    """
+    coherent = False
+
+    def __init__(self, vertices, faces, material, leaf_size = BVH_LEAF_SIZE):
+        """
+        Takes in:
+            (V, 3) array of vertex positions (vertices)
+            (T, 3) array of indices into vertices, one row per triangle (faces)
+        Triangles with no area are dropped
+
+        Attributes:
+            vertices: (V, 3) float32 array of vertex positions
+            faces: (T, 3) int32 array of vertex indices, in leaf order
+            points, corners: flat views of vertices and faces that the walk reads
+            material: material of the mesh
+            position: center of the mesh's bbox (for Octree)
+            type: type of object for Octree
+            bounds, child, start, count, axis: node arrays of the mesh BVH (see buildArrays)
+        """
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+        p0 = self.vertices[faces[:, 0]].astype(np.float64)
+        p1 = self.vertices[faces[:, 1]].astype(np.float64)
+        p2 = self.vertices[faces[:, 2]].astype(np.float64)
+        n = np.cross(p1 - p0, p2 - p0)
+        keep = (n*n).sum(axis=1) > 0.0
+        faces, p0, p1, p2 = faces[keep], p0[keep], p1[keep], p2[keep]
+
+        lo = np.minimum(np.minimum(p0, p1), p2) - kEpsilon
+        hi = np.maximum(np.maximum(p0, p1), p2) + kEpsilon
+        bounds, self.child, self.start, self.count, self.axis, order = buildArrays(lo, hi, leaf_size)
+        self.bounds = bounds
+        self.faces = np.ascontiguousarray(faces[order])
+        self.points = self.vertices.reshape(-1).data
+        self.corners = self.faces.reshape(-1).data
+
+        self.material = material
+        self.shadows = True
+        self.type = "Mesh"
+        if len(faces):
+            self.lo = lo.min(axis=0).tolist()
+            self.hi = hi.max(axis=0).tolist()
+        else:
+            self.lo = [0.0, 0.0, 0.0]
+            self.hi = [0.0, 0.0, 0.0]
+        self.position = Point((self.lo[0] + self.hi[0])/2, (self.lo[1] + self.hi[1])/2, (self.lo[2] + self.hi[2])/2)
+
+    #The flat views can't be pickled, so they are remade after a copy
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["points"]
+        del state["corners"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.points = self.vertices.reshape(-1).data
+        self.corners = self.faces.reshape(-1).data
+
+    #Number of triangles
+    def __len__(self):
+        return self.faces.shape[0]
+
+    #return bbox of the mesh
+    def getBbox(self):
+        if len(self) == 0:
+            return None
+        return Bbox(Point(*self.lo), Point(*self.hi))
+
+    def intersectRay(self, ray, sr):
+        """ Determine if a ray intersects the mesh
+            Returns: a Hit for the closest triangle to the ray origin.
+                     Returns a value of None for no intersection
+        """
+        tmin, k = self.closest(ray, BIGTIME, sr.w.stats if sr != None else None)
+        if k < 0:
+            return None
+        return Hit(tmin, self.normal(k), ray.o.addScaled(ray.d, tmin), self.material)
+
+    #Unit normal of triangle k, it follows the winding of the face (counter clockwise is the front)
+    def normal(self, k):
+        P = self.points
+        C = self.corners
+        i0 = 3*C[3*k]
+        i1 = 3*C[3*k+1]
+        i2 = 3*C[3*k+2]
+        ax = P[i1] - P[i0]
+        ay = P[i1+1] - P[i0+1]
+        az = P[i1+2] - P[i0+2]
+        bx = P[i2] - P[i0]
+        by = P[i2+1] - P[i0+1]
+        bz = P[i2+2] - P[i0+2]
+        nx = ay*bz - az*by
+        ny = az*bx - ax*bz
+        nz = ax*by - ay*bx
+        length = math.sqrt(nx*nx + ny*ny + nz*nz)
+        return Vector(nx / length, ny / length, nz / length)
+
+    #Intersect for shadow rays, returns t of the closest triangle or None
+    def shadowHit(self, ray, stats = None):
+        if not self.shadows:
+            return None
+        tmin, k = self.closest(ray, BIGTIME, stats)
+        if k < 0:
+            return None
+        return tmin
+
+    def closest(self, ray, tmin, stats = None):
+        """
+        Walk the mesh BVH front to back for the closest triangle hit before tmin
+        Node visits and triangle tests are counted in stats (a RenderStats)
+        Returns: the time of the hit and the index of the triangle (-1 for a miss)
+        """
+        if len(self.child) == 0:
+            return tmin, -1
+        ox, oy, oz = ray.o.x, ray.o.y, ray.o.z
+        dx, dy, dz = ray.d.x, ray.d.y, ray.d.z
+        ix, iy, iz = safeInverse(dx), safeInverse(dy), safeInverse(dz)
+        nx = 0 if ix >= 0 else 3
+        ny = 1 if iy >= 0 else 4
+        nz = 2 if iz >= 0 else 5
+        fx, fy, fz = (nx + 3) % 6, (ny + 3) % 6, (nz + 3) % 6
+        negative = (ix < 0, iy < 0, iz < 0)
+        bounds = self.bounds
+        child = self.child
+        P = self.points
+        C = self.corners
+        best = -1
+        visits = 0
+        tests = 0
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            visits += 1
+            k = 6*node
+            tnear = max((bounds[k+nx] - ox)*ix, (bounds[k+ny] - oy)*iy, (bounds[k+nz] - oz)*iz)
+            tfar = min((bounds[k+fx] - ox)*ix, (bounds[k+fy] - oy)*iy, (bounds[k+fz] - oz)*iz)
+            if tnear > tfar or tfar < kEpsilon or tnear > tmin:
+                continue
+            right = child[node]
+            if right < 0:
+                first = self.start[node]
+                tests += self.count[node]
+                for k in range(first, first + self.count[node]):
+                    #Same Cramer's rule as Triangle.intersectRay, on p0 and the edges p0-p1 and p0-p2
+                    i0 = 3*C[3*k]
+                    i1 = 3*C[3*k+1]
+                    i2 = 3*C[3*k+2]
+                    x0 = P[i0]
+                    y0 = P[i0+1]
+                    z0 = P[i0+2]
+                    a = x0 - P[i1]
+                    b = x0 - P[i2]
+                    e = y0 - P[i1+1]
+                    f = y0 - P[i2+1]
+                    i = z0 - P[i1+2]
+                    j = z0 - P[i2+2]
+                    d = x0 - ox
+                    h = y0 - oy
+                    l = z0 - oz
+
+                    m = f*dz - dy*j
+                    q = dy*i - e*dz
+                    s = e*j - f*i
+                    denom = a*m + b*q + dx*s
+                    if denom == 0.0:
+                        continue
+                    inv_denom = 1.0 / denom
+
+                    n = h*dz - dy*l
+                    p = f*l - h*j
+                    beta = (d*m - b*n - dx*p) * inv_denom
+                    if beta < 0.0:
+                        continue
+                    r = e*l - h*i
+                    gamma = (a*n + d*q + dx*r) * inv_denom
+                    if gamma < 0.0 or beta + gamma > 1.0:
+                        continue
+                    t = (a*p - b*r + d*s) * inv_denom
+                    if t >= kEpsilon and t < tmin:
+                        tmin = t
+                        best = k
+            #Visit the child nearer to the ray origin first
+            elif negative[self.axis[node]]:
+                stack.append(node + 1)
+                stack.append(right)
+            else:
+                stack.append(right)
+                stack.append(node + 1)
+        if stats != None:
+            stats.node_visits += visits
+            stats.primitive_tests += tests
+        return tmin, best
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+
+#Bump when the cache layout changes so old caches are parsed again
+CACHE_VERSION = 1
+
+def cachePath(filename):
+    """ Returns: the path of the binary cache kept next to an OBJ file """
+    return filename + ".cache.npz"
+
+def loadOBJ(filename, cache = True):
+    """
+    Read the vertices and faces of an OBJ file
+    Takes in:
+        The path of the OBJ file (filename)
+        Whether to use and write the binary cache next to it (cache)
+    The cache remembers the size and modification time of the file it was made
+    from, so an edited OBJ is parsed again
+    Returns: (V, 3) float32 array of vertices and (T, 3) int32 array of zero based
+             vertex indices, one row per triangle
+    """
+    st = os.stat(filename)
+    key = np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+    path = cachePath(filename)
+    if cache and os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                if np.array_equal(data["key"], key):
+                    return data["vertices"], data["faces"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with open(filename, "rb") as f:
+        vertices, faces = parseOBJ(f.read())
+
+    if cache:
+        #Write to a temporary file first so a reader never sees half a cache
+        tmp = path + ".tmp%d.npz" % os.getpid()
+        try:
+            np.savez(tmp, key=key, vertices=vertices, faces=faces)
+            os.replace(tmp, path)
+        except OSError:
+            #Read only folder, the mesh is still usable without a cache
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return vertices, faces
+
+def parseOBJ(data):
+    """
+    Parse the text of an OBJ file in bulk
+    Only v and f lines are read. Faces can use the v, v/vt, v//vn and v/vt/vn
+    forms and negative (relative) indices, polygons are split into triangle fans
+    Returns: (V, 3) float32 array of vertices and (T, 3) int32 array of zero based
+             vertex indices
+    """
+    lines = data.splitlines()
+    heads = np.array([l[:2] for l in lines], dtype="S2")
+    is_v = (heads == b"v ") | (heads == b"v\t")
+    is_f = (heads == b"f ") | (heads == b"f\t")
+    vlines = [lines[i] for i in np.flatnonzero(is_v)]
+    flines = [lines[i] for i in np.flatnonzero(is_f)]
+
+    vertices = _parseVertices(vlines)
+    if not flines:
+        return vertices, np.zeros((0, 3), dtype=np.int32)
+
+    #Tokens of all faces, every face starts with its "f"
+    tokens = np.array(b" ".join(flines).split())
+    marks = np.flatnonzero(tokens == b"f")
+    sizes = np.diff(np.append(marks, tokens.shape[0])) - 1
+    corners = np.delete(tokens, marks)
+    #Keep the vertex index of v/vt/vn
+    if np.char.find(corners, b"/").max() >= 0:
+        corners = np.char.partition(corners, b"/")[:, 0]
+    index = corners.astype(np.int64)
+
+    #Negative indices count back from the last vertex read before the face
+    before = np.cumsum(is_v)[is_f]
+    base = np.repeat(before, sizes)
+    index = np.where(index < 0, base + index, index - 1)
+
+    #Fan of (c0, ci, ci+1) for every polygon with at least 3 corners
+    first = np.cumsum(sizes) - sizes
+    tris = np.maximum(sizes - 2, 0)
+    face = np.repeat(np.arange(sizes.shape[0]), tris)
+    i = np.arange(face.shape[0]) - np.repeat(np.cumsum(tris) - tris, tris) + 1
+    s = first[face]
+    faces = np.stack((index[s], index[s + i], index[s + i + 1]), axis=1)
+    if faces.size and (faces.min() < 0 or faces.max() >= vertices.shape[0]):
+        raise ValueError("OBJ face refers to a vertex that does not exist")
+    return vertices, faces.astype(np.int32)
+
+def _parseVertices(vlines):
+    """ (V, 3) float32 array of the positions on the v lines (w and vertex colors are dropped) """
+    if not vlines:
+        return np.zeros((0, 3), dtype=np.float32)
+    tokens = b" ".join(vlines).split()
+    width = len(vlines[0].split())
+    if len(tokens) == width * len(vlines) and width >= 4:
+        rows = np.array(tokens).reshape(-1, width)
+        if (rows[:, 0] == b"v").all():
+            return rows[:, 1:4].astype(np.float32)
+    #Lines of different lengths, go one line at a time
+    return np.array([l.split()[1:4] for l in vlines]).astype(np.float32)
@@ -1,6 +1,8 @@
 ﻿from GeometricObjects import *
 from ShadeRec import *
 from Material import *
+from array import array
+import heapq
 import Constants
 #Maximum number of objects a leaf can hold before it adds children
 
@@ -72,7 +74,11 @@ class Octree:
         """
         self.root = self.addNode(Point(0, 0, 0), ws, [], -1)
         self.ws = ws
-        
+
+    def flatten(self):
+        """ Returns: a FlatOctree copy of the tree for traversal """
+        return FlatOctree(self)
+
     def addNode(self, p, s, o, h):
         """ Creates the actual node and returns it """
         return Octnode(p, s, o, h)
@@ -151,6 +157,21 @@ class Octree:
 
         return root
 
+    def remove(self, obj):
+        """
+        Take obj out of the node that holds it (e.g. to insert it again after it moved)
+        Returns: True if obj was found
+        """
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            for i in range(len(node.o)):
+                if node.o[i] is obj:
+                    del node.o[i]
+                    return True
+            nodes.extend(c for c in node.children if c != None)
+        return False
+
     def findDirection(self, root, ob):
         """ 
         Finds which child of root that holds obj inside of it
@@ -223,6 +244,254 @@ class Octree:
         elif ob.type == "Plane":
             #Keep on root always
             child = 8
+        else:
+            #Anything else (meshes) has to fit its bbox in the child's box
+            box = ob.getBbox()
+            if box == None:
+                child = 8
+            elif box.l.x < p3.x-off or box.l.y < p3.y-off or box.l.z < p3.z-off:
+                child = 8
+            elif box.u.x > p3.x+off or box.u.y > p3.y+off or box.u.z > p3.z+off:
+                child = 8
         return child
 
-        
\ No newline at end of file
+        
+
+
+class FlatOctree:
+
+    def __init__(self, tree):
+        """
+        Compacted copy of an Octree, stored in flat arrays and walked with a stack
+
+        Nodes are numbered breadth first, so the children of a node are contiguous.
+        The bounds of a node enclose the bboxes of all objects in its subtree, so an
+        object is always found through its node even if it sticks out of its cell.
+
+        Attributes:
+            objects: objects of all nodes, each node holds a contiguous range
+            unbounded: objects without a bbox (planes), tested by every ray
+            bounds: 6 floats per node (lower xyz, upper xyz)
+            first_child, child_count: range of a node's children
+            start, count: range of a node's objects
+            parent: parent of every node (-1 for the root)
+            node_of: bounded object -> node that holds it (for refit)
+            built_area: summed box area of the nodes when flattened (see refit)
+        """
+        self.objects = []
+        self.unbounded = []
+        self.bounds = array('d')
+        self.first_child = array('i')
+        self.child_count = array('b')
+        self.start = array('i')
+        self.count = array('i')
+        self.parent = array('i', [-1])
+        self.node_of = {}
+
+        nodes = [tree.root]
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            lo = [BIGTIME, BIGTIME, BIGTIME]
+            hi = [-BIGTIME, -BIGTIME, -BIGTIME]
+            self.start.append(len(self.objects))
+            for ob in node.o:
+                box = ob.getBbox()
+                if box == None:
+                    self.unbounded.append(ob)
+                    continue
+                self.objects.append(ob)
+                self.node_of[ob] = i
+                lo = [min(lo[0], box.l.x), min(lo[1], box.l.y), min(lo[2], box.l.z)]
+                hi = [max(hi[0], box.u.x), max(hi[1], box.u.y), max(hi[2], box.u.z)]
+            self.count.append(len(self.objects) - self.start[i])
+            self.bounds.extend(lo + hi)
+
+            children = [c for c in node.children if c != None] if not node.leaf else []
+            self.first_child.append(len(nodes))
+            self.child_count.append(len(children))
+            for c in children:
+                self.parent.append(i)
+                nodes.append(c)
+            i += 1
+
+        #Grow every parent's bounds around its children's, deepest nodes first
+        b = self.bounds
+        for c in range(len(nodes) - 1, 0, -1):
+            p = 6*self.parent[c]
+            k = 6*c
+            for a in range(3):
+                b[p+a] = min(b[p+a], b[k+a])
+                b[p+a+3] = max(b[p+a+3], b[k+a+3])
+        self.built_area = self.area()
+
+    #Summed surface area of the node boxes, grows as refit stretches them
+    def area(self):
+        return boundsArea(self.bounds)
+
+    def refit(self, objects):
+        """
+        Fit the node bounds around the current bboxes of objects, after they moved
+        Objects stay in the node they were flattened into, only that node and the
+        nodes above it are updated, so the walk slows down the further objects move
+        """
+        b = self.bounds
+        #Children come after their parent, so the deepest nodes are refit first
+        queued = set(self.node_of[ob] for ob in objects if ob in self.node_of)
+        heap = [-node for node in queued]
+        heapq.heapify(heap)
+        while heap:
+            node = -heapq.heappop(heap)
+            lo = [BIGTIME, BIGTIME, BIGTIME]
+            hi = [-BIGTIME, -BIGTIME, -BIGTIME]
+            for j in range(self.start[node], self.start[node] + self.count[node]):
+                box = self.objects[j].getBbox()
+                lo = [min(lo[0], box.l.x), min(lo[1], box.l.y), min(lo[2], box.l.z)]
+                hi = [max(hi[0], box.u.x), max(hi[1], box.u.y), max(hi[2], box.u.z)]
+            c = self.first_child[node]
+            for k in range(6*c, 6*(c + self.child_count[node]), 6):
+                lo = [min(lo[0], b[k]), min(lo[1], b[k+1]), min(lo[2], b[k+2])]
+                hi = [max(hi[0], b[k+3]), max(hi[1], b[k+4]), max(hi[2], b[k+5])]
+            k = 6*node
+            if b[k:k+6].tolist() == lo + hi:
+                continue
+            b[k:k+6] = array('d', lo + hi)
+            parent = self.parent[node]
+            if parent >= 0 and parent not in queued:
+                queued.add(parent)
+                heapq.heappush(heap, -parent)
+
+    def entry(self, node, ox, oy, oz, ix, iy, iz):
+        """ Returns: the time the ray enters node's bounds, or None if it misses them """
+        b = self.bounds
+        k = 6*node
+        #Nodes with nothing below them keep the inverted box they started with, every ray misses them
+        if b[k] > b[k+3]:
+            return None
+        t1 = (b[k] - ox)*ix
+        t2 = (b[k+3] - ox)*ix
+        tnear = min(t1, t2)
+        tfar = max(t1, t2)
+        t1 = (b[k+1] - oy)*iy
+        t2 = (b[k+4] - oy)*iy
+        tnear = max(tnear, min(t1, t2))
+        tfar = min(tfar, max(t1, t2))
+        t1 = (b[k+2] - oz)*iz
+        t2 = (b[k+5] - oz)*iz
+        tnear = max(tnear, min(t1, t2))
+        tfar = min(tfar, max(t1, t2))
+        if tnear > tfar or tfar < kEpsilon:
+            return None
+        return tnear
+
+    def hit(self, ray, sr, stats = None, tmin = BIGTIME, closest = None):
+        """
+        Find the closest object the ray hits and fill in sr
+        Nodes are visited front to back and the walk stops at nodes the ray
+        enters after the closest hit found so far
+        A hit already in sr (at tmin, on closest) is only replaced by closer ones,
+        closest isn't tested again
+        Node visits, intersection tests and the hit are counted in stats (a RenderStats)
+        Returns: the time of the closest hit (BIGTIME if nothing is hit) and the object hit
+        """
+        known = closest
+        for object in self.unbounded:
+            if object is known:
+                continue
+            hit = object.intersectRay(ray, sr)
+            if hit and hit.t < tmin:
+                sr.setHit(ray, hit)
+                tmin = hit.t
+                closest = object
+        visits = 0
+        tests = len(self.unbounded)
+
+        ox, oy, oz = ray.o.x, ray.o.y, ray.o.z
+        ix, iy, iz = safeInverse(ray.d.x), safeInverse(ray.d.y), safeInverse(ray.d.z)
+        t = self.entry(0, ox, oy, oz, ix, iy, iz)
+        objects = self.objects
+        first_child = self.first_child
+        child_count = self.child_count
+        #Stack of nodes with the times the ray enters them
+        nodes = [0] if t != None else []
+        times = [t]
+        while nodes:
+            node = nodes.pop()
+            visits += 1
+            if times.pop() > tmin:
+                continue
+            first = self.start[node]
+            tests += self.count[node]
+            for j in range(first, first + self.count[node]):
+                object = objects[j]
+                if object is known:
+                    continue
+                hit = object.intersectRay(ray, sr)
+                if hit and hit.t < tmin:
+                    sr.setHit(ray, hit)
+                    tmin = hit.t
+                    closest = object
+            n = child_count[node]
+            if n:
+                c = first_child[node]
+                hits = []
+                for child in range(c, c + n):
+                    t = self.entry(child, ox, oy, oz, ix, iy, iz)
+                    if t != None and t <= tmin:
+                        hits.append((t, child))
+                #Push the farthest first so the nearest child is visited next
+                hits.sort(reverse = True)
+                for t, child in hits:
+                    nodes.append(child)
+                    times.append(t)
+
+        if stats != None:
+            stats.node_visits += visits
+            stats.primitive_tests += tests
+            if closest != None:
+                stats.addHit(closest)
+        return tmin, closest
+
+    def shadowHit(self, ray, tmax, stats = None):
+        """
+        Any-hit query for shadow rays
+        Node visits and intersection tests are counted in stats (a RenderStats)
+        Returns: the first object found that blocks the ray before tmax (None if nothing does)
+        """
+        visits = 0
+        tests = 0
+        blocked = None
+        for object in self.unbounded:
+            tests += 1
+            t = object.shadowHit(ray, stats)
+            if t != None and t < tmax:
+                blocked = object
+                break
+
+        ox, oy, oz = ray.o.x, ray.o.y, ray.o.z
+        ix, iy, iz = safeInverse(ray.d.x), safeInverse(ray.d.y), safeInverse(ray.d.z)
+        objects = self.objects
+        first_child = self.first_child
+        child_count = self.child_count
+        nodes = [] if blocked != None else [0]
+        while nodes and blocked == None:
+            node = nodes.pop()
+            visits += 1
+            t = self.entry(node, ox, oy, oz, ix, iy, iz)
+            #Nodes past the light can't block it
+            if t == None or t > tmax:
+                continue
+            first = self.start[node]
+            for j in range(first, first + self.count[node]):
+                tests += 1
+                t = objects[j].shadowHit(ray, stats)
+                if t != None and t < tmax:
+                    blocked = objects[j]
+                    break
+            c = first_child[node]
+            nodes.extend(range(c, c + child_count[node]))
+
+        if stats != None:
+            stats.node_visits += visits
+            stats.primitive_tests += tests
+        return blocked
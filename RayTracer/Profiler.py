@@ -0,0 +1,254 @@
+import threading
+import time
+from Constants import *
+from GeometricObjects import *
+from Light import *
+from Material import *
+
+#Methods timed per kind of scene object
+PRIMITIVE_METHODS = ("intersectRay", "shadowHit")
+MATERIAL_METHODS = ("shade", "areaLightShade")
+LIGHT_METHODS = ("inShadow",)
+TEXTURE_METHODS = ("getColor",)
+MAPPING_METHODS = ("getUV",)
+WORLD_METHODS = ("hitObjects", "shadowHit")
+
+class Profiler:
+    def __init__(self):
+        """
+        Opt-in profiler for the hot paths of a render
+
+        attach(world) swaps the timed methods of the world, its objects, materials,
+        textures and lights for timed wrappers on those instances only, detach()
+        puts the class methods back. Every wrapped object gets a label like
+        "Sphere#2", so the timings are kept per scene object.
+        Worker processes can't send their timings back, profile serial or threaded renders.
+
+        Every thread counts into dicts of its own, so threads never update the same
+        counters, they are added up into entries and stacks by merge (detach and the
+        reports merge first)
+
+        Attributes:
+            entries: "label.method" -> [calls, total ns, self ns], summed over the threads by merge
+            stacks: tuple of "label.method" frames -> self ns spent in the last frame, summed by merge
+            threads: (entries, stacks) of every thread that timed a call
+            lock: guards threads
+            wrapped: (object, method name) of every wrapper, for detach
+            classes: (object, original class) of every object wrapClass gave a subclass
+            labels: id of a scene object -> its label
+            counts: objects labelled so far per type name
+            local: per thread stack of the frames being timed and the thread's entries and stacks
+        """
+        self.entries = {}
+        self.stacks = {}
+        self.threads = []
+        self.lock = threading.Lock()
+        self.wrapped = []
+        self.classes = []
+        self.labels = {}
+        self.counts = {}
+        self.local = threading.local()
+
+    #Label of a scene object, numbered per type in the order they are found
+    def label(self, ob):
+        key = id(ob)
+        if key not in self.labels:
+            name = type(ob).__name__
+            n = self.counts.get(name, 0)
+            self.counts[name] = n + 1
+            self.labels[key] = "{0}#{1}".format(name, n)
+        return self.labels[key]
+
+    def timer(self, key, method):
+        """ Returns: a function that calls method and adds its time to the thread's entry and stacks of key """
+        self.entries.setdefault(key, [0, 0, 0])
+        local = self.local
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            frames = getattr(local, "frames", None)
+            if frames == None:
+                frames = local.frames = []
+                local.child = []
+                local.entries = {}
+                local.stacks = {}
+                with self.lock:
+                    self.threads.append((local.entries, local.stacks))
+            child = local.child
+            frames.append(key)
+            child.append(0)
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                inner = child.pop()
+                stack = tuple(frames)
+                frames.pop()
+                #Time of this call is child time of the frame that called it
+                if child:
+                    child[-1] += elapsed
+                entry = local.entries.get(key)
+                if entry == None:
+                    entry = local.entries[key] = [0, 0, 0]
+                stacks = local.stacks
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += elapsed - inner
+                stacks[stack] = stacks.get(stack, 0) + elapsed - inner
+        return timed
+
+    def wrap(self, ob, name, label = None):
+        """ Time calls to ob.name (if ob has it and it isn't timed already) """
+        if not hasattr(ob, name) or name in vars(ob):
+            return
+        key = "{0}.{1}".format(label or self.label(ob), name)
+        setattr(ob, name, self.timer(key, getattr(ob, name)))
+        self.wrapped.append((ob, name))
+
+    def wrapClass(self, ob, names, label):
+        """
+        Time the methods names of ob by giving it a subclass with timed methods
+        Used for the world, whose copies (World.workerView) must call the methods on themselves
+        """
+        cls = type(ob)
+        methods = {}
+        for name in names:
+            methods[name] = self.timer("{0}.{1}".format(label, name), getattr(cls, name))
+        ob.__class__ = type(cls.__name__, (cls,), methods)
+        self.classes.append((ob, cls))
+
+    def attach(self, world):
+        """ Time the world's traversal and every object, material, texture and light it holds """
+        self.wrapClass(world, WORLD_METHODS, "World")
+        for light in world.lights:
+            for name in LIGHT_METHODS:
+                self.wrap(light, name)
+        for ob in world.objects:
+            self.attachObject(ob)
+        return self
+
+    def attachObject(self, ob):
+        for name in PRIMITIVE_METHODS:
+            self.wrap(ob, name)
+        #Instances time the object they transform too
+        inner = getattr(ob, "o", None)
+        if hasattr(inner, "intersectRay"):
+            self.attachObject(inner)
+        material = getattr(ob, "material", None)
+        if material != None:
+            self.attachMaterial(material)
+
+    def attachMaterial(self, material):
+        for name in MATERIAL_METHODS:
+            self.wrap(material, name)
+        #Textures sit on the material or on its BRDFs
+        for value in list(vars(material).values()):
+            surface = getattr(value, "surface", value)
+            if isinstance(surface, Surface):
+                for name in TEXTURE_METHODS:
+                    self.wrap(surface, name)
+                mapping = getattr(surface, "m", None)
+                if isinstance(mapping, TextureMapping):
+                    for name in MAPPING_METHODS:
+                        self.wrap(mapping, name)
+
+    def detach(self):
+        """ Put back the class methods of everything attach wrapped """
+        for ob, name in self.wrapped:
+            if vars(ob).get(name) != None:
+                delattr(ob, name)
+        for ob, cls in self.classes:
+            ob.__class__ = cls
+        self.wrapped = []
+        self.classes = []
+        self.merge()
+
+    def merge(self):
+        """ Add up the counters of the threads into entries and stacks """
+        with self.lock:
+            threads = list(self.threads)
+        for entry in self.entries.values():
+            entry[0] = entry[1] = entry[2] = 0
+        self.stacks = {}
+        for entries, stacks in threads:
+            for key, (calls, total, own) in list(entries.items()):
+                entry = self.entries.setdefault(key, [0, 0, 0])
+                entry[0] += calls
+                entry[1] += total
+                entry[2] += own
+            for stack, ns in list(stacks.items()):
+                self.stacks[stack] = self.stacks.get(stack, 0) + ns
+
+    def reset(self):
+        """ Forget the timings, keep the wrappers """
+        with self.lock:
+            for entries, stacks in self.threads:
+                entries.clear()
+                stacks.clear()
+        for entry in self.entries.values():
+            entry[0] = entry[1] = entry[2] = 0
+        self.stacks = {}
+
+    def byType(self):
+        """ Returns: "Type.method" -> [calls, total ns, self ns], summed over the objects of each type """
+        self.merge()
+        types = {}
+        for key, (calls, total, own) in self.entries.items():
+            label, name = key.rsplit(".", 1)
+            t = types.setdefault("{0}.{1}".format(label.split("#")[0], name), [0, 0, 0])
+            t[0] += calls
+            t[1] += total
+            t[2] += own
+        return types
+
+    def report(self, top = 25):
+        """ Returns: text tables of the methods with the most self time, per type and per object """
+        types = self.byType()
+        lines = []
+        for title, entries in (("By type", types), ("By object", self.entries)):
+            rows = sorted(((own, total, calls, key) for key, (calls, total, own) in entries.items() if calls), reverse = True)
+            spent = sum(row[0] for row in rows) or 1
+            lines.append("{0}:".format(title))
+            lines.append("{0:>10} {1:>10} {2:>6} {3:>10}  {4}".format("self ms", "total ms", "self%", "calls", "method"))
+            for own, total, calls, key in rows[:top]:
+                lines.append("{0:10.1f} {1:10.1f} {2:5.1f}% {3:10d}  {4}".format(own / 1e6, total / 1e6, 100.0 * own / spent, calls, key))
+            lines.append("")
+        return "\n".join(lines)
+
+    def writeReport(self, path, top = 25):
+        with open(path, "w") as f:
+            f.write(self.report(top))
+
+    def writeCollapsed(self, path):
+        """
+        Write the timed call stacks in the collapsed format ("a;b;c microseconds" per line)
+        that flamegraph.pl, speedscope and inferno read
+        """
+        self.merge()
+        with open(path, "w") as f:
+            for stack, ns in sorted(self.stacks.items()):
+                us = ns // 1000
+                if us > 0:
+                    f.write("{0} {1}\n".format(";".join(stack), us))
+
+
+def profileRender(world, report = None, collapsed = None, workers = 1):
+    """
+    Render the world with a Profiler attached
+    Takes in:
+        The world to render (world)
+        Paths to write the text report (report) and collapsed stacks (collapsed) to, if any
+        The number of render threads (workers), worker processes would keep their timings
+    Returns: the image, its RenderStats and the Profiler
+    """
+    profiler = Profiler().attach(world)
+    try:
+        image, stats = world.renderScene(workers, TILE_SIZE, "thread")
+    finally:
+        profiler.detach()
+    if report != None:
+        profiler.writeReport(report)
+    if collapsed != None:
+        profiler.writeCollapsed(collapsed)
+    return image, stats, profiler
@@ -0,0 +1,202 @@
+import numpy as np
+from Utilities import *
+from Constants import *
+
+class RayPacket:
+    def __init__(self, origins, directions):
+        """
+        Bundle of N rays traced together with NumPy
+
+        Attributes:
+            o: (N, 3) array of ray origins
+            d: (N, 3) array of ray directions
+        """
+        self.o = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        self.d = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return self.o.shape[0]
+
+    #Create a packet from a list of Rays
+    def fromRays(rays):
+        return RayPacket([(r.o.x, r.o.y, r.o.z) for r in rays], [(r.d.x, r.d.y, r.d.z) for r in rays])
+
+    #Return ray i of the packet as a Ray
+    def ray(self, i):
+        o = self.o[i]
+        d = self.d[i]
+        return Ray(Point(float(o[0]), float(o[1]), float(o[2])), Vector(float(d[0]), float(d[1]), float(d[2])))
+
+
+def _dot(a, b):
+    """ Dot product over the last axis """
+    return np.einsum("...k,...k->...", a, b)
+
+def _closest(t):
+    """
+    Reduce an (N, M) array of hit times to the closest of the M primitives
+    Returns: t (N,) with np.inf for misses, and the index of the primitive hit (N,)
+    """
+    index = np.argmin(t, axis=1)
+    return t[np.arange(t.shape[0]), index], index
+
+def intersectSpheres(packet, spheres):
+    """
+    Intersect every ray of the packet with a list of spheres
+    Returns: arrays of t (np.inf for a miss), normals, hit mask and index of the sphere hit
+    """
+    c = np.array([(s.c.x, s.c.y, s.c.z) for s in spheres], dtype=np.float64)
+    r = np.array([s.r for s in spheres], dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        temp = packet.o[:, None, :] - c[None, :, :]
+        a = _dot(packet.d, packet.d)[:, None]
+        b = 2.0 * _dot(temp, packet.d[:, None, :])
+        cq = _dot(temp, temp) - r * r
+        disc = b * b - 4.0 * a * cq
+        e = np.sqrt(np.maximum(disc, 0.0))
+        denom = 2.0 * a
+        #Near root first, far root if the near one is behind the origin
+        t1 = (-b - e) / denom
+        t2 = (-b + e) / denom
+        t = np.where(t1 > kEpsilon, t1, np.where(t2 > kEpsilon, t2, np.inf))
+        t = np.where(disc < 0.0, np.inf, t)
+        t, index = _closest(t)
+        hit = np.isfinite(t)
+        th = np.where(hit, t, 0.0)
+        normals = (packet.o - c[index] + th[:, None] * packet.d) / r[index][:, None]
+    return t, normals, hit, index
+
+def _planeTimes(packet, points, normals):
+    """ (N, M) hit times of every ray with the planes through points with normals, np.inf for a miss """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = packet.d @ normals.T
+        num = _dot(points, normals)[None, :] - packet.o @ normals.T
+        t = num / denom
+        return np.where((denom != 0.0) & (t > kEpsilon), t, np.inf)
+
+def intersectPlanes(packet, planes):
+    """
+    Intersect every ray of the packet with a list of planes
+    Returns: arrays of t (np.inf for a miss), normals, hit mask and index of the plane hit
+    """
+    p = np.array([(pl.p.x, pl.p.y, pl.p.z) for pl in planes], dtype=np.float64)
+    n = np.array([(pl.n.x, pl.n.y, pl.n.z) for pl in planes], dtype=np.float64)
+    t, index = _closest(_planeTimes(packet, p, n))
+    return t, n[index], np.isfinite(t), index
+
+def intersectRectangles(packet, rectangles):
+    """
+    Intersect every ray of the packet with a list of rectangles
+    Returns: arrays of t (np.inf for a miss), normals, hit mask and index of the rectangle hit
+    """
+    p = np.array([(re.p.x, re.p.y, re.p.z) for re in rectangles], dtype=np.float64)
+    n = np.array([(re.n.x, re.n.y, re.n.z) for re in rectangles], dtype=np.float64)
+    w = np.array([(re.w.x, re.w.y, re.w.z) for re in rectangles], dtype=np.float64)
+    h = np.array([(re.h.x, re.h.y, re.h.z) for re in rectangles], dtype=np.float64)
+    t = _planeTimes(packet, p, n)
+    with np.errstate(invalid="ignore"):
+        #Project the hit point on the two edges of each rectangle
+        v = packet.o[:, None, :] + np.where(np.isfinite(t), t, 0.0)[:, :, None] * packet.d[:, None, :] - p[None, :, :]
+        hh = _dot(v, h[None, :, :])
+        ww = _dot(v, w[None, :, :])
+        inside = (hh >= 0.0) & (hh <= _dot(h, h)) & (ww >= 0.0) & (ww <= _dot(w, w))
+    t, index = _closest(np.where(inside, t, np.inf))
+    return t, n[index], np.isfinite(t), index
+
+def intersectTriangles(packet, triangles):
+    """
+    Intersect every ray of the packet with a list of triangles
+    Returns: arrays of t (np.inf for a miss), normals, hit mask and index of the triangle hit
+    """
+    p0 = np.array([(tr.p0.x, tr.p0.y, tr.p0.z) for tr in triangles], dtype=np.float64)
+    p1 = np.array([(tr.p1.x, tr.p1.y, tr.p1.z) for tr in triangles], dtype=np.float64)
+    p2 = np.array([(tr.p2.x, tr.p2.y, tr.p2.z) for tr in triangles], dtype=np.float64)
+    n = np.array([(tr.n.x, tr.n.y, tr.n.z) for tr in triangles], dtype=np.float64)
+    t = triangleTimes(packet.o, packet.d, p0, p0 - p1, p0 - p2)
+    t, index = _closest(t)
+    return t, n[index], np.isfinite(t), index
+
+def triangleTimes(o, d, p0, e1, e2):
+    """
+    (N, M) hit times of N rays (o, d) with M triangles given by p0 and the
+    edges e1 = p0 - p1, e2 = p0 - p2, np.inf for a miss.
+    Same Cramer's rule as Triangle.intersectRay, done for all pairs at once
+    """
+    a, e, i = e1[None, :, 0], e1[None, :, 1], e1[None, :, 2]
+    b, f, j = e2[None, :, 0], e2[None, :, 1], e2[None, :, 2]
+    c, g, k = d[:, 0, None], d[:, 1, None], d[:, 2, None]
+    dd = p0[None, :, 0] - o[:, 0, None]
+    h = p0[None, :, 1] - o[:, 1, None]
+    l = p0[None, :, 2] - o[:, 2, None]
+
+    m = f*k - g*j
+    nn = h*k - g*l
+    p = f*l - h*j
+    q = g*i - e*k
+    s = e*j - f*i
+    r = e*l - h*i
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv_denom = 1.0 / (a*m + b*q + c*s)
+        beta = (dd*m - b*nn - c*p) * inv_denom
+        gamma = (a*nn + dd*q + c*r) * inv_denom
+        t = (a*p - b*r + dd*s) * inv_denom
+        ok = (beta >= 0.0) & (gamma >= 0.0) & (beta + gamma <= 1.0) & (t >= kEpsilon) & np.isfinite(inv_denom)
+    return np.where(ok, t, np.inf)
+
+
+def _kernel(ob):
+    """ Return the packet kernel for the class of ob, or None if it has to be traced one ray at a time """
+    return getattr(type(ob), "packetKernel", None)
+
+def _scalar(packet, objects):
+    """ Fallback for objects without a kernel, one intersectRay per ray and object """
+    n = len(packet)
+    t = np.full(n, np.inf)
+    normals = np.zeros((n, 3))
+    index = np.zeros(n, dtype=np.intp)
+    for i in range(n):
+        ray = packet.ray(i)
+        for k, ob in enumerate(objects):
+            hit = ob.intersectRay(ray, None)
+            if hit and hit.t < t[i]:
+                t[i] = hit.t
+                normals[i] = (hit.normal.x, hit.normal.y, hit.normal.z)
+                index[i] = k
+    return t, normals, np.isfinite(t), index
+
+def intersectObjects(packet, objects):
+    """
+    Intersect every ray of the packet with a set of objects, grouped by type so
+    every group is one vectorized kernel call
+    Returns: arrays of t (np.inf for a miss), normals, hit mask and the index in objects of the closest hit
+    """
+    n = len(packet)
+    t = np.full(n, np.inf)
+    normals = np.zeros((n, 3))
+    index = np.full(n, -1, dtype=np.intp)
+    groups = {}
+    for k, ob in enumerate(objects):
+        groups.setdefault(_kernel(ob), []).append(k)
+    for kernel, members in groups.items():
+        group = [objects[k] for k in members]
+        if kernel is None:
+            gt, gn, gh, gi = _scalar(packet, group)
+        else:
+            gt, gn, gh, gi = kernel(packet, group)
+        closer = gt < t
+        t = np.where(closer, gt, t)
+        normals[closer] = gn[closer]
+        index[closer] = np.asarray(members)[gi[closer]]
+    return t, normals, np.isfinite(t), index
+
+def occludedObjects(packet, objects, tmax):
+    """
+    Shadow test for every ray of the packet against a set of objects
+    tmax is the distance to the light (scalar or (N,) array)
+    Returns: mask of the rays that are blocked before tmax
+    """
+    casters = [ob for ob in objects if getattr(ob, "shadows", True)]
+    if not casters:
+        return np.zeros(len(packet), dtype=bool)
+    t = intersectObjects(packet, casters)[0]
+    return t < tmax
@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from Checkpoint import *
+from Constants import *
+from Distributed import *
+from GBuffer import *
+from Scene import *
+
+#Image file name, filled in per render
+OUTPUT_PATTERN = "{scene}_{camera}_{width}x{height}.png"
+#File name of a frame of an animated scene
+FRAME_PATTERN = "{root}_{frame:04d}{ext}"
+#File name of the G-buffer of an image, next to it
+GBUFFER_PATTERN = "{root}.gbuffer.npz"
+#File name of the checkpoint of an image being rendered, next to it
+CHECKPOINT_PATTERN = "{root}.checkpoint.npz"
+#File name of the linear (not tonemapped) colors of an image, next to it
+RAW_PATTERN = "{root}.{format}"
+
+
+#Parse a "WIDTHxHEIGHT" (or "WIDTH" for a square image) argument
+def parseSize(text):
+    parts = text.lower().split("x")
+    try:
+        sizes = [int(p) for p in parts]
+    except ValueError:
+        raise argparse.ArgumentTypeError("size must look like 640x480, not {0!r}".format(text))
+    if len(sizes) == 1:
+        sizes = sizes * 2
+    if len(sizes) != 2 or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError("size must look like 640x480, not {0!r}".format(text))
+    return tuple(sizes)
+
+def jobs(scene, cameras, sizes):
+    """
+    The renders to do for a scene
+    With no cameras or sizes given the scene's own renders list is used,
+    otherwise every camera (all of them by default) at every size (the scene's by default)
+    Returns: list of (camera name, width, height, output file or None)
+    """
+    if not cameras and not sizes:
+        return [(r.get("camera"), r.get("width"), r.get("height"), r.get("output")) for r in scene.renders]
+    names = cameras or list(scene.cameras)
+    sizes = sizes or [(scene.settings["width"], scene.settings["height"])]
+    return [(name, w, h, None) for name in names for (w, h) in sizes]
+
+def renderImage(scene, args, camera, width, height, output, frame = None, digest = ""):
+    """
+    Render one image and save it to output
+    With args.reshade the image is shaded from the G-buffer saved next to output (when
+    there is one) instead of traced, with args.gbuffer its G-buffer is saved there
+    With args.checkpoint or args.resume the finished tiles are checkpointed next to output
+    until the image is saved, args.resume first picks up the tiles of a checkpoint of the
+    same render (digest is the hash of the scene file, camera, size, frame and pruning must match too)
+    With args.raw the linear colors are saved next to output too, in that format
+    Returns: the RenderStats of the image
+    """
+    root = os.path.splitext(output)[0]
+    gpath = GBUFFER_PATTERN.format(root=root)
+    if args.reshade and os.path.exists(gpath):
+        if frame != None and scene.animation != None:
+            scene.animation.setFrame(frame)
+        image, stats = GBuffer.load(gpath, scene.world).reshade(scene.world)
+        saveImage(scene, args, image, output)
+        return stats
+
+    gbuffer = GBuffer() if args.gbuffer else None
+    checkpoint = None
+    if args.checkpoint != None or args.resume:
+        key = json.dumps([digest, camera, width, height, frame, scene.world.prune])
+        interval = args.checkpoint if args.checkpoint != None else CHECKPOINT_SECONDS
+        checkpoint = Checkpoint(CHECKPOINT_PATTERN.format(root=root), key, interval)
+        if args.resume and gbuffer == None and checkpoint.load():
+            print("{0}: resuming with {1} finished tiles".format(output, len(checkpoint.tiles)))
+    image, stats = scene.render(camera, width, height, args.workers, args.coordinator or args.backend, frame = frame, gbuffer = gbuffer, checkpoint = checkpoint)
+    if gbuffer != None:
+        gbuffer.save(gpath)
+    saveImage(scene, args, image, output)
+    if checkpoint != None:
+        checkpoint.remove()
+    return stats
+
+#Save the image, and the framebuffer it was made from when args.raw asks for it
+def saveImage(scene, args, image, output):
+    image.save(output)
+    if args.raw:
+        scene.world.framebuffer.save(RAW_PATTERN.format(root=os.path.splitext(output)[0], format=args.raw))
+
+#Render the images of all the scenes of args, returns the exit status
+def renderScenes(args):
+    for path in args.scenes:
+        start = time.time()
+        try:
+            scene = loadScene(path)
+        except (OSError, ValueError, KeyError, SceneError) as e:
+            print("{0}: {1}".format(path, e), file=sys.stderr)
+            return 1
+        if args.prune != None:
+            scene.world.prune = args.prune
+        print("{0}: built in {1:.2f}s, {2} objects".format(path, time.time() - start, len(scene.world.objects)))
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        for camera, width, height, output in jobs(scene, args.camera, args.size):
+            if camera not in scene.cameras and camera != None:
+                print("{0}: unknown camera {1!r}".format(path, camera), file=sys.stderr)
+                return 1
+            camera = camera or next(iter(scene.cameras))
+            width = width or scene.settings["width"]
+            height = height or scene.settings["height"]
+            output = os.path.join(args.output_dir, output or OUTPUT_PATTERN.format(scene=name, camera=camera, width=width, height=height))
+            if scene.animation == None:
+                stats = renderImage(scene, args, camera, width, height, output, digest = digest)
+                print("{0}: {1}".format(output, stats))
+                continue
+            #Frames are numbered before the extension, the world is refit between them
+            root, ext = os.path.splitext(output)
+            for frame in range(args.frames or scene.frames):
+                path = FRAME_PATTERN.format(root=root, frame=frame, ext=ext)
+                stats = renderImage(scene, args, camera, width, height, path, frame, digest)
+                print("{0}: {1}".format(path, stats))
+    return 0
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Render scene files, each scene is built once for all of its renders")
+    parser.add_argument("scenes", nargs="+", help="scene JSON files")
+    parser.add_argument("--camera", action="append", default=[], help="camera to render (repeatable, default all)")
+    parser.add_argument("--size", action="append", default=[], type=parseSize, help="resolution as WxH (repeatable)")
+    parser.add_argument("--output-dir", default=".", help="folder the images are written to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes or threads per render")
+    parser.add_argument("--frames", type=int, help="frames of an animated scene to render (default all of them)")
+    parser.add_argument("--backend", choices=["process", "thread"], help="how the workers run (default threads on free-threaded Python, else processes)")
+    parser.add_argument("--gbuffer", action="store_true", help="save the primary hits of each image next to it (.gbuffer.npz)")
+    parser.add_argument("--reshade", action="store_true", help="shade images again from their saved G-buffers instead of tracing them (materials and lights may change, geometry may not)")
+    parser.add_argument("--checkpoint", type=float, metavar="SECONDS", help="save the finished tiles of each image every SECONDS until it is done (.checkpoint.npz)")
+    parser.add_argument("--serve", type=parseAddress, metavar="HOST:PORT", help="trace the tiles in workers that connect to HOST:PORT (started with Distributed.py HOST:PORT --authkey KEY) instead of local ones, only use a HOST other machines can reach on a network you trust")
+    parser.add_argument("--authkey", help="key the workers of --serve must know (default a random one, printed)")
+    parser.add_argument("--prune", choices=["off", "cutoff", "roulette"], help="how secondary rays of low weight are pruned (default the scene's prune setting)")
+    parser.add_argument("--raw", choices=["pfm", "npy"], help="also save the linear colors of each image, before tonemapping")
+    parser.add_argument("--resume", action="store_true", help="pick up the finished tiles of checkpoints of the same renders (checkpoints every {0}s unless --checkpoint is given)".format(CHECKPOINT_SECONDS))
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    args.coordinator = Coordinator(args.serve, args.authkey) if args.serve else None
+    if args.coordinator != None:
+        host, port = args.coordinator.address
+        key = args.coordinator.authkey if args.authkey == None else "KEY"
+        print("Serving tiles on {0}:{1}, start workers with: python Distributed.py {0}:{1} --authkey {2}".format(host, port, key))
+    try:
+        return renderScenes(args)
+    finally:
+        if args.coordinator != None:
+            args.coordinator.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,65 +1,246 @@
 ﻿import numpy as np
 import math
 import random
+import threading
+import zlib
 from numpy import linalg as LA
 from Utilities import *
 from ShadeRec import *
 
+#Sample tables shared by every sampler with the same pattern, size and sets
+#(pattern name, samples per set, sets) -> (numpy table, list of Points)
+_TABLES = {}
+#Hemisphere maps of the tables, (pattern name, samples per set, sets, exp) -> list of Points
+_HEMISPHERES = {}
+
+class SamplerState(threading.local):
+    """
+    Position of one thread in a sampler's sets
+    count: count of samples checked
+    jump: for when new pixel is reached
+    pixel: pixel (see newPixel) the samples are being taken for
+    """
+    def __init__(self):
+        self.count = 0
+        self.jump = 0
+        self.pixel = -1
+
+class PixelCounter(threading.local):
+    #Number of the pixel this thread is tracing
+    n = 0
+
+_PIXEL = PixelCounter()
+
+#Start a new pixel, every sampler takes its next samples from a new set
+#so the samples of a pixel are one stratified set, not the ends of two
+def newPixel():
+    _PIXEL.n += 1
+
 # #419begin #type=3 #src=Ray Tracing from the Ground Up 
 class Sampler:
     """
-    Regular Sampler
+    Base of the samplers, subclasses fill in generateTable (the base lays the samples on a grid, see Regular)
     s: number of samples
     sets: number of sets
-    count: count of samples checked
-    samples: list of all samples
-    jump: for when new pixel is reached
+    table: (sets*s, 2) numpy array of the samples in the unit square, shared with equal samplers
+    samples: list of all samples (Points), shared with equal samplers
+    hsamples: samples mapped to the hemisphere (see hemisphere), shared too
+    state: SamplerState, every thread walks the sets on its own
     """
     def __init__(self, s, sets):
         self.s = s
         self.sets = sets
-        self.count = 0
-        self.samples = []
         self.hsamples = []
-        self.jump = 0
-        self.generateSamples()
+        self.state = SamplerState()
+        key = (type(self).__name__, self.s, self.sets)
+        if key not in _TABLES:
+            #Seeded by the parameters, so a table is the same in every process
+            rng = random.Random(zlib.crc32(repr(key).encode()))
+            table = np.ascontiguousarray(self.generateTable(rng), dtype=np.float64).reshape(self.sets * self.s, 2)
+            _TABLES[key] = (table, [Point(x, y, 0) for x, y in table.tolist()])
+        self.table, self.samples = _TABLES[key]
+
+    #Samples of all sets as a (sets*s, 2) array, rng (a random.Random) seeds the random patterns
+    #Here the centers of the cells of a grid of about sqrt(s) x sqrt(s), row by row, the same in every set
+    def generateTable(self, rng):
+        n = int(math.ceil(math.sqrt(self.s)))
+        rows = (self.s + n - 1) // n
+        i = np.arange(self.s)
+        grid = np.stack(((i % n + .5)/n, (i // n + .5)/rows), axis=1)
+        return np.tile(grid, (self.sets, 1))
+
+    #Thread state can't be pickled, a copy starts over at the first set
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["state"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.state = SamplerState()
 
     #Return sample point on Square
     def sampleSquare(self):
-        if self.count % self.s == 0:
-            self.jump = (random.randint(1, self.sets) % self.sets) * self.s
-        idx = self.jump + self.count % self.s
+        state = self.state
+        if state.pixel != _PIXEL.n:
+            state.pixel = _PIXEL.n
+            state.count = 0
+        if state.count % self.s == 0:
+            state.jump = (random.randint(1, self.sets) % self.sets) * self.s
+        idx = state.jump + state.count % self.s
         sample = self.samples[idx]
-        self.count += 1
+        state.count += 1
         return sample
 
     #Set up hsamples based on hemisphere
     def mapHemisphere(self, exp):
-        for sample in self.samples:
-            cos_phi = math.cos(2*math.pi*sample.x)
-            sin_phi = math.sin(2*math.pi*sample.x)
-            cos_theta = pow((1.0 - sample.y), 1.0 / (exp+1))
-            sin_theta = math.sqrt(1.0 - cos_theta * cos_theta)
-            pu = sin_theta * cos_phi
-            pv = sin_theta * sin_phi
-            pw = cos_theta
-            self.hsamples.append(Point(pu, pv, pw))
+        key = (type(self).__name__, self.s, self.sets, exp)
+        if key not in _HEMISPHERES:
+            x = self.table[:, 0]
+            y = self.table[:, 1]
+            cos_theta = np.power(1.0 - y, 1.0 / (exp+1))
+            sin_theta = np.sqrt(1.0 - cos_theta * cos_theta)
+            pu = sin_theta * np.cos(2*math.pi*x)
+            pv = sin_theta * np.sin(2*math.pi*x)
+            _HEMISPHERES[key] = [Point(u, v, w) for u, v, w in zip(pu.tolist(), pv.tolist(), cos_theta.tolist())]
+        self.hsamples = _HEMISPHERES[key]
+
+    def hemisphere(self, exp):
+        """
+        Returns: a sampler over the same samples mapped to a cosine power hemisphere of exp
+        It shares the tables but walks them on its own, so BRDFs with other exponents
+        can be given the same sampler
+        """
+        sampler = self.__class__.__new__(self.__class__)
+        sampler.__dict__.update(self.__dict__)
+        sampler.state = SamplerState()
+        sampler.mapHemisphere(exp)
+        return sampler
 
     #Return sample point on Hemisphere
     def sampleHemisphere(self):
-        if(self.count % self.s == 0):
-            self.jump = (random.randint(0, self.s) % self.sets) * self.s
-        idx = self.jump + self.count % self.s
+        state = self.state
+        if state.pixel != _PIXEL.n:
+            state.pixel = _PIXEL.n
+            state.count = 0
+        if(state.count % self.s == 0):
+            state.jump = (random.randint(1, self.sets) % self.sets) * self.s
+        idx = state.jump + state.count % self.s
         sample = self.hsamples[idx]
-        self.count += 1
+        state.count += 1
         return sample
 
 class Regular(Sampler):        
-    #Generate the Regular samples and add them to the list samples
-    def generateSamples(self):
+    #Samples on the centers of an n x n grid, the same in every set
+    def __init__(self, s, sets):
+        n = max(1, int(math.sqrt(s)))
+        Sampler.__init__(self, n*n, sets)
+# #419end
+
+#Array of shape filled with uniform numbers in [0, 1) from rng
+#(a random.Random, importing numpy.random takes more memory than all the tables)
+def uniform(rng, shape):
+    return np.array([rng.random() for i in range(int(np.prod(shape)))]).reshape(shape)
+
+#Put the samples of every set of a (sets, s, 2) table in random order
+#so the order they are taken in isn't tied to their cell (or to the camera's grid)
+def shuffleSets(table, rng):
+    order = np.argsort(uniform(rng, table.shape[:2]), axis=1)
+    return np.take_along_axis(table, order[:, :, None], axis=1)
+
+class Jittered(Sampler):
+    #One random sample in every cell of an n x n grid, in random order
+    def __init__(self, s, sets):
+        n = max(1, int(math.sqrt(s)))
+        Sampler.__init__(self, n*n, sets)
+
+    def generateTable(self, rng):
         n = int(math.sqrt(self.s))
-        for i in range(self.sets):
-            for j in range (n):
-                for k in range(n):
-                    self.samples.append(Point((k+.5)/n, (j+.5)/n, 0))
-# #419end
\ No newline at end of file
+        k, j = np.meshgrid(np.arange(n), np.arange(n))
+        cells = np.stack((k.ravel(), j.ravel()), axis=1)
+        return shuffleSets((cells[None, :, :] + uniform(rng, (self.sets, self.s, 2))) / n, rng)
+
+class MultiJittered(Sampler):
+    """
+    Jittered on an n x n grid and on the n*n x n*n grid below it: every row and
+    column of the fine grid holds one sample, so x and y alone are stratified too
+    """
+    def __init__(self, s, sets):
+        n = max(1, int(math.sqrt(s)))
+        Sampler.__init__(self, n*n, sets)
+
+    def generateTable(self, rng):
+        n = int(math.sqrt(self.s))
+        i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+        table = np.empty((self.sets, n, n, 2))
+        #Canonical arrangement, then shuffle x within columns and y within rows
+        table[..., 0] = (i + (j + uniform(rng, (self.sets, n, n))) / n) / n
+        table[..., 1] = (j + (i + uniform(rng, (self.sets, n, n))) / n) / n
+        table[..., 0] = np.take_along_axis(table[..., 0], np.argsort(uniform(rng, (self.sets, n, n)), axis=2), axis=2)
+        table[..., 1] = np.take_along_axis(table[..., 1], np.argsort(uniform(rng, (self.sets, n, n)), axis=1), axis=1)
+        return shuffleSets(table.reshape(self.sets, self.s, 2), rng)
+
+#Radical inverse of the integers i in base b (digits mirrored after the point)
+def radicalInverse(i, b):
+    i = np.array(i, dtype=np.int64)
+    result = np.zeros(i.shape)
+    f = 1.0 / b
+    while i.any():
+        result += (i % b) * f
+        i //= b
+        f /= b
+    return result
+
+class Halton(Sampler):
+    #Halton points in bases 2 and 3, every set shifted by a random offset (wrapping around)
+    def generateTable(self, rng):
+        i = np.arange(self.s)
+        points = np.stack((radicalInverse(i, 2), radicalInverse(i, 3)), axis=1)
+        return (points[None, :, :] + uniform(rng, (self.sets, 1, 2))) % 1.0
+
+class Sobol(Sampler):
+    """
+    First two dimensions of the Sobol sequence, every set randomly scrambled (XOR of the bits)
+    With a power of 2 samples every set is a (0, 2)-net: each 1/s area box of the
+    square holds exactly one sample
+    """
+    def generateTable(self, rng):
+        i = np.arange(self.s, dtype=np.uint64)
+        x = np.zeros(self.s, dtype=np.uint64)
+        y = np.zeros(self.s, dtype=np.uint64)
+        v = 1 << 31
+        for k in range(32):
+            bit = (i >> np.uint64(k)) & np.uint64(1)
+            x ^= bit * np.uint64(1 << (31 - k))
+            y ^= bit * np.uint64(v)
+            v ^= v >> 1
+        scramble = np.array([rng.getrandbits(32) for i in range(self.sets * 2)], dtype=np.uint64).reshape(self.sets, 1, 2)
+        points = np.stack((x, y), axis=1)[None, :, :] ^ scramble
+        return (points.astype(np.float64) + 0.5) / 2.0**32
+
+class BlueNoise(Sampler):
+    #Best candidate samples, every new one is the farthest of several random candidates from the others (wrapping around)
+    candidates = 8
+
+    def generateTable(self, rng):
+        table = np.empty((self.sets, self.s, 2))
+        for k in range(self.sets):
+            points = table[k]
+            points[0] = uniform(rng, 2)
+            for i in range(1, self.s):
+                c = uniform(rng, (self.candidates * min(i, 16), 2))
+                d = np.abs(c[:, None, :] - points[None, :i, :])
+                d = np.minimum(d, 1.0 - d)
+                nearest = (d * d).sum(axis=2).min(axis=1)
+                points[i] = c[np.argmax(nearest)]
+        return table
+
+#Sampler classes by name (for scene files)
+SAMPLERS = {
+    "Regular": Regular,
+    "Jittered": Jittered,
+    "MultiJittered": MultiJittered,
+    "Halton": Halton,
+    "Sobol": Sobol,
+    "BlueNoise": BlueNoise,
+}
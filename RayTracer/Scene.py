@@ -0,0 +1,287 @@
+import json
+import math
+import os
+from Animation import *
+from Camera import *
+from Constants import *
+from GeometricObjects import *
+from Instance import *
+from Light import *
+from Material import *
+from Mesh import *
+from Sampler import *
+from Texture import *
+from Utilities import *
+from World import *
+
+"""
+Scene files are JSON:
+
+{
+    "settings": {"width": 128, "height": 128, "accel": "octree", "world_size": 128,
+                 "samples": 4, "adaptive": false, "threshold": 0.02, "min_samples": 4,
+                 "max_samples": 16, "background": [0, 0, 0], "prune": "off", "prune_threshold": 0.05,
+                 "prepass": true, "tonemap": "clamp",
+                 "ambient": {"ls": 0.4, "color": [1, 1, 1]}},
+    "samplers": {"name": {"type": "Regular", "samples": 25, "sets": 83}},
+    (Regular, Jittered, MultiJittered, Halton, Sobol or BlueNoise)
+    "textures": {"name": {"type": "color", "color": [1, 0, 0]},
+                 "earth": {"type": "image", "file": "earthmap1k.jpg", "filter": "trilinear",
+                           "mapping": {"type": "spherical", "radius": 8}}},
+    "materials": {"name": {"type": "Matte", "ka": 1, "kd": 1, "color": "texture name or [r, g, b]",
+                           "sampler": "sampler name", "max_depth": 5}},
+    "objects": [{"type": "Sphere", "center": [0, 0, 0], "radius": 5, "material": "name",
+                 "name": "optional, for area lights",
+                 "transform": [{"translate": [x, y, z]}, {"scale": [x, y, z]}, {"rotateY": degrees}]}],
+    "lights": [{"type": "area", "object": "object name"},
+               {"type": "point", "position": [x, y, z], "ls": 1, "color": [1, 1, 1]},
+               {"type": "directional", "direction": [x, y, z], "ls": 1, "color": [1, 1, 1]}],
+    "cameras": {"name": {"eye": [0, 0, -25], "lookat": [0, 0, 1], "up": [0, 1, 0]}},
+    "renders": [{"camera": "name", "width": 128, "height": 128, "output": "image.png"}],
+    "animation": {"frames": 48,
+                  "tracks": [{"object": "object name", "channel": "translate",
+                              "keys": [[0, [0, 0, 0]], [47, [10, 0, 0]]]}]}
+}
+
+Objects are Sphere (center, radius), Plane (point, normal), Rectangle (corner, width,
+height vectors, sampler), Triangle (p0, p1, p2) and Mesh (file of an OBJ, or vertices
+and faces). An object with a transform is wrapped in an Instance, the transforms are
+applied like calls to Instance, so the last one moves the object first.
+Relative file paths are relative to the scene file.
+Animation channels are those of Animation, rotations are in degrees like in transforms.
+Prune is "off", "cutoff" or "roulette" (see PRUNE in Constants), the max_depth of a
+material limits the depth of the rays leaving it.
+"""
+
+class SceneError(Exception):
+    pass
+
+
+def _point(v):
+    return Point(float(v[0]), float(v[1]), float(v[2]))
+
+def _vector(v):
+    return Vector(float(v[0]), float(v[1]), float(v[2]))
+
+def _color(v):
+    return Color(float(v[0]), float(v[1]), float(v[2]))
+
+def _lookup(table, name, kind):
+    if name not in table:
+        raise SceneError("unknown {0} {1!r}".format(kind, name))
+    return table[name]
+
+
+class Scene:
+    def __init__(self, data, base = "."):
+        """
+        A world built from a scene description, with its cameras and the renders it asks for
+        The world and its acceleration structure are built once and shared by every render
+
+        Attributes:
+            settings: settings of the scene (with defaults filled in)
+            world: the built World
+            cameras: camera name -> PerspectiveCamera
+            renders: list of render dicts (camera, width, height, output)
+            animation: Animation of the scene's objects (None if it has none)
+            frames: number of frames of the animation (1 without one)
+            base: folder relative paths are read from
+        """
+        self.base = base
+        self.settings = {"width": 128, "height": 128, "accel": ACCEL, "world_size": WORLD_SIZE,
+                         "samples": SAMPLES, "adaptive": ADAPTIVE, "threshold": ADAPTIVE_THRESHOLD,
+                         "min_samples": ADAPTIVE_MIN, "max_samples": ADAPTIVE_MAX, "contrast": ADAPTIVE_CONTRAST,
+                         "prune": PRUNE, "prune_threshold": PRUNE_THRESHOLD, "prepass": PREPASS, "tonemap": TONEMAP,
+                         "background": [0, 0, 0], "ambient": {"ls": 0.4, "color": [1, 1, 1]}}
+        self.settings.update(data.get("settings", {}))
+        s = self.settings
+
+        self.world = World()
+        self.world.build(s["width"], s["height"], 1, s["accel"], s["world_size"])
+        self.world.background = _color(s["background"])
+        self.world.ambient = AmbientLight(s["ambient"]["ls"], _color(s["ambient"]["color"]))
+        if s["prune"] not in ("off", "cutoff", "roulette"):
+            raise SceneError("unknown prune mode {0!r}".format(s["prune"]))
+        self.world.prune = s["prune"]
+        self.world.prune_threshold = s["prune_threshold"]
+        if s["tonemap"] not in ("clamp", "reinhard"):
+            raise SceneError("unknown tonemap {0!r}".format(s["tonemap"]))
+        self.world.tonemap = s["tonemap"]
+
+        self.samplers = {name: self.makeSampler(d) for name, d in data.get("samplers", {}).items()}
+        self.textures = {name: self.makeTexture(d) for name, d in data.get("textures", {}).items()}
+        self.materials = {name: self.makeMaterial(d) for name, d in data.get("materials", {}).items()}
+        named = {}
+        for d in data.get("objects", []):
+            ob = self.makeObject(d)
+            self.world.addObject(ob)
+            if "name" in d:
+                named[d["name"]] = ob
+        for d in data.get("lights", []):
+            self.world.addLight(self.makeLight(d, named))
+        self.animation = None
+        self.frames = 1
+        if data.get("animation"):
+            self.makeAnimation(data["animation"], named)
+
+        self.cameras = {name: self.makeCamera(d) for name, d in data.get("cameras", {}).items()}
+        if not self.cameras:
+            raise SceneError("the scene has no cameras")
+        self.renders = data.get("renders") or [{"camera": name} for name in self.cameras]
+        self.world.camera = next(iter(self.cameras.values()))
+        self.world.buildAccel()
+
+    #Path of a file named in the scene
+    def path(self, filename):
+        return os.path.join(self.base, filename)
+
+    def makeSampler(self, d):
+        kind = d.get("type", "Regular")
+        if kind not in SAMPLERS:
+            raise SceneError("unknown sampler type {0!r}".format(kind))
+        return SAMPLERS[kind](d.get("samples", 25), d.get("sets", 83))
+
+    def makeTexture(self, d):
+        kind = d.get("type", "color")
+        if kind == "color":
+            return RegularSurface(_color(d["color"]))
+        if kind == "image":
+            mapping = d.get("mapping", {"type": "spherical", "radius": 1.0})
+            if mapping.get("type", "spherical") != "spherical":
+                raise SceneError("unknown texture mapping {0!r}".format(mapping["type"]))
+            if d.get("filter", TEXTURE_FILTER) not in ("nearest", "bilinear", "trilinear"):
+                raise SceneError("unknown texture filter {0!r}".format(d["filter"]))
+            return ImageTexture(loadTexture(self.path(d["file"])), SphericalMapping(mapping.get("radius", 1.0)),
+                                d.get("filter", TEXTURE_FILTER))
+        raise SceneError("unknown texture type {0!r}".format(kind))
+
+    #A color entry is a texture name or an [r, g, b] list
+    def surface(self, value):
+        if isinstance(value, str):
+            return _lookup(self.textures, value, "texture")
+        return RegularSurface(_color(value))
+
+    def sampler(self, value):
+        if value == None:
+            return None
+        return _lookup(self.samplers, value, "sampler")
+
+    def makeMaterial(self, d):
+        material = self.makeMaterialType(d)
+        if "max_depth" in d:
+            material.max_depth = min(int(d["max_depth"]), RAYDEPTH)
+        return material
+
+    def makeMaterialType(self, d):
+        kind = d.get("type")
+        ka = d.get("ka", 1.0)
+        kd = d.get("kd", 1.0)
+        ks = d.get("ks", 0.3)
+        exp = d.get("exp", 80.0)
+        cd = self.surface(d.get("color", [1, 1, 1]))
+        if kind == "Matte":
+            return Matte(ka, kd, cd, self.sampler(d.get("sampler")))
+        if kind == "Phong":
+            return Phong(ka, kd, ks, cd, exp)
+        if kind == "Reflective":
+            return Reflective(ka, kd, ks, cd, exp, d.get("kr", 1.0), self.surface(d.get("reflect_color", [1, 1, 1])))
+        if kind == "GlossyReflective":
+            return GlossyReflective(ka, kd, ks, cd, exp, d.get("kr", 1.0), self.surface(d.get("reflect_color", [1, 1, 1])),
+                                    self.sampler(d.get("sampler")) or Regular(25, 83))
+        if kind == "Transparent":
+            return Transparent(ka, kd, ks, cd, exp, d.get("kr", 0.1), self.surface(d.get("reflect_color", [1, 1, 1])),
+                               d.get("kt", 1.0), d.get("ior", 1.5))
+        if kind == "Emissive":
+            return Emissive(d.get("ls", 1.0), _color(d.get("color", [1, 1, 1])))
+        raise SceneError("unknown material type {0!r}".format(kind))
+
+    def makeObject(self, d):
+        kind = d.get("type")
+        material = _lookup(self.materials, d.get("material"), "material")
+        if kind == "Sphere":
+            ob = Sphere(_point(d["center"]), float(d["radius"]), material)
+        elif kind == "Plane":
+            ob = Plane(_point(d["point"]), _vector(d["normal"]), material)
+        elif kind == "Rectangle":
+            ob = Rectangle(_point(d["corner"]), _vector(d["width"]), _vector(d["height"]), material,
+                           self.sampler(d.get("sampler")) or Regular(25, 83))
+        elif kind == "Triangle":
+            ob = Triangle(_point(d["p0"]), _point(d["p1"]), _point(d["p2"]), material)
+        elif kind == "Mesh":
+            if "file" in d:
+                vertices, faces = self.world.OBJLoad(self.path(d["file"]))
+            else:
+                vertices, faces = d["vertices"], d["faces"]
+            ob = TriangleMesh(vertices, faces, material)
+        else:
+            raise SceneError("unknown object type {0!r}".format(kind))
+        if "shadows" in d:
+            ob.shadows = bool(d["shadows"])
+
+        transform = d.get("transform")
+        if transform:
+            ob = Instance(ob)
+            for step in transform:
+                for op, value in step.items():
+                    if op in ("translate", "scale"):
+                        getattr(ob, op)(*[float(x) for x in value])
+                    elif op in ("rotateX", "rotateY", "rotateZ"):
+                        getattr(ob, op)(math.radians(float(value)))
+                    else:
+                        raise SceneError("unknown transform {0!r}".format(op))
+        return ob
+
+    def makeLight(self, d, named):
+        kind = d.get("type")
+        if kind == "area":
+            return AreaLight(_lookup(named, d.get("object"), "object"))
+        if kind == "point":
+            return PointLight(_point(d["position"]), d.get("ls", 1.0), _color(d.get("color", [1, 1, 1])))
+        if kind == "directional":
+            return DirectionLight(_vector(d["direction"]).normalize(), d.get("ls", 1.0), _color(d.get("color", [1, 1, 1])))
+        raise SceneError("unknown light type {0!r}".format(kind))
+
+    def makeAnimation(self, d, named):
+        self.animation = Animation(self.world)
+        for track in d.get("tracks", []):
+            ob = _lookup(named, track.get("object"), "object")
+            channel = track["channel"]
+            for frame, value in track["keys"]:
+                if channel in ("rotateX", "rotateY", "rotateZ"):
+                    value = math.radians(value)
+                self.animation.key(ob, channel, frame, value)
+        self.frames = d.get("frames") or int(self.animation.frameRange()[1]) + 1
+
+    def makeCamera(self, d):
+        s = dict(self.settings)
+        s.update(d)
+        camera = PerspectiveCamera(_point(s.get("eye", [0, 0, -25])), _vector(s.get("lookat", [0, 0, 1])), 0, _vector(s.get("up", [0, 1, 0])))
+        camera.samples = s["samples"]
+        camera.adaptive = s["adaptive"]
+        camera.prepass = s["prepass"]
+        camera.setAdaptive(s["threshold"], s["min_samples"], s["max_samples"], s["contrast"])
+        return camera
+
+    def render(self, camera = None, width = None, height = None, workers = 1, backend = None, tile_size = TILE_SIZE, frame = None, gbuffer = None, checkpoint = None):
+        """
+        Render one view of the scene, the world is reused as built
+        Takes in:
+            The name of the camera (camera), the first camera by default
+            The resolution (width, height), the scene's by default
+            The renderScene arguments (workers, backend, tile_size, gbuffer, checkpoint)
+            The frame of the animation to render (frame), the current one by default
+        Returns: the image and its RenderStats
+        """
+        if frame != None and self.animation != None:
+            self.animation.setFrame(frame)
+        name = camera or next(iter(self.cameras))
+        self.world.camera = _lookup(self.cameras, name, "camera")
+        self.world.setResolution(width or self.settings["width"], height or self.settings["height"])
+        return self.world.renderScene(workers, tile_size, backend, gbuffer, checkpoint)
+
+
+def loadScene(filename):
+    """ Read a scene file, returns: the built Scene """
+    with open(filename) as f:
+        data = json.load(f)
+    return Scene(data, os.path.dirname(os.path.abspath(filename)))
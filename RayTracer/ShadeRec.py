@@ -1,7 +1,22 @@
-﻿from Utilities import *
+﻿from collections import namedtuple
+from Utilities import *
+
+#Result of a ray-object intersection, returned by intersectRay so nothing is stored on the (shared) object
+#   t: time of hit, normal: normal at the hit, local_hit: hit point in object space, material: material hit
+#   local_scale: object space length of a unit of world space at the hit (for texture filtering)
+Hit = namedtuple("Hit", ["t", "normal", "local_hit", "material", "local_scale"], defaults = (1.0,))
+
+#Shared defaults for a ShadeRec without a hit, they are replaced (never changed in place) on a hit
+_ORIGIN = Point(0.0, 0.0, 0.0)
+_ZERO = Vector(0.0, 0.0, 0.0)
+_RAY = Ray(_ORIGIN, _ZERO)
+_BLACK = Color(0.0, 0.0, 0.0)
 
 # #419begin #type=3 #src= Ray Trace Ground Up
 class ShadeRec():
+    __slots__ = ("w", "hit", "mat", "hit_point", "local_hit", "local_scale", "normal", "ray", "t", "depth", "weight", "color",
+                 "light_point", "light_normal", "light_wi", "light_distance", "texture", "texel")
+
     def __init__(self, world):
         """
         Attributes:
@@ -10,21 +25,47 @@ class ShadeRec():
             mat: material of object hit
             hit_point: point where object is hit
             local_hit: point on object that was hit
+            local_scale: object space length of a unit of world space at local_hit
             normal: normal of object at local_hit
             ray: ray that is shot
             t: time of hit
             depth: Number of times reflected
+            weight: path weight of ray, the scale its color reaches the pixel with (see Tracer.spawn)
             color: color at hit_point
+            light_point: point sampled on the light being shaded
+            light_normal: light normal at light_point
+            light_wi: direction from hit_point to light_point
+            light_distance: distance from hit_point to a point light
+            texture, texel: last texture looked up at this hit and its Color
         """
         self.w = world
         self.hit = False
         self.mat = None
-        self.hit_point = Point(0.0, 0.0, 0.0)
-        self.local_hit = Point(0.0, 0.0, 0.0)
-        self.normal = Vector(0.0, 0.0, 0.0)
-        self.ray = Ray(Point(0.0, 0.0, 0.0), Vector(0.0, 0.0, 0.0))
+        self.hit_point = _ORIGIN
+        self.local_hit = _ORIGIN
+        self.local_scale = 1.0
+        self.normal = _ZERO
+        self.ray = _RAY
         self.t = 0.0
         self.depth = 0
-        self.color = Color(0.0, 0.0, 0.0)
+        self.weight = 1.0
+        self.color = _BLACK
+        self.light_point = None
+        self.light_normal = None
+        self.light_wi = None
+        self.light_distance = 0.0
+        self.texture = None
+        self.texel = None
+
+    #Record the Hit that intersectRay returned for ray
+    def setHit(self, ray, hit):
+        self.hit = True
+        self.normal = hit.normal
+        self.local_hit = hit.local_hit
+        self.local_scale = hit.local_scale
+        self.texture = None
+        self.t = hit.t
+        self.mat = hit.material
+        self.hit_point = ray.o.addScaled(ray.d, hit.t)
 
 # #419end
\ No newline at end of file
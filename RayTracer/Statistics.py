@@ -0,0 +1,118 @@
+#Ray categories counted by RenderStats
+RAY_KINDS = ("primary", "shadow", "reflection", "refraction", "glossy")
+
+class RenderStats:
+    """
+    Counters of one render, kept per worker and merged when the tiles come back
+    Counters are plain ints that the hot loops add to once per query, so they
+    are always on
+
+    Attributes:
+        primary: rays shot from the camera
+        shadow: shadow rays
+        reflection: mirror reflection rays (and total internal reflection)
+        refraction: transmitted rays
+        glossy: glossy reflection rays
+        pruned: secondary rays not traced because of their path weight (see Tracer.spawn)
+        culled: primary rays not traced because the camera's pre-pass found no object over
+                their tile (see PerspectiveCamera.renderTile)
+        node_visits: acceleration structure nodes (octree, BVH and mesh BVH) a ray was tested against
+        primitive_tests: ray-object (and ray-triangle) intersection tests
+        last_hit_tests, last_hit_hits: primary rays the last hit object was tested for first,
+                                       and how many of them hit it (see World.hitObjects)
+        occluder_tests, occluder_hits: shadow rays a light's last occluder was tested for first,
+                                       and how many of them it blocked (see World.shadowHit)
+        hits: closest hits per object type name
+        seconds: wall time of the render
+    """
+    __slots__ = ("primary", "shadow", "reflection", "refraction", "glossy", "pruned", "culled",
+                 "node_visits", "primitive_tests", "last_hit_tests", "last_hit_hits",
+                 "occluder_tests", "occluder_hits", "hits", "seconds")
+
+    def __init__(self):
+        self.primary = 0
+        self.shadow = 0
+        self.reflection = 0
+        self.refraction = 0
+        self.glossy = 0
+        self.pruned = 0
+        self.culled = 0
+        self.node_visits = 0
+        self.primitive_tests = 0
+        self.last_hit_tests = 0
+        self.last_hit_hits = 0
+        self.occluder_tests = 0
+        self.occluder_hits = 0
+        self.hits = {}
+        self.seconds = 0.0
+
+    #Count a closest hit on an object
+    def addHit(self, object):
+        name = type(object).__name__
+        self.hits[name] = self.hits.get(name, 0) + 1
+
+    #Add the counts of another RenderStats (e.g. from a worker) to these
+    def merge(self, other):
+        self.primary += other.primary
+        self.shadow += other.shadow
+        self.reflection += other.reflection
+        self.refraction += other.refraction
+        self.glossy += other.glossy
+        self.pruned += other.pruned
+        self.culled += other.culled
+        self.node_visits += other.node_visits
+        self.primitive_tests += other.primitive_tests
+        self.last_hit_tests += other.last_hit_tests
+        self.last_hit_hits += other.last_hit_hits
+        self.occluder_tests += other.occluder_tests
+        self.occluder_hits += other.occluder_hits
+        for name, n in other.hits.items():
+            self.hits[name] = self.hits.get(name, 0) + n
+        return self
+
+    #Total number of rays of every kind
+    def totalRays(self):
+        return self.primary + self.shadow + self.reflection + self.refraction + self.glossy
+
+    #Share of the cached objects tested that were hit, by cache (None for a cache that wasn't used)
+    def cacheRates(self):
+        return {"last_hit": self.last_hit_hits / self.last_hit_tests if self.last_hit_tests else None,
+                "occluder": self.occluder_hits / self.occluder_tests if self.occluder_tests else None}
+
+    def report(self):
+        """ Returns: the counters as a dict (JSON serializable) """
+        rays = {kind: getattr(self, kind) for kind in RAY_KINDS}
+        rays["total"] = self.totalRays()
+        return {
+            "rays": rays,
+            "pruned": self.pruned,
+            "culled": self.culled,
+            "node_visits": self.node_visits,
+            "primitive_tests": self.primitive_tests,
+            "caches": {"last_hit": {"tests": self.last_hit_tests, "hits": self.last_hit_hits},
+                       "occluder": {"tests": self.occluder_tests, "hits": self.occluder_hits}},
+            "hits": dict(self.hits),
+            "seconds": self.seconds,
+            "rays_per_second": rays["total"] / self.seconds if self.seconds > 0 else 0.0,
+        }
+
+    def __str__(self):
+        r = self.report()
+        rays = ", ".join("{0} {1}".format(kind, r["rays"][kind]) for kind in RAY_KINDS)
+        hits = ", ".join("{0} {1}".format(name, n) for name, n in sorted(r["hits"].items()))
+        text = ("{0} rays ({1}, {2} pruned, {3} culled) in {4:.2f}s, {5:.0f} rays/s\n"
+                "{6} node visits, {7} primitive tests, hits: {8}").format(
+                    r["rays"]["total"], rays, r["pruned"], r["culled"], r["seconds"], r["rays_per_second"],
+                    r["node_visits"], r["primitive_tests"], hits or "none")
+        caches = ["{0} cache {1:.0%} of {2}".format(name.replace("_", " "), rate, r["caches"][name]["tests"])
+                  for name, rate in self.cacheRates().items() if rate != None]
+        if caches:
+            text += "\n" + ", ".join(caches)
+        return text
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
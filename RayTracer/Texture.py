@@ -0,0 +1,174 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from Constants import *
+
+#Round a float array of 0-255 values to a contiguous uint8 array
+def _bytes(level):
+    return np.ascontiguousarray(np.clip(np.rint(level), 0, 255), dtype=np.uint8)
+
+class MipMap:
+    def __init__(self, image):
+        """
+        An image as RGB arrays, full size and halved down to 1x1
+        Takes in a PIL image or an (H, W, 3) array of 0-255 or 0-1 values (image)
+
+        Rows are stored top to bottom as in the image, u wraps around and v is clamped.
+        Texels are kept as uint8 like in the image, a quarter of the memory of floats.
+
+        Attributes:
+            levels: (H, W, 3) uint8 arrays, level 0 is the image
+            sizes: (width, height) of every level
+            flat: flat view of every level, indexed as 3*(row*width + column)
+            nbytes: bytes held by the levels
+        """
+        if isinstance(image, Image.Image):
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            #One copy of the decoded bytes, not the two np.asarray makes
+            level = np.frombuffer(image.tobytes(), dtype=np.uint8).reshape(image.size[1], image.size[0], 3)
+        else:
+            level = np.asarray(image)[:, :, :3]
+            if level.dtype != np.uint8:
+                level = np.asarray(level, dtype=np.float32)
+                level = _bytes(level * 255.0 if level.max() <= 1.0 else level)
+        level = np.ascontiguousarray(level)
+        self.levels = [level]
+        while level.shape[0] > 1 or level.shape[1] > 1:
+            #Repeat the last row or column of odd sizes, then average 2x2 blocks (rounded)
+            h, w = level.shape[:2]
+            if h % 2 and h > 1:
+                level = np.concatenate((level, level[-1:]), axis=0)
+            if w % 2 and w > 1:
+                level = np.concatenate((level, level[:, -1:]), axis=1)
+            if level.shape[0] > 1:
+                level = level[0::2].astype(np.uint16) + level[1::2]
+            else:
+                level = level.astype(np.uint16) * 2
+            if level.shape[1] > 1:
+                level = level[:, 0::2] + level[:, 1::2]
+            else:
+                level = level * 2
+            level = ((level + 2) // 4).astype(np.uint8)
+            self.levels.append(level)
+        self.sizes = [(lv.shape[1], lv.shape[0]) for lv in self.levels]
+        self.nbytes = sum(lv.nbytes for lv in self.levels)
+        self.flat = [lv.reshape(-1).data for lv in self.levels]
+
+    #The flat views can't be pickled, so they are remade after a copy
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["flat"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.flat = [lv.reshape(-1).data for lv in self.levels]
+
+    #Texel (r, g, b) in 0-1 at column, row of level 0
+    def texel(self, column, row):
+        k = 3*(row*self.sizes[0][0] + column)
+        T = self.flat[0]
+        return T[k]/255.0, T[k+1]/255.0, T[k+2]/255.0
+
+    def bilinear(self, level, u, v):
+        """ Returns: the (r, g, b) in 0-1 of level at (u, v), interpolated between the 4 nearest texels """
+        w, h = self.sizes[level]
+        T = self.flat[level]
+        x = u*w - 0.5
+        y = v*h - 0.5
+        x0 = math.floor(x)
+        y0 = math.floor(y)
+        fx = x - x0
+        fy = y - y0
+        x1 = (x0 + 1) % w
+        x0 = x0 % w
+        y1 = min(y0 + 1, h - 1)
+        y0 = max(y0, 0)
+        a = 3*(y0*w + x0)
+        b = 3*(y0*w + x1)
+        c = 3*(y1*w + x0)
+        d = 3*(y1*w + x1)
+        #Weights include the 1/255 from bytes to 0-1
+        w00 = (1.0 - fx)*(1.0 - fy)/255.0
+        w01 = fx*(1.0 - fy)/255.0
+        w10 = (1.0 - fx)*fy/255.0
+        w11 = fx*fy/255.0
+        return (T[a]*w00 + T[b]*w01 + T[c]*w10 + T[d]*w11,
+                T[a+1]*w00 + T[b+1]*w01 + T[c+1]*w10 + T[d+1]*w11,
+                T[a+2]*w00 + T[b+2]*w01 + T[c+2]*w10 + T[d+2]*w11)
+
+    def trilinear(self, lod, u, v):
+        """ Returns: the (r, g, b) at (u, v) blended between the two levels around lod """
+        top = len(self.levels) - 1
+        if lod <= 0.0:
+            return self.bilinear(0, u, v)
+        if lod >= top:
+            return self.bilinear(top, u, v)
+        level = int(lod)
+        f = lod - level
+        r0, g0, b0 = self.bilinear(level, u, v)
+        r1, g1, b1 = self.bilinear(level + 1, u, v)
+        return r0 + (r1 - r0)*f, g0 + (g1 - g0)*f, b0 + (b1 - b0)*f
+
+
+class TextureCache:
+    def __init__(self, max_bytes = TEXTURE_CACHE_MB * 1024 * 1024):
+        """
+        Process wide cache of MipMaps by image file, least recently used ones are dropped
+        when the cache holds more than max_bytes (the one just loaded is always kept).
+        A texture still used by a material stays in memory until the material is gone.
+
+        Attributes:
+            max_bytes: size the cache is kept under
+            entries: absolute path -> (modification time, MipMap), least recently used first
+            nbytes: bytes held by the cached MipMaps
+            hits, misses: lookups answered from the cache and loads
+            lock: guards entries, render threads share the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """ Returns: the MipMap of the image at path, loaded again if the file changed """
+        key = os.path.abspath(path)
+        mtime = os.stat(key).st_mtime_ns
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry[0] == mtime:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        with Image.open(key) as image:
+            mipmap = MipMap(image)
+        with self.lock:
+            self.misses += 1
+            old = self.entries.pop(key, None)
+            if old != None:
+                self.nbytes -= old[1].nbytes
+            self.entries[key] = (mtime, mipmap)
+            self.nbytes += mipmap.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                dropped = self.entries.popitem(last=False)[1][1]
+                self.nbytes -= dropped.nbytes
+        return mipmap
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+#The texture cache of this process
+TEXTURES = TextureCache()
+
+#MipMap of an image file, from the process wide cache
+def loadTexture(path):
+    return TEXTURES.get(path)
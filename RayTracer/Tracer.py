@@ -1,4 +1,5 @@
-﻿from Utilities import *
+﻿import random
+from Utilities import *
 from ShadeRec import *
 from Constants import *
 
@@ -7,37 +8,115 @@ class Tracer:
     def __init__(self, world):
         self.world = world
 
-    def trace(self, ray, depth):
+    def trace(self, ray, depth, weight = 1.0):
         pass
 
+    #Shade the hit in sr
+    def shadeHit(self, sr):
+        pass
+
+    #The direct lighting of the hit in sr (the stage GBuffer.reshade runs again)
+    def shadeDirect(self, sr):
+        pass
+
+    #Add the light of the secondary rays of the hit in sr to its direct lighting L
+    def shadeSecondary(self, sr, L):
+        pass
+
+    #Shade a primary hit in sr while the world captures a GBuffer, which keeps the light of its secondary rays
+    def shadeCaptured(self, sr):
+        L = self.shadeDirect(sr)
+        direct = Color(L.r, L.g, L.b)
+        L = self.shadeSecondary(sr, L)
+        self.world.capture.setSecondary(L - direct)
+        return L
+
+    def spawn(self, sr, ray, scale, kind):
+        """
+        Trace a secondary ray of the material hit at sr
+        Takes in:
+            The ray (ray) and how much the material scales its color by (scale),
+            the largest channel of the BRDF with the cosine and pdf in it
+            The RenderStats counter of the ray (kind), e.g. "reflection"
+        Rays past the material's max_depth aren't traced. Rays whose path weight (sr.weight
+        times scale) is below the world's prune_threshold are dropped, or with "roulette"
+        dropped at random and the survivors' color scaled up to make up for the rest
+        Returns: the color of the ray
+        """
+        if sr.depth >= sr.mat.max_depth:
+            return Color(0.0, 0.0, 0.0)
+        w = self.world
+        weight = sr.weight * scale
+        boost = 1.0
+        if weight < w.prune_threshold and w.prune != "off":
+            #Survives with probability weight / threshold
+            if w.prune == "cutoff" or random.random() * w.prune_threshold >= weight:
+                w.stats.pruned += 1
+                return Color(0.0, 0.0, 0.0)
+            boost = w.prune_threshold / weight
+            weight = w.prune_threshold
+        setattr(w.stats, kind, getattr(w.stats, kind) + 1)
+        color = self.trace(ray, sr.depth + 1, weight)
+        if boost != 1.0:
+            color = color.scale(boost)
+        return color
+
 #Non-Area Light Tracer
 class RayCast(Tracer):
     #Shoot ray, return color that should be drawn
-    def trace(self, ray, depth):
+    def trace(self, ray, depth, weight = 1.0):
         #Check if hit any objects
-        sr = self.world.hitObjects(ray)
+        sr = self.world.hitObjects(ray, depth == 0)
+        if depth == 0 and self.world.capture != None:
+            self.world.capture.add(sr, ray)
         if sr.hit:
             sr.depth = depth
+            sr.weight = weight
             sr.ray = ray
-            return sr.mat.shade(sr)
+            if depth == 0 and self.world.capture != None:
+                return self.shadeCaptured(sr)
+            return self.shadeHit(sr)
         else:
             return self.world.background
 
+    def shadeHit(self, sr):
+        return sr.mat.shade(sr)
+
+    def shadeDirect(self, sr):
+        return sr.mat.shadeDirect(sr)
+
+    def shadeSecondary(self, sr, L):
+        return sr.mat.shadeSecondary(sr, L)
+
 #Area Light Tracer
 class AreaLighting(Tracer):
     #Shoot ray, return color that should be drawn
-    def trace(self, ray, depth):
+    def trace(self, ray, depth, weight = 1.0):
         #If the depth is larger than max reflection depth (in Constants)
         if (depth > RAYDEPTH):
             return Color(0.0, 0.0, 0.0)
         else:
             #Check if hit any objects
-            sr = self.world.hitObjects(ray)
+            sr = self.world.hitObjects(ray, depth == 0)
+            if depth == 0 and self.world.capture != None:
+                self.world.capture.add(sr, ray)
             if sr.hit:
                 sr.depth = depth
+                sr.weight = weight
                 sr.ray = ray
-                return sr.mat.areaLightShade(sr)
+                if depth == 0 and self.world.capture != None:
+                    return self.shadeCaptured(sr)
+                return self.shadeHit(sr)
             else:
                 return self.world.background
 
+    def shadeHit(self, sr):
+        return sr.mat.areaLightShade(sr)
+
+    def shadeDirect(self, sr):
+        return sr.mat.areaLightDirect(sr)
+
+    def shadeSecondary(self, sr, L):
+        return sr.mat.areaLightSecondary(sr, L)
+
 # #419end
\ No newline at end of file
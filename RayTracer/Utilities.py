@@ -1,7 +1,27 @@
 ﻿import math
+from array import array
 import Constants
 
+#1/d, with a huge finite value for d == 0 so slab tests stay free of nan
+def safeInverse(d):
+    if d == 0.0:
+        return 1e30
+    return 1.0 / d
+
+#Summed surface area of boxes stored as 6 floats each (lower xyz, upper xyz), empty boxes count 0
+def boundsArea(bounds):
+    total = 0.0
+    for k in range(0, len(bounds), 6):
+        dx = bounds[k+3] - bounds[k]
+        dy = bounds[k+4] - bounds[k+1]
+        dz = bounds[k+5] - bounds[k+2]
+        if dx >= 0 and dy >= 0 and dz >= 0:
+            total += 2.0 * (dx*dy + dy*dz + dz*dx)
+    return total
+
 class Ray():
+    __slots__ = ("o", "d")
+
     def __init__(self, origin, direction):
         """
         Attributes:
@@ -12,18 +32,20 @@ class Ray():
         self.d = direction
 
 class Point():
+    __slots__ = ("x", "y", "z")
+    #w value (for Matrix Mult), the same for every point
+    w = 1
+
     def __init__(self, x, y, z):
         """
         Attributes:
             x: x value of point
             y: y value of point
             z: z value of point
-            w: w value (for Matrix Mult)
         """
         self.x = x
         self.y = y
         self.z = z
-        self.w = 1
 
     #Add with another point, vector, or scalar
     def __add__(self, other):
@@ -48,6 +70,14 @@ class Point():
     def __truediv__(self, other):
         return Point(self.x / other, self.y / other, self.z / other)
 
+    #Return self + v*s (e.g. a point along a ray) without temporaries
+    def addScaled(self, v, s):
+        return Point(self.x + v.x*s, self.y + v.y*s, self.z + v.z*s)
+
+    #Return the Vector from other to self, no type check
+    def diff(self, other):
+        return Vector(self.x - other.x, self.y - other.y, self.z - other.z)
+
     #returns distance between two points
     def distance(self, other):
         return math.sqrt((self.x - other.x)*(self.x - other.x)
@@ -61,18 +91,20 @@ class Point():
                      matrix.m[8]*self.x + matrix.m[9]*self.y + matrix.m[10]*self.z + matrix.m[11])
 
 class Vector():
+    __slots__ = ("x", "y", "z")
+    #w value (for Matrix Mult), the same for every vector
+    w = 0
+
     def __init__(self, x, y, z):
         """
         Attributes:
             x: x value of vector
             y: y value of vector
             z: z value of vector
-            w: w value (for Matrix Mult)
         """
         self.x = x
         self.y = y
         self.z = z
-        self.w = 0
 
     #Add with another vector or scalar
     def __add__(self, other):
@@ -102,6 +134,22 @@ class Vector():
     def __truediv__(self, other):
         return Vector(self.x / other, self.y / other, self.z / other)
 
+    #Negate
+    def __neg__(self):
+        return Vector(-self.x, -self.y, -self.z)
+
+    #Return dot of two vectors, no type check
+    def dot(self, other):
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    #Return vector times scalar, no type check
+    def scale(self, s):
+        return Vector(self.x * s, self.y * s, self.z * s)
+
+    #Return self + v*s without temporaries
+    def addScaled(self, v, s):
+        return Vector(self.x + v.x*s, self.y + v.y*s, self.z + v.z*s)
+
     #Return cross of two vectors
     def cross(self, other):
         return Vector(self.y * other.z - self.z * other.y, self.z * other.x - self.x * other.z, self.x * other.y - self.y * other.x)
@@ -125,9 +173,12 @@ class Vector():
                      matrix.m[8]*self.x + matrix.m[9]*self.y + matrix.m[10]*self.z)
 
 class Matrix():
-    #m: list of 16 floats that make up 4x4 matrix
+    __slots__ = ("m",)
+
+    #m: array of 16 doubles that make up 4x4 matrix, row by row
+    #(an array rather than a list of floats, instances each keep two matrices)
     def __init__(self, x1, y1, z1, w1, x2, y2, z2, w2, x3, y3, z3, w3, x4, y4, z4, w4):
-        self.m = [x1, y1, z1, w1, x2, y2, z2, w2, x3, y3, z3, w3, x4, y4, z4, w4]
+        self.m = array('d', (x1, y1, z1, w1, x2, y2, z2, w2, x3, y3, z3, w3, x4, y4, z4, w4))
 
     #Create a translation matrix by (x,y,z)
     def Translate(x, y, z):
@@ -169,18 +220,27 @@ class Matrix():
             0, 0, 0, 1)
 
      
-    #Matrix multiplication
+    #Matrix multiplication (other times self, written out)
     def __mul__(self, other):
-        product = Matrix(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-
-        for y in range(4):
-            for x in range(4):
-                sum = 0.0
-                for j in range(4):
-                    sum += self.m[x+j*4] * other.m[j+y*4]
-
-                product.m[x+y*4] = sum
-        return product
+        a = self.m
+        b = other.m
+        return Matrix(
+            b[0]*a[0] + b[1]*a[4] + b[2]*a[8] + b[3]*a[12],
+            b[0]*a[1] + b[1]*a[5] + b[2]*a[9] + b[3]*a[13],
+            b[0]*a[2] + b[1]*a[6] + b[2]*a[10] + b[3]*a[14],
+            b[0]*a[3] + b[1]*a[7] + b[2]*a[11] + b[3]*a[15],
+            b[4]*a[0] + b[5]*a[4] + b[6]*a[8] + b[7]*a[12],
+            b[4]*a[1] + b[5]*a[5] + b[6]*a[9] + b[7]*a[13],
+            b[4]*a[2] + b[5]*a[6] + b[6]*a[10] + b[7]*a[14],
+            b[4]*a[3] + b[5]*a[7] + b[6]*a[11] + b[7]*a[15],
+            b[8]*a[0] + b[9]*a[4] + b[10]*a[8] + b[11]*a[12],
+            b[8]*a[1] + b[9]*a[5] + b[10]*a[9] + b[11]*a[13],
+            b[8]*a[2] + b[9]*a[6] + b[10]*a[10] + b[11]*a[14],
+            b[8]*a[3] + b[9]*a[7] + b[10]*a[11] + b[11]*a[15],
+            b[12]*a[0] + b[13]*a[4] + b[14]*a[8] + b[15]*a[12],
+            b[12]*a[1] + b[13]*a[5] + b[14]*a[9] + b[15]*a[13],
+            b[12]*a[2] + b[13]*a[6] + b[14]*a[10] + b[15]*a[14],
+            b[12]*a[3] + b[13]*a[7] + b[14]*a[11] + b[15]*a[15])
 
     #Scalar division by other
     def divide(self, other):
@@ -198,6 +258,8 @@ class Matrix():
 
 
 class Color():
+    __slots__ = ("r", "g", "b")
+
     def __init__(self, r, g, b):
         """
         Attributes:
@@ -235,17 +297,80 @@ class Color():
     def __truediv__(self, other):
         return Color(self.r/other, self.g/other, self.b/other)
 
+    #In place versions for accumulating (L += ..., color /= ...), only use them on colors you own
+    def __iadd__(self, other):
+        self.r += other.r
+        self.g += other.g
+        self.b += other.b
+        return self
+
+    def __imul__(self, other):
+        if isinstance(other, Color):
+            self.r *= other.r
+            self.g *= other.g
+            self.b *= other.b
+        else:
+            self.r *= other
+            self.g *= other
+            self.b *= other
+        return self
+
+    def __itruediv__(self, other):
+        self.r /= other
+        self.g /= other
+        self.b /= other
+        return self
+
+    #self += other * s in place, without temporaries
+    def accumulate(self, other, s = 1.0):
+        self.r += other.r * s
+        self.g += other.g * s
+        self.b += other.b * s
+        return self
+
+    #Return color times scalar, no type check
+    def scale(self, s):
+        return Color(self.r * s, self.g * s, self.b * s)
+
+    #Return the product of two colors, no type check
+    def modulate(self, other):
+        return Color(self.r * other.r, self.g * other.g, self.b * other.b)
+
+    #Largest of r, g and b
+    def maxComponent(self):
+        return max(self.r, self.g, self.b)
+
 
-#NOT USED
 # #419begin #type=3 #src= Ray Trace Ground Up
 class Bbox():
-    def __init__(self):
-        self.l = Point(-1.0, -1.0, -1.0)
-        self.u = Point(1.0, 1.0, 1.0)
+    __slots__ = ("l", "u")
 
-    def __init__(self, p0, p1):
-        self.l = p0
-        self.u = p1
+    def __init__(self, p0 = None, p1 = None):
+        """
+        Axis aligned bounding box
+        Attributes:
+            l: lower corner
+            u: upper corner
+        """
+        self.l = p0 if p0 != None else Point(-1.0, -1.0, -1.0)
+        self.u = p1 if p1 != None else Point(1.0, 1.0, 1.0)
+
+    #Box holding all the given points
+    def fromPoints(points):
+        return Bbox(Point(min(p.x for p in points), min(p.y for p in points), min(p.z for p in points)),
+                    Point(max(p.x for p in points), max(p.y for p in points), max(p.z for p in points)))
+
+    #Box holding this box and other
+    def union(self, other):
+        return Bbox(Point(min(self.l.x, other.l.x), min(self.l.y, other.l.y), min(self.l.z, other.l.z)),
+                    Point(max(self.u.x, other.u.x), max(self.u.y, other.u.y), max(self.u.z, other.u.z)))
+
+    #Surface area of the box
+    def area(self):
+        dx = self.u.x - self.l.x
+        dy = self.u.y - self.l.y
+        dz = self.u.z - self.l.z
+        return 2.0 * (dx*dy + dy*dz + dz*dx)
 
     def getPoints(self):
         return [
@@ -261,15 +386,20 @@ class Bbox():
         
 
     def hit(self, ray):
-        t1 = (self.l.x - ray.o.x)/ray.d.x
-        t2 = (self.u.x - ray.o.x)/ray.d.x
-        t3 = (self.l.y - ray.o.y)/ray.d.y
-        t4 = (self.u.y - ray.o.y)/ray.d.y
-        t5 = (self.l.z - ray.o.z)/ray.d.z
-        t6 = (self.u.z - ray.o.z)/ray.d.z
-        tmin = max(max(min(t1, t2), min(t3, t4)), min(t5, t6))
-        tmax = min(min(max(t1, t2), max(t3, t4)), max(t5, t6))
-        return (tmin < tmax and tmax > kEpsilon)
+        tmin = -Constants.BIGTIME
+        tmax = Constants.BIGTIME
+        #Slabs the ray is parallel to only bound it if the origin is inside them
+        for o, d, l, u in ((ray.o.x, ray.d.x, self.l.x, self.u.x),
+                           (ray.o.y, ray.d.y, self.l.y, self.u.y),
+                           (ray.o.z, ray.d.z, self.l.z, self.u.z)):
+            if d != 0:
+                t1 = (l - o)/d
+                t2 = (u - o)/d
+                tmin = max(tmin, min(t1, t2))
+                tmax = min(tmax, max(t1, t2))
+            elif o < l or o > u:
+                return False
+        return (tmin < tmax and tmax > Constants.kEpsilon)
     
     def inside(self, p):
         return ((p.x > self.l.x and p.x < self.u.x) and (p.y > self.l.y and p.y < self.u.y) and (p.z > self.l.z and p.z < self.u.z))
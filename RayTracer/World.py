@@ -1,11 +1,17 @@
-﻿import math
+﻿import copy
+import math
+from BVH import *
 from Camera import *
 from Constants import *
 from GeometricObjects import *
 from Light import *
 from Material import *
+from Mesh import *
+from OBJLoader import *
 from Octree import *
+from RayPacket import *
 from Sampler import *
+from Statistics import *
 from ShadeRec import *
 from Tracer import *
 from Utilities import *
@@ -19,12 +25,12 @@ class World:
             objects: list of all objects
             lights: list of all lights
             camera: camera
-            rays: num of rays shot
+            stats: RenderStats of the rays this world (or worker view) traced
         """
         self.objects = []
         self.lights = []
         self.camera = None
-        self.rays = 0
+        self.stats = RenderStats()
         
     #Add light to list
     def addLight(self, light):
@@ -32,116 +38,233 @@ class World:
 
     #Add object to list (and put in Octree)
     def addObject(self, object):
-        #Add to tree
         self.objects.append(object)
-        self.tree.insertChild(self.tree.root, self.tree.root.s, self.tree.root, object)
-
-    #obj file reader
-    def OBJLoad(filename):
-        vertices = []
-        faces = []
-        for line in open(filename, "r"):
-            if line.startswith('#'): continue
-            values = line.split()
-            if not values: continue
-            if(values[0] == "v"):
-                v = Point(float(values[1]), float(values[2]), float(values[3]))
-                vertices.append(v)
-            if(values[0] == "f"):   
-                w = values[1].split('/')
-                u = values[2].split('/')
-                v = values[3].split('/')
-                f = np.array([int(w[0]), int(u[0]), int(v[0])]) 
-                faces.append(f)
-        return vertices, faces
+        self.footprints = None
+        if self.accel == "bvh":
+            #BVH is rebuilt from all objects the next time it is needed
+            self.bvh = None
+        else:
+            #Add to tree, its flat copy is redone the next time it is needed
+            self.tree.insertChild(self.tree.root, self.tree.root.s, self.tree.root, object)
+            self.flat = None
+
+    #Build the acceleration structure up front (e.g. before worker processes copy the world)
+    def buildAccel(self):
+        if self.accel == "bvh":
+            if self.bvh == None:
+                self.bvh = BVH(self.objects)
+        elif self.flat == None:
+            self.flat = self.tree.flatten()
+
+    def update(self, objects):
+        """
+        Tell the world that objects of it moved or changed size (e.g. from an Animation)
+        The acceleration structure is refit around them instead of rebuilt, until
+        refitting has grown its boxes past REFIT_LIMIT times their built size
+        Returns: "refit", "rebuild" or None if there was nothing built to update
+        """
+        self.footprints = None
+        if self.accel == "bvh":
+            if self.bvh == None:
+                return None
+            self.bvh.refit(objects)
+            if self.bvh.area() <= REFIT_LIMIT * self.bvh.built_area:
+                return "refit"
+            self.bvh = None
+            return "rebuild"
+
+        #Refit objects keep their old Octree cell until the tree is flattened again
+        for ob in objects:
+            self.moved[ob] = True
+        if self.flat != None:
+            self.flat.refit(objects)
+            if self.flat.area() <= REFIT_LIMIT * self.flat.built_area:
+                return "refit"
+        for ob in self.moved:
+            if self.tree.remove(ob):
+                self.tree.insertChild(self.tree.root, self.tree.root.s, self.tree.root, ob)
+        self.moved = {}
+        if self.flat == None:
+            return None
+        self.flat = None
+        return "rebuild"
+
+    #obj file reader, returns arrays of vertices and zero based faces (see loadOBJ)
+    def OBJLoad(self, filename, cache = True):
+        return loadOBJ(filename, cache)
+
+    #Load an OBJ file as one TriangleMesh and add it to the world
+    def loadMesh(self, filename, material, cache = True):
+        vertices, faces = self.OBJLoad(filename, cache)
+        mesh = TriangleMesh(vertices, faces, material)
+        self.addObject(mesh)
+        return mesh
 
     #Build the beginning of the World
-    def build(self, width, height, samples):
+    def build(self, width, height, samples, accel = ACCEL, world_size = WORLD_SIZE):
         """
         Attributes:
             width: width of viewport
             height: height of viewport
             samples: num of samples for viewport
+            sets: num of sample sets for viewport
+            accel: acceleration structure for hitObjects, "octree" or "bvh"
+            world_size: edge length of the Octree root (not tied to the resolution)
             tree: Octree of world Geometry
+            flat: flattened copy of tree that rays walk (built on first use)
+            bvh: BVH of world Geometry (built on first use)
+            moved: objects moved (see update) since they were put in the Octree
             view_port: world viewport
             background: background color
             tracer: Tracer for Primary rays
             ambient: Ambient Light of world
+            prune, prune_threshold: pruning of secondary rays (see PRUNE in Constants and Tracer.spawn)
+            coherence: use last_hit and occluders (see COHERENCE in Constants)
+            last_hit: object the last primary ray hit
+            occluders: light -> object that last blocked a shadow ray to it
+            footprints: the camera's visibility pre-pass of the objects (see PerspectiveCamera.footprints)
+            candidates: the objects the primary rays of the tile being traced can hit, with the
+                        footprints their origins must lie in (None for all, see PerspectiveCamera.tileCandidates)
+            capture: GBuffer the hits of primary rays are recorded in (None when not capturing)
+            tonemap: how the framebuffer is turned into an image (see TONEMAP in Constants)
+            framebuffer: Framebuffer of the last render (None before the first)
         """
-        s = samples
-        sets = 83
-        self.tree = Octree(width)
-        self.view_port = ViewPort(width, height, RAYDEPTH, samples, sets)
+        self.samples = samples
+        self.sets = 83
+        self.accel = accel
+        self.tree = Octree(world_size)
+        self.flat = None
+        self.bvh = None
+        self.moved = {}
+        self.view_port = ViewPort(width, height, RAYDEPTH, samples, self.sets)
         self.background = Color(0, 0, 0)
 
         self.tracer = AreaLighting(self)
         self.ambient = AmbientLight(0.4, Color(1.0, 1.0, 1.0))
+        self.prune = PRUNE
+        self.prune_threshold = PRUNE_THRESHOLD
+        self.coherence = COHERENCE
+        self.last_hit = None
+        self.occluders = {}
+        self.footprints = None
+        self.candidates = None
+        self.capture = None
+        self.tonemap = TONEMAP
+        self.framebuffer = None
+
+    #Render at another resolution, the objects and acceleration structures are kept
+    def setResolution(self, width, height):
+        self.view_port = ViewPort(width, height, RAYDEPTH, self.samples, self.sets)
 
     #Checks if ray hits Objects
-    def hitObjects(self, ray):
+    #Primary rays only test the candidates of their tile when the camera found few,
+    #otherwise they test the object the last one hit first, so the walk can skip everything behind it
+    def hitObjects(self, ray, primary = False):
         sr = ShadeRec(self)
+        self.buildAccel()
         tmin = BIGTIME
-        
-        #Acceleration
-        children = []
-        children.append(self.tree.root)
-        while(len(children) != 0):
-            node = children[0]
-            if node != None:
-                #Not a leaf
-                if node.leaf == False:
-                    if node.intersectRay(ray) and node.t < tmin:
-                        #Add children
-                        for c in node.children:
-                            children.append(c)
-                        #Check objects (if any)
-                        if node.o.count != 0:
-                            for object in node.o:
-                                #Check hit
-                                if object.intersectRay(ray, sr) and object.t < tmin:
-                                    sr.hit = True
-                                    sr.normal = object.normal
-                                    sr.local_hit = object.local_hit
-                                    sr.t = object.t
-                                    sr.mat = object.material
-                                    sr.hit_point = ray.o + object.t * ray.d
-                                    tmin = object.t
-                #Leaf Node, so no children to add
-                elif node.leaf:
-                    if node.intersectRay(ray) and node.t < tmin:
-                        #Check objects (if any)
-                        if node.o.count != 0:
-                            for object in node.o:
-                                if object.intersectRay(ray, sr) and object.t < tmin:
-                                    sr.hit = True
-                                    sr.normal = object.normal
-                                    sr.local_hit = object.local_hit
-                                    sr.t = object.t
-                                    sr.mat = object.material
-                                    sr.hit_point = ray.o + object.t * ray.d
-                                    tmin = object.t
-            #Done checking current node, so remove it
-            children.remove(node)
+        closest = None
+        if primary and self.candidates != None:
+            ox = ray.o.x
+            oy = ray.o.y
+            tests = 0
+            for x0, y0, x1, y1, object in self.candidates:
+                if ox < x0 or ox > x1 or oy < y0 or oy > y1:
+                    continue
+                tests += 1
+                hit = object.intersectRay(ray, sr)
+                if hit and hit.t < tmin:
+                    sr.setHit(ray, hit)
+                    tmin = hit.t
+                    closest = object
+            self.stats.primitive_tests += tests
+            if closest != None:
+                self.stats.addHit(closest)
+            return sr
+        if primary and self.coherence and self.last_hit != None:
+            self.stats.last_hit_tests += 1
+            hit = self.last_hit.intersectRay(ray, sr)
+            if hit:
+                self.stats.last_hit_hits += 1
+                sr.setHit(ray, hit)
+                tmin = hit.t
+                closest = self.last_hit
+            else:
+                #A hit is counted by the walk, which then skips the object
+                self.stats.primitive_tests += 1
+        if self.accel == "bvh":
+            tmin, closest = self.bvh.hit(ray, sr, self.stats, tmin, closest)
+        else:
+            tmin, closest = self.flat.hit(ray, sr, self.stats, tmin, closest)
+        if primary and closest != None and closest.coherent:
+            self.last_hit = closest
 
         """
         #No Acceleration
+        tmin = BIGTIME
         for object in self.objects:
-            self.addRay()
-            if object.intersectRay(ray, sr) and object.t < tmin:
-                sr.hit = True
-                sr.normal = object.normal
-                sr.local_hit = object.local_hit
-                sr.t = object.t
-                sr.mat = object.material
-                sr.hit_point = ray.o + object.t * ray.d
-                tmin = object.t
+            hit = object.intersectRay(ray, sr)
+            if hit and hit.t < tmin:
+                sr.setHit(ray, hit)
+                tmin = hit.t
         """
         return sr
 
-    #Calls camera's renderScene function
-    def renderScene(self):
-        self.camera.renderScene(self)
+    #Checks if any object blocks a shadow ray before tmax (the distance to the light)
+    #Stops at the first blocking object, the one that last blocked a ray to light is tried first
+    def shadowHit(self, ray, tmax, light = None):
+        self.stats.shadow += 1
+        self.buildAccel()
+        if self.coherence and light != None:
+            occluder = self.occluders.get(light)
+            if occluder != None:
+                self.stats.occluder_tests += 1
+                self.stats.primitive_tests += 1
+                t = occluder.shadowHit(ray, self.stats)
+                if t != None and t < tmax:
+                    self.stats.occluder_hits += 1
+                    return True
+        if self.accel == "bvh":
+            blocked = self.bvh.shadowHit(ray, tmax, self.stats)
+        else:
+            blocked = self.flat.shadowHit(ray, tmax, self.stats)
+        if blocked == None:
+            return False
+        if self.coherence and light != None and blocked.coherent:
+            self.occluders[light] = blocked
+        return True
+
+    #Intersect a RayPacket with all objects at once
+    #Returns arrays of t, normals, hit mask and the index in self.objects of the closest object
+    def hitPacket(self, packet):
+        return intersectObjects(packet, self.objects)
+
+    #Shadow test for a RayPacket, tmax is the distance to the light for each ray
+    #Returns a mask of the blocked rays
+    def shadowPacket(self, packet, tmax):
+        return occludedObjects(packet, self.objects, tmax)
+
+    #Calls camera's renderScene function, tiles are traced by (workers) processes or threads
+    #The primary hits are captured in gbuffer when one is given, finished tiles are saved to checkpoint
+    #Returns the image and the RenderStats of the render, its linear colors are kept in self.framebuffer
+    def renderScene(self, workers = 1, tile_size = TILE_SIZE, backend = None, gbuffer = None, checkpoint = None):
+        self.buildAccel()
+        return self.camera.renderScene(self, workers, tile_size, backend, gbuffer, checkpoint)
+
+    #The framebuffer of the last render stays behind when the world is pickled for worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state.get("framebuffer") != None:
+            state["framebuffer"] = None
+        return state
 
-    #Add another ray to the count
-    def addRay(self):
-        self.rays += 1
+    #Shallow copy of the world for one render thread
+    #Shares objects, lights and acceleration structures, but has its own tracer, stats and coherence caches
+    def workerView(self):
+        self.buildAccel()
+        view = copy.copy(self)
+        view.stats = RenderStats()
+        view.tracer = type(self.tracer)(view)
+        view.last_hit = None
+        view.occluders = {}
+        return view
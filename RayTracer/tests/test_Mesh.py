@@ -0,0 +1,86 @@
+import math
+import os
+import pickle
+import random
+import sys
+import numpy as np
+import pytest
+
+#The modules of the ray tracer are imported flat, from the folder above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GeometricObjects import *
+from Mesh import *
+from Utilities import *
+
+
+def sphere(n, radius = 2.0):
+    """ Returns: vertices and faces of a UV sphere of n rings, with shared vertices """
+    vertices = []
+    for i in range(n + 1):
+        for j in range(2*n):
+            th, ph = math.pi*i/n, math.pi*j/n
+            vertices.append((radius*math.sin(th)*math.cos(ph), radius*math.cos(th), radius*math.sin(th)*math.sin(ph)))
+    faces = []
+    for i in range(n):
+        for j in range(2*n):
+            a = i*2*n + j
+            b = i*2*n + (j + 1) % (2*n)
+            faces.append((a, a + 2*n, b + 2*n))
+            faces.append((a, b + 2*n, b))
+    return np.array(vertices), np.array(faces)
+
+def triangles(mesh):
+    #The mesh's triangles as Triangle objects, from the same float32 vertices
+    points = [Point(*v) for v in mesh.vertices.astype(np.float64).tolist()]
+    return [Triangle(points[a], points[b], points[c], None) for a, b, c in mesh.faces.tolist()]
+
+def rays(count, seed = 7):
+    rnd = random.Random(seed)
+    for k in range(count):
+        o = Point(rnd.uniform(-6, 6), rnd.uniform(-6, 6), rnd.uniform(-6, 6))
+        target = Point(rnd.uniform(-2.5, 2.5), rnd.uniform(-2.5, 2.5), rnd.uniform(-2.5, 2.5))
+        d = target - o
+        yield Ray(o, d * (1.0 / d.length()))
+
+def closest(tris, ray):
+    best = None
+    for tri in tris:
+        hit = tri.intersectRay(ray, None)
+        if hit and (best == None or hit.t < best):
+            best = hit.t
+    return best
+
+def test_drops_triangles_without_area():
+    vertices, faces = sphere(6)
+    #The poles of a UV sphere give triangles with two equal corners
+    mesh = TriangleMesh(vertices, faces, None)
+    assert 0 < len(mesh) < len(faces)
+    assert mesh.vertices.shape == (len(vertices), 3)
+
+def test_hits_like_triangles():
+    vertices, faces = sphere(10)
+    mesh = TriangleMesh(vertices, faces, None, leaf_size = 2)
+    tris = triangles(mesh)
+    hits = 0
+    for ray in rays(400):
+        best = closest(tris, ray)
+        hit = mesh.intersectRay(ray, None)
+        t = mesh.shadowHit(ray)
+        if best == None:
+            assert hit == None and t == None
+        else:
+            hits += 1
+            assert hit != None and hit.t == pytest.approx(best, rel=1e-6)
+            assert t == pytest.approx(best, rel=1e-6)
+    assert hits > 100
+
+def test_pickled_copy_hits_the_same():
+    vertices, faces = sphere(8)
+    mesh = TriangleMesh(vertices, faces, None)
+    copy = pickle.loads(pickle.dumps(mesh))
+    for ray in rays(100, seed = 3):
+        a = mesh.intersectRay(ray, None)
+        b = copy.intersectRay(ray, None)
+        assert (a == None) == (b == None)
+        if a != None:
+            assert a.t == b.t
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import numpy as np
+import pytest
+
+#The modules of the ray tracer are imported flat, from the folder above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import OBJLoader
+from OBJLoader import *
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixture.obj")
+
+
+def lineOBJ(filename):
+    """
+    The per line OBJ reader loadOBJ replaced, with the fans and relative indices it gained
+    Returns: lists of vertices and of zero based triangles
+    """
+    vertices = []
+    faces = []
+    for line in open(filename, "r"):
+        if line.startswith('#'): continue
+        values = line.split()
+        if not values: continue
+        if(values[0] == "v"):
+            vertices.append([float(values[1]), float(values[2]), float(values[3])])
+        if(values[0] == "f"):
+            index = []
+            for corner in values[1:]:
+                i = int(corner.split('/')[0])
+                index.append(len(vertices) + i if i < 0 else i - 1)
+            for k in range(1, len(index) - 1):
+                faces.append([index[0], index[k], index[k+1]])
+    return vertices, faces
+
+
+@pytest.fixture
+def obj(tmp_path):
+    #A copy, so the caches are written next to it and not into the source tree
+    path = str(tmp_path / "fixture.obj")
+    shutil.copyfile(FIXTURE, path)
+    return path
+
+def test_matches_line_reader(obj):
+    vertices, faces = loadOBJ(obj, cache = False)
+    ref_vertices, ref_faces = lineOBJ(obj)
+    assert vertices.dtype == np.float32 and faces.dtype == np.int32
+    assert vertices.tolist() == np.array(ref_vertices, dtype=np.float32).tolist()
+    assert faces.tolist() == ref_faces
+    #6 quads, a pentagon and 2 triangles
+    assert faces.shape == (6*2 + 3 + 2, 3)
+    assert not os.path.exists(cachePath(obj))
+
+def test_cache_hit(obj, monkeypatch):
+    vertices, faces = loadOBJ(obj)
+    assert os.path.exists(cachePath(obj))
+
+    def parse(data):
+        raise AssertionError("the OBJ was parsed again instead of read from its cache")
+    monkeypatch.setattr(OBJLoader, "parseOBJ", parse)
+    cached_vertices, cached_faces = loadOBJ(obj)
+    assert np.array_equal(cached_vertices, vertices)
+    assert np.array_equal(cached_faces, faces)
+
+def test_stale_cache(obj):
+    loadOBJ(obj)
+    st = os.stat(obj)
+    #Same size, only the modification time tells the edit apart
+    with open(obj, "r") as f:
+        text = f.read()
+    with open(obj, "w") as f:
+        f.write(text.replace("f 14 15 16", "f 16 15 14"))
+    os.utime(obj, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    assert os.path.getsize(obj) == st.st_size
+    vertices, faces = loadOBJ(obj)
+    assert faces.tolist() == lineOBJ(obj)[1]
+    assert faces[-1].tolist() == [15, 14, 13]
+
+    #A longer file
+    with open(obj, "a") as f:
+        f.write("f 1 2 3\n")
+    vertices, faces = loadOBJ(obj)
+    assert faces.tolist() == lineOBJ(obj)[1]